@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Benchmark serial WebClient sends against the asyncio send engine.
+
+Both paths post the same batch to a local Slack stub, so no workspace or
+network access is needed:
+    python -m benchmarks.async_send --messages 5000 --latency 0.05 --concurrency 50
+
+Exits non-zero if any async send fails, since the timing of a run that
+did not send is meaningless.
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+import django
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial and async Slack dispatch throughput')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated Slack response time in seconds')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--skip-serial', action='store_true', help='Only time the async engine')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+    # Measure the send engine itself, not the per-channel pacing
+    os.environ.setdefault('SLACK_RATE_LIMIT_ENABLED', 'False')
+    django.setup()
+
+    from slack_sdk import WebClient
+    from scheduler.async_dispatch import send_messages_async
+    from benchmarks.slack_stub import start_stub_server
+
+    server = start_stub_server(latency=args.latency)
+    # The attributes of a claimed ScheduledMessage that the send engine reads
+    messages = [
+        SimpleNamespace(
+            id=i, team_id='', idempotency_key=None, channel=f"C{i % 100:08d}", message=f"Benchmark message {i}", blocks=None
+        )
+        for i in range(args.messages)
+    ]
+
+    if not args.skip_serial:
+        client = WebClient(token='xoxb-benchmark', base_url=server.base_url)
+        started = time.perf_counter()
+        for message in messages:
+            client.chat_postMessage(channel=message.channel, text=message.message)
+        elapsed = time.perf_counter() - started
+        print(f"serial: {len(messages)} messages in {elapsed:.2f}s ({len(messages) / elapsed:.1f} msg/s)")
+
+    started = time.perf_counter()
+    results = send_messages_async(messages, concurrency=args.concurrency, base_url=server.base_url)
+    elapsed = time.perf_counter() - started
+    errors = [error for _, success, error in results if not success]
+    print(
+        f"async (concurrency {args.concurrency}): {len(messages)} messages in {elapsed:.2f}s "
+        f"({len(messages) / elapsed:.1f} msg/s, {len(errors)} failed)"
+    )
+
+    server.shutdown()
+    if errors:
+        sys.exit(f"{len(errors)} of {len(messages)} async sends failed, first error: {errors[0]!r}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Time scheduling messages one POST at a time against POST /api/messages/bulk/.
+
+Requests go through Django's in-process test client, so the numbers cover
+routing, parsing, validation and the INSERTs but no network. Rows are
+written to the configured database and removed afterwards; run it against
+a scratch database (point DATABASE_URL at one), never production:
+    python manage.py migrate
+    python -m benchmarks.bulk_schedule --messages 2000
+"""
+import argparse
+import json
+import os
+import time
+from datetime import timedelta
+import django
+
+BENCH_CHANNEL = 'C0BENCHBULK'
+
+def build_payload(messages):
+    from django.utils import timezone
+
+    scheduled_time = timezone.now() + timedelta(days=7)
+    return [
+        {
+            'message': f"Campaign message {i}",
+            'channel': BENCH_CHANNEL,
+            'scheduled_time': (scheduled_time + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(messages)
+    ]
+
+def time_per_item(client, payload):
+    started = time.perf_counter()
+    for item in payload:
+        response = client.post('/api/messages/', item, format='json')
+        assert response.status_code == 201, response.content
+    return time.perf_counter() - started
+
+def time_bulk_json(client, payload):
+    started = time.perf_counter()
+    response = client.post('/api/messages/bulk/', payload, format='json')
+    assert response.status_code == 201, response.content
+    return time.perf_counter() - started
+
+def time_bulk_ndjson(client, payload):
+    body = '\n'.join(json.dumps(item) for item in payload)
+    started = time.perf_counter()
+    response = client.post('/api/messages/bulk/', body, content_type='application/x-ndjson')
+    assert response.status_code == 201, response.content
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-item POSTs with the bulk scheduling endpoint')
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    # Measure the API itself; no broker is needed
+    os.environ.setdefault('SCHEDULER_EVENT_DISPATCH', 'False')
+    django.setup()
+
+    from django.conf import settings
+    from rest_framework.test import APIClient
+    from scheduler.models import ScheduledMessage
+
+    if ScheduledMessage.objects.exclude(channel=BENCH_CHANNEL).exists():
+        parser.error('the scheduler table holds real messages; point DATABASE_URL at a scratch database')
+
+    settings.ALLOWED_HOSTS.append('testserver')
+    client = APIClient()
+    payload = build_payload(args.messages)
+
+    try:
+        for label, run in (
+            ('per-item POST', time_per_item),
+            ('bulk JSON array', time_bulk_json),
+            ('bulk NDJSON', time_bulk_ndjson),
+        ):
+            elapsed = run(client, payload)
+            print(f"{label}: {args.messages} messages in {elapsed:.2f}s ({args.messages / elapsed:.0f} msg/s)")
+            ScheduledMessage.objects.filter(channel=BENCH_CHANNEL).delete()
+    finally:
+        ScheduledMessage.objects.filter(channel=BENCH_CHANNEL).delete()
+
+if __name__ == '__main__':
+    main()
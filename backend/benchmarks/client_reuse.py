@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Measure the per-send latency saved by reusing pooled Slack clients.
+
+Compares building a fresh WebClient for every chat.postMessage (a new TCP
+connection per call) with the shared client from scheduler.slack_clients
+(keep-alive connections). Against the local stub only TCP setup is saved;
+against slack.com each reused connection also skips a TLS handshake.
+    python -m benchmarks.client_reuse --messages 2000
+"""
+import argparse
+import os
+import statistics
+import time
+import django
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def time_sends(send, messages):
+    timings = []
+    for i in range(messages):
+        started = time.perf_counter()
+        send(f"C{i % 50:08d}", f"Benchmark message {i}")
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def report(label, timings):
+    print(
+        f"{label}: mean {statistics.mean(timings):.3f} ms, p50 {percentile(timings, 0.5):.3f} ms, "
+        f"p99 {percentile(timings, 0.99):.3f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-send latency with and without client reuse')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated Slack response time in seconds')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    django.setup()
+
+    from django.conf import settings
+    from slack_sdk import WebClient
+    from benchmarks.slack_stub import start_stub_server
+    from scheduler.slack_clients import get_client
+
+    server = start_stub_server(latency=args.latency)
+    settings.SLACK_API_BASE_URL = server.base_url
+    token = 'xoxb-benchmark'
+
+    def fresh_client_send(channel, text):
+        WebClient(token=token, base_url=server.base_url).chat_postMessage(channel=channel, text=text)
+
+    def pooled_client_send(channel, text):
+        get_client(token).chat_postMessage(channel=channel, text=text)
+
+    fresh = time_sends(fresh_client_send, args.messages)
+    pooled = time_sends(pooled_client_send, args.messages)
+    report('new client per send', fresh)
+    report('pooled shared client', pooled)
+    print(f"saved per send: {statistics.mean(fresh) - statistics.mean(pooled):.3f} ms (mean)")
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
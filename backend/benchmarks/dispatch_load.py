@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Load-test the dispatcher end to end against the local Slack stub.
+
+Seeds a table of scheduled messages, dispatches them against the stub
+(running in its own process, with configurable latency and 429 responses)
+and reports throughput, schedule lag, DB queries per message and peak RSS
+as JSON, so runs can be compared.
+
+Two modes:
+    drain   every message is due; one process_scheduled_messages() call
+            drains the backlog
+    runner  messages come due over --spread seconds and a
+            scheduler_runner-style loop dispatches them every --interval
+            seconds
+
+Schedule lag is measured from when a message came due, or from the start
+of the run if it was due before that, to when its outcome was written.
+
+``--small-tenants N`` adds N messages, each from its own workspace, seeded
+after the main backlog and due with its first messages, and reports their
+lag separately: with ``--fair`` claiming they go out in the first batch,
+with ``--oldest-first`` they wait for the backlog ahead of them.
+
+Rows are written to the configured database and removed afterwards; run it
+against a scratch database (point DATABASE_URL at one), never production:
+    python manage.py migrate
+    python -m benchmarks.dispatch_load --messages 100000 --latency 0.05 --backend async --output drain.json
+    python -m benchmarks.dispatch_load --mode runner --messages 10000 --spread 60 --interval 5
+    python -m benchmarks.dispatch_load --messages 20000 --small-tenants 20 --fair
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import timedelta
+import django
+
+from benchmarks.slack_stub import get_stub_stats, start_stub_process
+
+BENCH_CHANNEL_PREFIX = 'CBENCH'
+BENCH_TEAM_PREFIX = 'TBENCH'
+
+def seed(messages, channels, first_due, spread, chunk_size=10000):
+    """
+    Insert ``messages`` pending rows due evenly between ``first_due`` and ``first_due + spread``
+    """
+    from scheduler.models import ScheduledMessage
+
+    step = spread / messages if spread else 0
+    started = time.perf_counter()
+    for start in range(0, messages, chunk_size):
+        ScheduledMessage.objects.bulk_create([
+            ScheduledMessage(
+                message=f"Load test message {i}",
+                channel=f"{BENCH_CHANNEL_PREFIX}{i % channels:05d}",
+                scheduled_time=first_due + timedelta(seconds=i * step),
+            )
+            for i in range(start, min(start + chunk_size, messages))
+        ])
+    return time.perf_counter() - started
+
+def seed_small_tenants(count, due):
+    """
+    Insert one message for each of ``count`` workspaces, installed with a stub token
+    """
+    from scheduler.models import ScheduledMessage, SlackInstallation
+
+    SlackInstallation.objects.bulk_create([
+        SlackInstallation(team_id=f"{BENCH_TEAM_PREFIX}{n:05d}", bot_token='xoxb-benchmark')
+        for n in range(count)
+    ])
+    ScheduledMessage.objects.bulk_create([
+        ScheduledMessage(
+            message=f"Small tenant message {n}",
+            channel=f"{BENCH_CHANNEL_PREFIX}T{n:05d}",
+            team_id=f"{BENCH_TEAM_PREFIX}{n:05d}",
+            scheduled_time=due,
+        )
+        for n in range(count)
+    ])
+
+class QueryCounter:
+    """
+    Count queries run on the default connection, with or without DEBUG
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+def run_drain(dispatcher):
+    from scheduler.services import process_scheduled_messages
+
+    process_scheduled_messages(
+        backend=dispatcher.backend,
+        concurrency=dispatcher.concurrency,
+        batch_size=dispatcher.batch_size,
+        fair=dispatcher.fair
+    )
+    return 1
+
+def run_runner(dispatcher, interval, deadline):
+    """
+    The scheduler_runner.py loop, until nothing is left to send or time runs out
+    """
+    from django.utils import timezone
+    from scheduler.models import ScheduledMessage
+    from scheduler.recurrence import materialize_recurring_messages
+
+    ticks = 0
+    while time.monotonic() < deadline:
+        tick_started = time.monotonic()
+        materialize_recurring_messages()
+        dispatcher.run(now=timezone.now())
+        ticks += 1
+        if not ScheduledMessage.objects.filter(
+            channel__startswith=BENCH_CHANNEL_PREFIX,
+            status__in=['pending', 'sending']
+        ).exists():
+            break
+        time.sleep(max(0.0, interval - (time.monotonic() - tick_started)))
+    return ticks
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of already sorted ``values``
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+def collect_lags(rows, run_started):
+    lags = sorted(
+        (recorded_at - max(scheduled_time, run_started)).total_seconds()
+        for scheduled_time, recorded_at in rows.filter(
+            status='sent'
+        ).values_list('scheduled_time', 'updated_at').iterator(chunk_size=10000)
+    )
+    return {
+        'p50_s': percentile(lags, 0.50),
+        'p99_s': percentile(lags, 0.99),
+        'max_s': lags[-1] if lags else None,
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test scheduled message dispatch against a local Slack stub')
+    parser.add_argument('--mode', choices=['drain', 'runner'], default='drain')
+    parser.add_argument('--messages', type=int, default=10000, help='Rows to seed (10k to 1M)')
+    parser.add_argument('--channels', type=int, default=100, help='Distinct channels the messages are spread over')
+    parser.add_argument('--backend', choices=['sync', 'thread', 'async'], default=None, help='Defaults to SCHEDULER_DISPATCH_BACKEND')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None, help='Messages claimed per round trip')
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated Slack response time in seconds')
+    parser.add_argument('--ratelimit-ratio', type=float, default=0.0, help='Fraction of posts answered with 429 ratelimited')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    parser.add_argument('--spread', type=float, default=60.0, help='runner mode: seconds over which messages come due')
+    parser.add_argument('--lead', type=float, default=10.0, help='runner mode: seconds from seeding until the first message is due')
+    parser.add_argument('--interval', type=float, default=5.0, help='runner mode: seconds between dispatcher ticks')
+    parser.add_argument('--max-duration', type=float, default=3600.0, help='runner mode: give up after this many seconds')
+    parser.add_argument('--small-tenants', type=int, default=0, help='Extra one-message workspaces seeded behind the backlog')
+    parser.add_argument('--fair', action='store_const', const=True, default=None,
+                        help='Claim weighted-fair instead of oldest first')
+    parser.add_argument('--oldest-first', action='store_const', const=False, dest='fair',
+                        help='Claim oldest first instead of weighted-fair')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows afterwards')
+    args = parser.parse_args()
+
+    stub, base_url = start_stub_process(
+        latency=args.latency,
+        ratelimit_ratio=args.ratelimit_ratio,
+        retry_after=args.retry_after,
+        seed=0
+    )
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ['SLACK_API_BASE_URL'] = base_url
+    os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+    # Measure the dispatcher itself: no broker, no Redis, names are already IDs
+    os.environ.setdefault('SCHEDULER_EVENT_DISPATCH', 'False')
+    os.environ.setdefault('SLACK_RATE_LIMIT_ENABLED', 'False')
+    os.environ.setdefault('SLACK_CHANNEL_CACHE_ENABLED', 'False')
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.db.models import Count
+    from django.utils import timezone
+    from scheduler.dispatcher import Dispatcher
+    from scheduler.models import ScheduledMessage, SlackInstallation
+
+    if ScheduledMessage.objects.exclude(channel__startswith=BENCH_CHANNEL_PREFIX).exists():
+        parser.error('the scheduler table holds real messages; point DATABASE_URL at a scratch database')
+    bench_rows = ScheduledMessage.objects.filter(channel__startswith=BENCH_CHANNEL_PREFIX)
+    small_tenant_rows = bench_rows.filter(team_id__startswith=BENCH_TEAM_PREFIX)
+    bench_installations = SlackInstallation.objects.filter(team_id__startswith=BENCH_TEAM_PREFIX)
+    bench_rows.delete()
+    bench_installations.delete()
+
+    dispatcher = Dispatcher(
+        backend=args.backend,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        fair=args.fair
+    )
+    try:
+        if args.mode == 'drain':
+            first_due, spread = timezone.now() - timedelta(seconds=1), 0
+        else:
+            first_due, spread = timezone.now() + timedelta(seconds=args.lead), args.spread
+        print(f"Seeding {args.messages} messages...", file=sys.stderr)
+        seed_seconds = seed(args.messages, args.channels, first_due, spread)
+        seed_small_tenants(args.small_tenants, first_due)
+        rss_after_seed = peak_rss_mb()
+
+        print(f"Dispatching ({args.mode}, backend {dispatcher.backend})...", file=sys.stderr)
+        queries = QueryCounter()
+        run_started = timezone.now()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            if args.mode == 'drain':
+                ticks = run_drain(dispatcher)
+            else:
+                ticks = run_runner(dispatcher, args.interval, time.monotonic() + args.max_duration)
+        elapsed = time.perf_counter() - started
+        rss_after_run = peak_rss_mb()
+
+        counts = dict(bench_rows.values_list('status').annotate(count=Count('id')).order_by())
+        sent = counts.get('sent', 0)
+        report = {
+            'config': {
+                'mode': args.mode,
+                'messages': args.messages,
+                'channels': args.channels,
+                'backend': dispatcher.backend,
+                'concurrency': dispatcher.concurrency,
+                'batch_size': dispatcher.batch_size,
+                'fair': dispatcher.fair,
+                'small_tenants': args.small_tenants,
+                'latency_s': args.latency,
+                'ratelimit_ratio': args.ratelimit_ratio,
+                'retry_after_s': args.retry_after,
+                'spread_s': spread,
+                'interval_s': args.interval if args.mode == 'runner' else None,
+            },
+            'results': {
+                'seed_s': round(seed_seconds, 3),
+                'elapsed_s': round(elapsed, 3),
+                'ticks': ticks,
+                'statuses': counts,
+                # In runner mode throughput is capped by how fast messages come due
+                'messages_per_s': round(sent / elapsed, 1) if elapsed else None,
+                'schedule_lag': collect_lags(bench_rows, run_started),
+                'small_tenant_lag': collect_lags(small_tenant_rows, run_started) if args.small_tenants else None,
+                'db_queries': queries.count,
+                'db_queries_per_message': round(queries.count / sent, 3) if sent else None,
+                'peak_rss_mb': rss_after_run,
+                'peak_rss_after_seed_mb': rss_after_seed,
+                'stub': get_stub_stats(base_url),
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'metrics_enabled': settings.SCHEDULER_METRICS_ENABLED,
+            },
+        }
+    finally:
+        if not args.keep:
+            bench_rows.delete()
+            bench_installations.delete()
+        stub.terminate()
+
+    output = json.dumps(report, indent=2, default=str)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
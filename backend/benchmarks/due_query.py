@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Time the dispatcher's due-query with and without the due-message indexes.
+
+Seeds the configured database with a large history of sent rows and a small
+set of pending ones, then runs the claim query with the indexes from
+migration 0004 dropped and again with them in place. Run it against a
+scratch database (point DATABASE_URL at one), never production:
+    python manage.py migrate
+    python -m benchmarks.due_query --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+import django
+
+BENCH_CHANNEL = 'C0BENCHDUE'
+
+def seed(rows, pending_ratio, chunk_size=10000):
+    """
+    Insert benchmark rows until ``rows`` of them exist
+    """
+    from django.utils import timezone
+    from scheduler.models import ScheduledMessage
+
+    existing = ScheduledMessage.objects.filter(channel=BENCH_CHANNEL).count()
+    now = timezone.now()
+    remaining = rows - existing
+    print(f"Seeding {max(remaining, 0)} rows ({existing} already present)...")
+
+    started = time.perf_counter()
+    while remaining > 0:
+        batch = []
+        for _ in range(min(chunk_size, remaining)):
+            pending = random.random() < pending_ratio
+            offset = timedelta(minutes=random.randint(-60 * 24 * 365, 60 * 24 * 7 if pending else -1))
+            batch.append(ScheduledMessage(
+                message='Benchmark message body ' * 8,
+                channel=BENCH_CHANNEL,
+                scheduled_time=now + offset,
+                status='pending' if pending else random.choice(['sent', 'sent', 'sent', 'failed']),
+            ))
+        ScheduledMessage.objects.bulk_create(batch)
+        remaining -= len(batch)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+def time_due_query(repeat, batch_size):
+    """
+    Run the claim candidate query ``repeat`` times and return timings in ms
+    """
+    from django.utils import timezone
+    from scheduler.services import due_messages_queryset
+
+    timings = []
+    for _ in range(repeat):
+        queryset = due_messages_queryset(timezone.now()).order_by('scheduled_time', 'id')
+        started = time.perf_counter()
+        list(queryset.values_list('id', flat=True)[:batch_size])
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, queryset.values_list('id', flat=True)[:batch_size].explain()
+
+def report(label, timings, plan):
+    print(f"\n{label}")
+    print(f"  median {statistics.median(timings):.2f} ms, min {min(timings):.2f} ms, max {max(timings):.2f} ms")
+    print("  plan: " + plan.replace('\n', '\n        '))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the due-message query before and after indexing')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--pending-ratio', type=float, default=0.001)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows for later runs')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    django.setup()
+
+    from django.db import connection
+    from scheduler.models import ScheduledMessage
+
+    if ScheduledMessage.objects.exclude(channel=BENCH_CHANNEL).exists():
+        parser.error('the scheduler table holds real messages; point DATABASE_URL at a scratch database')
+
+    seed(args.rows, args.pending_ratio)
+    indexes = ScheduledMessage._meta.indexes
+
+    with connection.schema_editor() as schema_editor:
+        for index in indexes:
+            schema_editor.remove_index(ScheduledMessage, index)
+    try:
+        timings, plan = time_due_query(args.repeat, args.batch_size)
+        report(f"Without indexes ({connection.vendor})", timings, plan)
+    finally:
+        with connection.schema_editor() as schema_editor:
+            for index in indexes:
+                schema_editor.add_index(ScheduledMessage, index)
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ScheduledMessage._meta.db_table}")
+    timings, plan = time_due_query(args.repeat, args.batch_size)
+    report(f"With indexes ({connection.vendor})", timings, plan)
+
+    if not args.keep:
+        ScheduledMessage.objects.filter(channel=BENCH_CHANNEL).delete()
+
+if __name__ == '__main__':
+    main()
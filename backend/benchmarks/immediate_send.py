@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Load-test the immediate-send endpoints under gunicorn sync workers and uvicorn.
+
+Starts the app under each server in turn (same worker count, same Slack
+stub latency), fires concurrent ``POST /api/messages/<id>/send/`` requests
+and reports throughput, request latency and how many Slack calls each
+worker kept in flight. A gunicorn sync worker holds one request at a time,
+so it manages about one; an ASGI worker awaits Slack and keeps serving.
+
+Seeded messages use ``CBENCH`` channel IDs and are deleted afterwards; use a
+scratch database (point DATABASE_URL at one). SQLite serializes writes, so
+keep to one worker there:
+    python manage.py migrate
+    python -m benchmarks.immediate_send --requests 500 --concurrency 50 --latency 0.1
+    python -m benchmarks.immediate_send --endpoint send_slack_message --workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+import aiohttp
+import django
+
+from benchmarks.slack_stub import get_stub_stats, start_stub_process
+
+BENCH_CHANNEL_PREFIX = 'CBENCH'
+
+SERVERS = {
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'core.wsgi:application',
+        '--bind', f"127.0.0.1:{port}", '--workers', str(workers), '--timeout', '120',
+    ],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'core.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+        '--lifespan', 'off', '--no-access-log',
+    ],
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(name, workers, env):
+    port = free_port()
+    process = subprocess.Popen(SERVERS[name](port, workers), env=env, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"{name} did not start")
+            time.sleep(0.1)
+    return process, f"http://127.0.0.1:{port}"
+
+async def fire(base_url, endpoint, ids, concurrency):
+    """
+    POST one immediate send per id with at most ``concurrency`` in flight
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def post(session, i, message_id):
+        if endpoint == 'send':
+            url, body = f"{base_url}/api/messages/{message_id}/send/", {}
+        else:
+            url = f"{base_url}/api/messages/send_slack_message/"
+            body = {'channel': f"{BENCH_CHANNEL_PREFIX}{i % 100:05d}", 'message': f"Load test message {i}"}
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=body) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(session, i, message_id) for i, message_id in enumerate(ids)))
+        elapsed = time.perf_counter() - started
+    return elapsed, sorted(latencies), statuses
+
+def seed(count):
+    from django.utils import timezone
+    from scheduler.models import ScheduledMessage
+
+    messages = ScheduledMessage.objects.bulk_create([
+        ScheduledMessage(
+            message=f"Load test message {i}",
+            channel=f"{BENCH_CHANNEL_PREFIX}{i % 100:05d}",
+            scheduled_time=timezone.now() + timedelta(days=1),
+        )
+        for i in range(count)
+    ])
+    if messages and messages[0].pk is None:
+        # Backends that do not return primary keys from bulk inserts
+        return list(
+            ScheduledMessage.objects.filter(channel__startswith=BENCH_CHANNEL_PREFIX, status='pending')
+            .order_by('-id').values_list('id', flat=True)[:count]
+        )
+    return [message.pk for message in messages]
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 4)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare immediate sends per worker under gunicorn and uvicorn')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50, help='Requests the client keeps in flight')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes')
+    parser.add_argument('--latency', type=float, default=0.1, help='Simulated Slack response time in seconds')
+    parser.add_argument('--endpoint', choices=['send', 'send_slack_message'], default='send')
+    parser.add_argument('--servers', default='gunicorn,uvicorn', help='Comma-separated: gunicorn, uvicorn')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_process(latency=args.latency)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ['SLACK_API_BASE_URL'] = stub_url
+    os.environ.setdefault('SLACK_BOT_TOKEN', 'xoxb-benchmark')
+    os.environ.setdefault('DEBUG', 'False')
+    # Measure request handling, not pacing or name lookups; let each worker's pool fit every request
+    os.environ.setdefault('SLACK_RATE_LIMIT_ENABLED', 'False')
+    os.environ.setdefault('SLACK_CHANNEL_CACHE_ENABLED', 'False')
+    os.environ.setdefault('SLACK_HTTP_POOL_SIZE', str(args.concurrency))
+    os.environ.setdefault('SCHEDULER_METRICS_ENABLED', 'False')
+    django.setup()
+
+    from django.conf import settings
+    from scheduler.models import ScheduledMessage
+
+    if ScheduledMessage.objects.exclude(channel__startswith=BENCH_CHANNEL_PREFIX).exists():
+        parser.error('the scheduler table holds real messages; point DATABASE_URL at a scratch database')
+    bench_rows = ScheduledMessage.objects.filter(channel__startswith=BENCH_CHANNEL_PREFIX)
+
+    report = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'latency_s': args.latency,
+            'endpoint': args.endpoint,
+            'slack_pool_size': settings.SLACK_HTTP_POOL_SIZE,
+        },
+        'results': {},
+    }
+    try:
+        for name in args.servers.split(','):
+            bench_rows.delete()
+            ids = seed(args.requests) if args.endpoint == 'send' else [None] * args.requests
+            posts_before = get_stub_stats(stub_url)['posts']
+            print(f"Sending {args.requests} requests through {name}...", file=sys.stderr)
+            server, base_url = start_server(name, args.workers, dict(os.environ))
+            try:
+                elapsed, latencies, statuses = asyncio.run(fire(base_url, args.endpoint, ids, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+            throughput = args.requests / elapsed
+            report['results'][name] = {
+                'elapsed_s': round(elapsed, 3),
+                'statuses': statuses,
+                'requests_per_s': round(throughput, 1),
+                'latency': {'p50_s': percentile(latencies, 0.50), 'p99_s': percentile(latencies, 0.99)},
+                'slack_posts': get_stub_stats(stub_url)['posts'] - posts_before,
+                # Little's law: sends completed per second times how long each holds Slack
+                'concurrent_sends_per_worker': round(throughput * args.latency / args.workers, 1),
+            }
+    finally:
+        bench_rows.delete()
+        stub.terminate()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Local stub of the Slack Web API for offline benchmarking.
+
+Answers every ``POST /api/<method>`` with a canned successful response after
+an optional artificial delay. conversations.list pages through a generated
+set of channels named ``channel-<n>``; posts are kept (the most recent
+``HISTORY_SIZE`` per channel) and returned by conversations.history. A
+fraction of chat.postMessage calls can be answered with HTTP 429
+``ratelimited`` and a Retry-After, and ``GET /stats`` reports the counts. Point the app at it with
+``SLACK_API_BASE_URL=http://127.0.0.1:<port>/api/``.
+
+Run standalone with:
+    python -m benchmarks.slack_stub --port 8765 --latency 0.05 --ratelimit-ratio 0.01
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import urllib.request
+from urllib.parse import parse_qs
+
+HISTORY_SIZE = 1000
+
+class SlackStubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler that mimics a successful Slack Web API call
+    """
+    # Keep-alive, so clients that reuse connections can actually do so
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm plus delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Per-request access logs would dominate benchmark output
+        pass
+
+    def _read_params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if 'json' in content_type and raw:
+            return json.loads(raw)
+        return {key: values[0] for key, values in parse_qs(raw.decode('utf-8')).items()}
+
+    def _respond(self, status_code, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        params = self._read_params()
+        api_method = self.path.rstrip('/').rsplit('/', 1)[-1]
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        with self.server.lock:
+            self.server.request_count += 1
+            count = self.server.request_count
+            ratelimited = api_method == 'chat.postMessage' and self.server.random.random() < self.server.ratelimit_ratio
+            if ratelimited:
+                self.server.ratelimited_count += 1
+
+        if ratelimited:
+            self._respond(
+                429,
+                {'ok': False, 'error': 'ratelimited'},
+                headers={'Retry-After': str(self.server.retry_after)}
+            )
+            return
+
+        payload = {'ok': True}
+        if api_method == 'chat.postMessage':
+            payload.update(self._post_message(params))
+        elif api_method == 'conversations.list':
+            payload.update(self._list_channels(params))
+        elif api_method == 'conversations.history':
+            payload.update(self._channel_history(params))
+        payload['stub_request_count'] = count
+        self._respond(200, payload)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/stats':
+            self._respond(404, {'ok': False, 'error': 'unknown_method'})
+            return
+        with self.server.lock:
+            stats = {
+                'requests': self.server.request_count,
+                'ratelimited': self.server.ratelimited_count,
+                'posts': self.server.post_count,
+            }
+        self._respond(200, stats)
+
+    def _post_message(self, params):
+        message = {'type': 'message', 'text': params.get('text'), 'ts': f"{time.time():.6f}"}
+        if params.get('metadata'):
+            metadata = params['metadata']
+            message['metadata'] = json.loads(metadata) if isinstance(metadata, str) else metadata
+        with self.server.lock:
+            self.server.history[params.get('channel')].appendleft(message)
+            self.server.post_count += 1
+        return {'channel': params.get('channel'), 'ts': message['ts'], 'message': message}
+
+    def _channel_history(self, params):
+        # Newest first, like Slack; the cursor is the offset of the next page
+        oldest = float(params.get('oldest') or 0)
+        offset = int(params.get('cursor') or 0)
+        limit = int(params.get('limit') or 100)
+        include_metadata = str(params.get('include_all_metadata')).lower() in ('1', 'true')
+        with self.server.lock:
+            messages = [message for message in self.server.history[params.get('channel')] if float(message['ts']) > oldest]
+        page = [
+            message if include_metadata else {key: value for key, value in message.items() if key != 'metadata'}
+            for message in messages[offset:offset + limit]
+        ]
+        end = offset + len(page)
+        return {
+            'messages': page,
+            'has_more': end < len(messages),
+            'response_metadata': {'next_cursor': str(end) if end < len(messages) else ''},
+        }
+
+    def _list_channels(self, params):
+        # The cursor is simply the offset of the next page
+        offset = int(params.get('cursor') or 0)
+        limit = int(params.get('limit') or 100)
+        end = min(offset + limit, self.server.channels)
+        return {
+            'channels': [{'id': f"C{i:08d}", 'name': f"channel-{i}"} for i in range(offset, end)],
+            'response_metadata': {'next_cursor': str(end) if end < self.server.channels else ''},
+        }
+
+class SlackStubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server carrying the stub's configuration and counters
+    """
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs when a batch opens its connection pool
+    # at once, and every dropped SYN costs a one second retransmit
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, channels=1000, ratelimit_ratio=0.0, retry_after=1, seed=None):
+        super().__init__(address, SlackStubHandler)
+        self.latency = latency
+        self.channels = channels
+        self.ratelimit_ratio = ratelimit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+        self.request_count = 0
+        self.ratelimited_count = 0
+        self.post_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+def start_stub_server(host='127.0.0.1', port=0, latency=0.0, **kwargs):
+    """
+    Start the stub in a background thread and return the running server
+
+    ``port=0`` picks a free port; read it back from ``server.base_url``.
+    Other keyword arguments go to SlackStubServer.
+    """
+    server = SlackStubServer((host, port), latency=latency, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def _serve_stub(port, kwargs):
+    SlackStubServer(('127.0.0.1', port), **kwargs).serve_forever()
+
+def start_stub_process(**kwargs):
+    """
+    Start the stub in a child process and return ``(process, base_url)``
+
+    Keeps the stub off the benchmarked process's GIL. Keyword arguments go
+    to SlackStubServer.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = multiprocessing.Process(target=_serve_stub, args=(port, kwargs), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Slack stub did not start')
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}/api/"
+
+def get_stub_stats(base_url):
+    """
+    Request counters of a running stub
+    """
+    with urllib.request.urlopen(base_url.replace('/api/', '/stats')) as response:
+        return json.load(response)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local Slack Web API stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering each call')
+    parser.add_argument('--ratelimit-ratio', type=float, default=0.0, help='Fraction of chat.postMessage calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    args = parser.parse_args()
+
+    server = SlackStubServer(
+        (args.host, args.port),
+        latency=args.latency,
+        ratelimit_ratio=args.ratelimit_ratio,
+        retry_after=args.retry_after
+    )
+    print(f"Slack stub listening on {server.base_url} (latency {args.latency}s, ratelimit ratio {args.ratelimit_ratio})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
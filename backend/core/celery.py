@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_init
 from django.conf import settings
 
 # Set the default Django settings module
@@ -14,6 +15,12 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks from all registered Django apps
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    # Runs once in the parent process; prefork children write samples to PROMETHEUS_MULTIPROC_DIR
+    from scheduler.metrics import start_metrics_server
+    start_metrics_server()
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -206,10 +206,41 @@ CELERY_TIMEZONE = TIME_ZONE
 
 # Celery Beat settings
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Messages are sent by ETA tasks enqueued when they are saved; this sweep is the safety net
+SCHEDULER_EVENT_DISPATCH = os.getenv('SCHEDULER_EVENT_DISPATCH', 'True') == 'True'
+SCHEDULER_SWEEP_INTERVAL = int(os.getenv('SCHEDULER_SWEEP_INTERVAL', '300' if SCHEDULER_EVENT_DISPATCH else '60'))
+# Only messages due within this many seconds get an ETA task; it must stay below the broker visibility timeout
+SCHEDULER_EVENT_HORIZON = int(os.getenv('SCHEDULER_EVENT_HORIZON', '1800'))
+# Unacknowledged ETA tasks are redelivered after this; keep it well above the event horizon
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': max(3600, 2 * SCHEDULER_EVENT_HORIZON),
+}
+# Immediate sends in async mode run on their own queue; give it a dedicated worker
+# (celery -A core worker -Q immediate) so sweeps and timed sends never delay them
+SCHEDULER_IMMEDIATE_QUEUE = os.getenv('SCHEDULER_IMMEDIATE_QUEUE', 'immediate')
+# Timed sends of high-priority messages share that queue; low-priority (bulk campaign) sends
+# get their own, so a campaign's backlog of ETA tasks never sits ahead of normal sends
+SCHEDULER_HIGH_PRIORITY_QUEUE = os.getenv('SCHEDULER_HIGH_PRIORITY_QUEUE', SCHEDULER_IMMEDIATE_QUEUE)
+SCHEDULER_LOW_PRIORITY_QUEUE = os.getenv('SCHEDULER_LOW_PRIORITY_QUEUE', 'bulk')
+CELERY_TASK_ROUTES = {
+    'scheduler.tasks.send_message_immediately': {'queue': SCHEDULER_IMMEDIATE_QUEUE},
+}
 CELERY_BEAT_SCHEDULE = {
     'process-scheduled-messages': {
         'task': 'scheduler.tasks.process_due_messages',
-        'schedule': 60.0,  # Run every minute
+        'schedule': float(SCHEDULER_SWEEP_INTERVAL),
+    },
+    'materialize-recurring-messages': {
+        'task': 'scheduler.tasks.materialize_recurring',
+        'schedule': float(SCHEDULER_SWEEP_INTERVAL),
+    },
+    'purge-expired-oauth-states': {
+        'task': 'scheduler.tasks.purge_expired_oauth_states',
+        'schedule': 3600.0,
+    },
+    'archive-message-history': {
+        'task': 'scheduler.tasks.archive_message_history',
+        'schedule': 3600.0,
     },
 }
 
@@ -224,3 +255,110 @@ SLACK_SIGNING_SECRET = os.getenv('SLACK_SIGNING_SECRET')
 SLACK_CLIENT_ID = os.getenv('SLACK_CLIENT_ID')
 SLACK_CLIENT_SECRET = os.getenv('SLACK_CLIENT_SECRET')
 SLACK_REFRESH_TOKEN = os.getenv('SLACK_REFRESH_TOKEN')
+# OAuth install states are single-use and expire after this many seconds
+SLACK_OAUTH_STATE_EXPIRATION = int(os.getenv('SLACK_OAUTH_STATE_EXPIRATION', '300'))
+SLACK_OAUTH_STATE_PURGE_BATCH_SIZE = int(os.getenv('SLACK_OAUTH_STATE_PURGE_BATCH_SIZE', '1000'))
+# Point this at a local stub server to benchmark dispatch offline
+SLACK_API_BASE_URL = os.getenv('SLACK_API_BASE_URL', 'https://www.slack.com/api/')
+SLACK_API_TIMEOUT = int(os.getenv('SLACK_API_TIMEOUT', '30'))
+SLACK_API_CONNECT_TIMEOUT = float(os.getenv('SLACK_API_CONNECT_TIMEOUT', '5'))
+# Keep-alive connections per cached client, and how many token clients to keep
+SLACK_HTTP_POOL_SIZE = int(os.getenv('SLACK_HTTP_POOL_SIZE', '20'))
+SLACK_CLIENT_CACHE_SIZE = int(os.getenv('SLACK_CLIENT_CACHE_SIZE', '256'))
+# Per-process cache of workspace bot tokens read from the installation table. Installation
+# changes bump a version key in Redis that empties every process's cache; the TTL bounds
+# how stale a token can get while Redis is unreachable.
+SLACK_INSTALLATION_CACHE_SIZE = int(os.getenv('SLACK_INSTALLATION_CACHE_SIZE', '1024'))
+SLACK_INSTALLATION_CACHE_TTL = int(os.getenv('SLACK_INSTALLATION_CACHE_TTL', '60'))
+SLACK_INSTALLATION_CACHE_REDIS_URL = os.getenv('SLACK_INSTALLATION_CACHE_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+# Compiled message templates kept per process
+SCHEDULER_TEMPLATE_CACHE_SIZE = int(os.getenv('SCHEDULER_TEMPLATE_CACHE_SIZE', '512'))
+
+# Scheduler dispatch settings
+# Number of due messages a worker claims per round trip
+SCHEDULER_CLAIM_BATCH_SIZE = int(os.getenv('SCHEDULER_CLAIM_BATCH_SIZE', '100'))
+# True claims batches weighted-fair: one message per channel per round, each workspace capped
+# at SLACK_WORKSPACE_RATE_PER_SECOND channels per round, so one tenant's campaign cannot delay
+# the others; the default claims strictly oldest first
+SCHEDULER_FAIR_DISPATCH = os.getenv('SCHEDULER_FAIR_DISPATCH', 'False') == 'True'
+# Fair dispatch ranks this many of the oldest due messages at a time
+SCHEDULER_FAIR_WINDOW = int(os.getenv('SCHEDULER_FAIR_WINDOW', '10000'))
+# Share of those rounds per priority (low,normal,high): a high-priority message is claimed as
+# if it had waited 16 times as long as a low-priority one
+SCHEDULER_PRIORITY_WEIGHTS = [float(weight) for weight in os.getenv('SCHEDULER_PRIORITY_WEIGHTS', '1,4,16').split(',')]
+# Claims older than this are considered abandoned (crashed worker); the channel history is
+# checked for the post before such a message is sent again
+SCHEDULER_CLAIM_LEASE_SECONDS = int(os.getenv('SCHEDULER_CLAIM_LEASE_SECONDS', '300'))
+# When that history cannot be read (e.g. the app lacks the channels:history scope) the message
+# is failed rather than risk a duplicate post, unless this is True
+SCHEDULER_RESEND_UNVERIFIED = os.getenv('SCHEDULER_RESEND_UNVERIFIED', 'False') == 'True'
+# Transient send failures are retried with jittered exponential backoff up to this many attempts
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv('SCHEDULER_MAX_ATTEMPTS', '5'))
+SCHEDULER_RETRY_BASE_DELAY = float(os.getenv('SCHEDULER_RETRY_BASE_DELAY', '30'))
+SCHEDULER_RETRY_MAX_DELAY = float(os.getenv('SCHEDULER_RETRY_MAX_DELAY', '3600'))
+# Immediate sends: with async mode on, POST .../send/ enqueues the send and answers 202 with a
+# job id unless the request passes ?async=false (and vice versa with it off)
+SCHEDULER_IMMEDIATE_SEND_ASYNC = os.getenv('SCHEDULER_IMMEDIATE_SEND_ASYNC', 'False') == 'True'
+# Results of async immediate sends can be POSTed to a callback_url, signed with this secret
+# (X-Scheduler-Signature: sha256=<HMAC of the body>) when it is set. Callbacks only go to the hosts
+# listed, or, with no list, to hosts whose addresses are all public (no loopback, private or link-local)
+SCHEDULER_CALLBACK_SECRET = os.getenv('SCHEDULER_CALLBACK_SECRET', '')
+SCHEDULER_CALLBACK_TIMEOUT = float(os.getenv('SCHEDULER_CALLBACK_TIMEOUT', '10'))
+SCHEDULER_CALLBACK_ALLOWED_HOSTS = [host for host in os.getenv('SCHEDULER_CALLBACK_ALLOWED_HOSTS', '').split(',') if host]
+# Page size of GET /api/messages/ (clients may ask for up to the maximum with ?page_size=)
+SCHEDULER_API_PAGE_SIZE = int(os.getenv('SCHEDULER_API_PAGE_SIZE', '100'))
+SCHEDULER_API_MAX_PAGE_SIZE = int(os.getenv('SCHEDULER_API_MAX_PAGE_SIZE', '1000'))
+# Limits for POST /api/messages/bulk/: messages per request, and rows per INSERT
+SCHEDULER_BULK_MAX_ITEMS = int(os.getenv('SCHEDULER_BULK_MAX_ITEMS', '10000'))
+SCHEDULER_BULK_CHUNK_SIZE = int(os.getenv('SCHEDULER_BULK_CHUNK_SIZE', '1000'))
+# Broadcasts: channels per broadcast, and deliveries sent between renewals of the claim
+# (keep a chunk's send time, chunk / SLACK_WORKSPACE_RATE_PER_SECOND, inside the lease)
+SCHEDULER_BROADCAST_MAX_TARGETS = int(os.getenv('SCHEDULER_BROADCAST_MAX_TARGETS', '1000'))
+SCHEDULER_BROADCAST_CHUNK_SIZE = int(os.getenv('SCHEDULER_BROADCAST_CHUNK_SIZE', '500'))
+# Recurring messages: occurrences are written this many seconds ahead, at most
+# SCHEDULER_RECURRING_MAX_OCCURRENCES per rule per pass; occurrences missed by more
+# than SCHEDULER_RECURRING_MAX_LATENESS seconds (e.g. during an outage) are skipped
+SCHEDULER_RECURRING_HORIZON = int(os.getenv('SCHEDULER_RECURRING_HORIZON', '86400'))
+SCHEDULER_RECURRING_MAX_OCCURRENCES = int(os.getenv('SCHEDULER_RECURRING_MAX_OCCURRENCES', '10'))
+SCHEDULER_RECURRING_MAX_LATENESS = int(os.getenv('SCHEDULER_RECURRING_MAX_LATENESS', '3600'))
+# Retention: sent and failed messages scheduled more than this many days ago are moved from the
+# hot table to the archive table, SCHEDULER_ARCHIVE_BATCH_SIZE rows per transaction (0 disables)
+SCHEDULER_RETENTION_DAYS = int(os.getenv('SCHEDULER_RETENTION_DAYS', '30'))
+SCHEDULER_ARCHIVE_BATCH_SIZE = int(os.getenv('SCHEDULER_ARCHIVE_BATCH_SIZE', '1000'))
+# Archived messages scheduled more than this many days ago are deleted (0 keeps them forever),
+# after being written as gzipped JSONL to SCHEDULER_ARCHIVE_EXPORT_DIR when it is set
+SCHEDULER_ARCHIVE_RETENTION_DAYS = int(os.getenv('SCHEDULER_ARCHIVE_RETENTION_DAYS', '0'))
+SCHEDULER_ARCHIVE_EXPORT_DIR = os.getenv('SCHEDULER_ARCHIVE_EXPORT_DIR', '')
+# How the dispatcher sends a claimed batch: 'sync' (one at a time), 'thread' or 'async'
+SCHEDULER_DISPATCH_BACKEND = os.getenv('SCHEDULER_DISPATCH_BACKEND', 'sync')
+# Maximum chat.postMessage calls in flight per batch for the thread and async backends
+SLACK_SEND_CONCURRENCY = int(os.getenv('SLACK_SEND_CONCURRENCY', '20'))
+
+# Shared Slack rate limiting (token buckets kept in Redis so all workers agree)
+SLACK_RATE_LIMIT_ENABLED = os.getenv('SLACK_RATE_LIMIT_ENABLED', 'True') == 'True'
+SLACK_RATE_LIMIT_REDIS_URL = os.getenv('SLACK_RATE_LIMIT_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+# chat.postMessage allows roughly one message per second per channel
+SLACK_CHANNEL_RATE_PER_SECOND = float(os.getenv('SLACK_CHANNEL_RATE_PER_SECOND', '1'))
+SLACK_CHANNEL_BURST = int(os.getenv('SLACK_CHANNEL_BURST', '1'))
+# Workspace-wide ceiling for chat.postMessage across all channels
+SLACK_WORKSPACE_RATE_PER_SECOND = float(os.getenv('SLACK_WORKSPACE_RATE_PER_SECOND', '10'))
+SLACK_WORKSPACE_BURST = int(os.getenv('SLACK_WORKSPACE_BURST', '20'))
+# How often, and for how long, a send waits out Retry-After (or a queued rate-limit slot)
+# before deferring the message
+SLACK_RATE_LIMIT_MAX_RETRIES = int(os.getenv('SLACK_RATE_LIMIT_MAX_RETRIES', '3'))
+SLACK_RATE_LIMIT_MAX_WAIT = float(os.getenv('SLACK_RATE_LIMIT_MAX_WAIT', '30'))
+
+# Channel directory: channel names are resolved to IDs from a Redis cache of conversations.list
+SLACK_CHANNEL_CACHE_ENABLED = os.getenv('SLACK_CHANNEL_CACHE_ENABLED', 'True') == 'True'
+SLACK_CHANNEL_CACHE_REDIS_URL = os.getenv('SLACK_CHANNEL_CACHE_REDIS_URL', SLACK_RATE_LIMIT_REDIS_URL)
+SLACK_CHANNEL_CACHE_TTL = int(os.getenv('SLACK_CHANNEL_CACHE_TTL', '86400'))
+# After a full listing, unknown names are rejected without calling Slack for this long
+SLACK_CHANNEL_REFRESH_INTERVAL = int(os.getenv('SLACK_CHANNEL_REFRESH_INTERVAL', '300'))
+SLACK_CHANNEL_PAGE_SIZE = int(os.getenv('SLACK_CHANNEL_PAGE_SIZE', '200'))
+
+# Prometheus metrics, served at /metrics by the web process. Processes without a web
+# server (Celery worker, scheduler_runner.py) serve them on SCHEDULER_METRICS_PORT.
+# Under gunicorn or Celery prefork set PROMETHEUS_MULTIPROC_DIR to an empty directory
+# so samples from every child process are aggregated.
+SCHEDULER_METRICS_ENABLED = os.getenv('SCHEDULER_METRICS_ENABLED', 'True') == 'True'
+SCHEDULER_METRICS_PORT = int(os.getenv('SCHEDULER_METRICS_PORT', '0'))
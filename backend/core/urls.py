@@ -16,10 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from scheduler.views import health_check
+from scheduler.views import health_check, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('scheduler.urls')),
     path('health/', health_check, name='root_health_check'),
+    path('metrics', metrics, name='metrics'),
 ]
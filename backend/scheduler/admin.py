@@ -1,12 +1,58 @@
 from django.contrib import admin
-from .models import ScheduledMessage
+from .models import ArchivedMessage, BroadcastTarget, MessageTemplate, RecurringMessage, ScheduledMessage, SlackInstallation
 
 # Register your models here.
 
+class BroadcastTargetInline(admin.TabularInline):
+    model = BroadcastTarget
+    extra = 0
+    readonly_fields = ('status', 'last_error', 'sent_at')
+
+
 @admin.register(ScheduledMessage)
 class ScheduledMessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'channel', 'scheduled_time', 'status', 'created_at')
-    list_filter = ('status', 'channel')
+    list_display = ('id', 'channel', 'is_broadcast', 'team_id', 'scheduled_time', 'priority', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status', 'priority', 'is_broadcast', 'team_id', 'channel')
     search_fields = ('message', 'channel')
+    readonly_fields = ('is_broadcast', 'attempts', 'next_attempt_at', 'last_error', 'created_at', 'updated_at')
+    ordering = ('-scheduled_time',)
+    inlines = (BroadcastTargetInline,)
+
+
+@admin.register(RecurringMessage)
+class RecurringMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'channel', 'rrule', 'timezone', 'priority', 'is_active', 'next_occurrence_at')
+    list_filter = ('is_active', 'channel')
+    search_fields = ('message', 'channel')
+    readonly_fields = ('next_occurrence_at', 'created_at', 'updated_at')
+
+
+@admin.register(MessageTemplate)
+class MessageTemplateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'updated_at')
+    search_fields = ('name', 'text')
     readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'channel', 'is_broadcast', 'team_id', 'scheduled_time', 'status', 'archived_at')
+    list_filter = ('status', 'is_broadcast', 'team_id')
+    search_fields = ('message', 'channel')
     ordering = ('-scheduled_time',)
+
+    # Archived history is a record of what was sent; it is only ever moved here or purged
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(SlackInstallation)
+class SlackInstallationAdmin(admin.ModelAdmin):
+    list_display = ('team_id', 'team_name', 'enterprise_id', 'bot_user_id', 'installed_at', 'updated_at')
+    search_fields = ('team_id', 'team_name', 'enterprise_id')
+    # Tokens are secrets; they are written by the OAuth flow, never shown or edited here
+    exclude = ('bot_token', 'bot_refresh_token', 'user_token', 'user_refresh_token')
+    readonly_fields = ('installed_at', 'updated_at')
+    ordering = ('-installed_at',)
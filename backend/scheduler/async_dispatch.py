@@ -0,0 +1,210 @@
+"""
+Asyncio send engine for dispatching batches of scheduled messages
+
+Also home to the event-loop-shared Slack session used by the async
+immediate-send views.
+"""
+import asyncio
+import logging
+import weakref
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+from .installation_store import SlackInstallationNotFound, forget_bot_token, get_bot_tokens, resolve_bot_token
+from .metrics import observe_slack_call
+from .rate_limit import SlackRateLimitedError, get_rate_limiter, get_retry_after
+from .services import get_message_metadata
+from .slack_clients import is_token_error
+
+logger = logging.getLogger(__name__)
+
+class InstrumentedAsyncWebClient(AsyncWebClient):
+    """
+    AsyncWebClient that records per-method Slack API latency
+    """
+    async def api_call(self, api_method, **kwargs):
+        with observe_slack_call(api_method):
+            return await super().api_call(api_method, **kwargs)
+
+async def _post_message(client, limiter, text, channel, team_id=None, idempotency_key=None, blocks=None):
+    """
+    Post one message through the shared rate limiter, honoring Retry-After
+
+    An idempotency key goes along as message metadata.
+    """
+    kwargs = {'channel': channel, 'text': text}
+    if blocks:
+        kwargs['blocks'] = blocks
+    if idempotency_key:
+        kwargs['metadata'] = get_message_metadata(idempotency_key)
+    attempt = 0
+    while True:
+        if limiter:
+            await limiter.acquire_async('chat.postMessage', client.token, channel)
+        try:
+            return await client.chat_postMessage(**kwargs)
+        except SlackApiError as e:
+            if is_token_error(e):
+                forget_bot_token(team_id)
+            retry_after = get_retry_after(e)
+            if retry_after is None:
+                raise
+            
+            logger.warning(f"Rate limited sending to {channel}, Retry-After {retry_after}s")
+            if limiter:
+                await asyncio.to_thread(limiter.block, 'chat.postMessage', client.token, channel, retry_after)
+            
+            attempt += 1
+            if attempt > settings.SLACK_RATE_LIMIT_MAX_RETRIES or retry_after > settings.SLACK_RATE_LIMIT_MAX_WAIT:
+                raise SlackRateLimitedError(channel, retry_after) from e
+            if not limiter:
+                await asyncio.sleep(retry_after)
+
+async def _send_one(client, semaphore, limiter, message):
+    """
+    Post a single message, holding a concurrency slot for the HTTP call
+    """
+    async with semaphore:
+        try:
+            result = await _post_message(
+                client,
+                limiter,
+                message.message,
+                message.channel,
+                team_id=message.team_id,
+                idempotency_key=message.idempotency_key,
+                blocks=message.blocks
+            )
+            logger.info(f"Message {message.id} sent to {message.channel}: ts={result.get('ts')}")
+            return message, True, None
+        except SlackApiError as e:
+            logger.error(f"Error sending message {message.id} to Slack: {e}")
+            return message, False, e
+        except Exception as e:
+            logger.error(f"Error sending message {message.id}: {str(e)}")
+            return message, False, e
+
+async def send_batch(messages, concurrency=None, tokens=None, base_url=None):
+    """
+    Send a batch of messages concurrently over one shared HTTP session
+
+    ``tokens`` maps each message's team_id to its bot token; messages from
+    a workspace with no token fail with SlackInstallationNotFound. Every
+    workspace gets its own AsyncWebClient on the same session.
+
+    At most ``concurrency`` chat.postMessage calls are in flight at once, and
+    the aiohttp connection pool is sized to match so TCP/TLS connections are
+    reused across the whole batch. Each call also waits on the shared Redis
+    rate limiter, so a batch spread over many channels runs in parallel while
+    messages to one channel are paced.
+    """
+    concurrency = concurrency or settings.SLACK_SEND_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=settings.SLACK_API_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        clients = {}
+        limiter = get_rate_limiter()
+        
+        async def send(message):
+            token = (tokens or {}).get(message.team_id)
+            if token is None and message.team_id:
+                return message, False, SlackInstallationNotFound(message.team_id)
+            if token not in clients:
+                clients[token] = InstrumentedAsyncWebClient(
+                    token=token,
+                    base_url=base_url or settings.SLACK_API_BASE_URL,
+                    session=session,
+                )
+            return await _send_one(clients[token], semaphore, limiter, message)
+        
+        return await asyncio.gather(*(send(message) for message in messages))
+
+def send_messages_async(messages, concurrency=None, tokens=None, base_url=None):
+    """
+    Synchronous entry point for Celery tasks and management commands
+
+    ``messages`` are already-loaded ScheduledMessage instances and bot tokens
+    are resolved before the loop starts, so no ORM access happens inside the
+    event loop. Returns a list of ``(message, success, error)`` tuples in
+    input order.
+    """
+    if not messages:
+        return []
+    if tokens is None:
+        tokens = get_bot_tokens(message.team_id for message in messages)
+    return asyncio.run(send_batch(messages, concurrency=concurrency, tokens=tokens, base_url=base_url))
+
+_shared_sessions = weakref.WeakKeyDictionary()
+
+def get_shared_session():
+    """
+    Return the aiohttp session shared by async Slack calls on the running event loop
+
+    An ASGI worker runs one event loop for its lifetime, so every request it
+    serves sends over the same connection pool (sized by
+    SLACK_HTTP_POOL_SIZE). Only use it from a long-lived loop: a loop that
+    is closed after one call would leave its session's connections open.
+    """
+    loop = asyncio.get_running_loop()
+    session = _shared_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.SLACK_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=settings.SLACK_API_TIMEOUT),
+        )
+        _shared_sessions[loop] = session
+    return session
+
+async def post_message_async(message, channel, team_id=None, idempotency_key=None, session=None, blocks=None):
+    """
+    Asyncio counterpart of services.post_slack_message for async views
+
+    Posts over ``session`` (usually get_shared_session()), or over a session
+    opened for this call when none is given. The bot token is resolved in a
+    thread, as it may need the database. Raises as post_slack_message does.
+    """
+    own_session = None
+    if session is None:
+        session = own_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=settings.SLACK_API_TIMEOUT))
+    try:
+        # Only an installed workspace's token needs a lookup (and so a thread)
+        token = await sync_to_async(resolve_bot_token)(team_id) if team_id else settings.SLACK_BOT_TOKEN
+        client = InstrumentedAsyncWebClient(token=token, base_url=settings.SLACK_API_BASE_URL, session=session)
+        return await _post_message(
+            client,
+            get_rate_limiter(),
+            message,
+            channel,
+            team_id=team_id,
+            idempotency_key=idempotency_key,
+            blocks=blocks
+        )
+    finally:
+        if own_session is not None:
+            await own_session.close()
+
+async def send_slack_message_async(message, channel, team_id=None, idempotency_key=None, session=None, blocks=None):
+    """
+    Asyncio counterpart of services.send_slack_message for async views
+
+    Returns True on success.
+    """
+    try:
+        result = await post_message_async(
+            message,
+            channel,
+            team_id=team_id,
+            idempotency_key=idempotency_key,
+            session=session,
+            blocks=blocks
+        )
+        logger.info(f"Message sent to {channel}: ts={result.get('ts')}")
+        return True
+    except (SlackApiError, SlackRateLimitedError, SlackInstallationNotFound) as e:
+        logger.error(f"Error sending message to Slack: {e}")
+        return False
@@ -0,0 +1,42 @@
+"""
+Async-capable DRF view for the immediate-send endpoints
+
+DRF 3.15 only runs sync handlers. AsyncAPIView keeps everything APIView
+does around a handler (request parsing, the REST_FRAMEWORK
+authentication, permission and throttle classes, exception handling and
+response rendering) and awaits the handler in between, so the endpoints
+stay under the same API policy as the viewsets while Slack calls run on
+the event loop.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose HTTP handlers are coroutines
+
+    The checks in ``initial()`` are sync (session authentication reads the
+    database), so they run in a thread before the handler is awaited.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
@@ -0,0 +1,188 @@
+"""
+Broadcast messages: one message body sent to many channels
+
+A broadcast is a single ScheduledMessage (``is_broadcast``) whose channels
+are BroadcastTarget rows, so the body is stored once however many channels
+it goes to. The dispatcher expands a claimed broadcast into one delivery
+per pending target and sends them alongside ordinary messages, under the
+same per-channel and per-workspace rate limits. Each target records its
+own outcome; the message is retried until every target is sent or has
+failed for good.
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import BroadcastTarget
+
+class BroadcastDelivery:
+    """
+    One target of a claimed broadcast, shaped like a message for the send engines
+    """
+    __slots__ = ('broadcast', 'target')
+
+    def __init__(self, broadcast, target):
+        self.broadcast = broadcast
+        self.target = target
+
+    @property
+    def id(self):
+        return self.broadcast.id
+
+    @property
+    def message(self):
+        return self.broadcast.message
+
+    @property
+    def blocks(self):
+        return self.broadcast.blocks
+
+    @property
+    def channel(self):
+        return self.target.channel
+
+    @property
+    def team_id(self):
+        return self.broadcast.team_id
+
+    @property
+    def idempotency_key(self):
+        return self.broadcast.idempotency_key
+
+class BroadcastDeliveryError(Exception):
+    """
+    Some targets of a broadcast failed permanently
+    """
+    def __init__(self, failed, total):
+        self.failed = failed
+        self.total = total
+        super().__init__(f"Failed for {failed} of {total} channels; see the message's targets")
+
+def expand_broadcasts(messages):
+    """
+    Replace each broadcast in ``messages`` with one delivery per pending target
+
+    The targets of every broadcast in the batch are loaded in one query.
+    Ordinary messages pass through unchanged.
+    """
+    broadcast_ids = [message.id for message in messages if message.is_broadcast]
+    if not broadcast_ids:
+        return list(messages)
+
+    targets = {}
+    for target in (
+        BroadcastTarget.objects.filter(message_id__in=broadcast_ids, status='pending')
+        .only('id', 'message_id', 'channel')
+        .order_by('id')
+    ):
+        targets.setdefault(target.message_id, []).append(target)
+
+    sendables = []
+    for message in messages:
+        if message.is_broadcast:
+            sendables.extend(BroadcastDelivery(message, target) for target in targets.get(message.id, []))
+        else:
+            sendables.append(message)
+    return sendables
+
+def record_broadcast_results(messages, results, now=None):
+    """
+    Write per-target outcomes and fold them into one result per message
+
+    Sent targets are marked sent and permanently failed ones failed; targets
+    that hit a transient error stay pending, so a retry of the message only
+    sends to them. A broadcast counts as sent once every target is sent, is
+    retried (with the transient error) while any target is pending, and has
+    failed if any target failed. Returns ``(message, success, error)``
+    tuples in the order of ``messages``.
+    """
+    from .services import classify_send_error
+
+    now = now or timezone.now()
+    by_message = {}
+    sent_ids = []
+    failed = []
+    for sendable, success, error in results:
+        if not isinstance(sendable, BroadcastDelivery):
+            by_message[sendable.id] = (sendable, success, error)
+            continue
+        target = sendable.target
+        state = by_message.setdefault(sendable.id, {'transient': None})
+        if success:
+            sent_ids.append(target.id)
+            continue
+        target.last_error = str(error)
+        transient, _ = classify_send_error(error)
+        if transient:
+            state['transient'] = state['transient'] or error
+        else:
+            target.status = 'failed'
+        failed.append(target)
+
+    broadcast_ids = [message.id for message in messages if message.is_broadcast]
+    if not broadcast_ids:
+        return [by_message[message.id] for message in messages]
+
+    with transaction.atomic():
+        if sent_ids:
+            BroadcastTarget.objects.filter(id__in=sent_ids).update(status='sent', last_error='', sent_at=now)
+        if failed:
+            BroadcastTarget.objects.bulk_update(failed, ['status', 'last_error'])
+
+    # Failures from earlier attempts decide the outcome as much as this one's
+    counts = count_targets(broadcast_ids)
+
+    collapsed = []
+    for message in messages:
+        if not message.is_broadcast:
+            collapsed.append(by_message[message.id])
+            continue
+        state = by_message.get(message.id, {'transient': None})
+        if state['transient'] is not None:
+            collapsed.append((message, False, state['transient']))
+        else:
+            collapsed.append((message, *get_broadcast_result(counts.get(message.id))))
+    return collapsed
+
+def count_targets(broadcast_ids):
+    """
+    Count each broadcast's targets by status, in one query
+    """
+    counts = {}
+    for row in (
+        BroadcastTarget.objects.filter(message_id__in=broadcast_ids)
+        .values('message_id', 'status')
+        .annotate(count=Count('id'))
+        .order_by()
+    ):
+        counts.setdefault(row['message_id'], {'pending': 0, 'sent': 0, 'failed': 0})[row['status']] = row['count']
+    return counts
+
+def get_broadcast_result(counts):
+    """
+    ``(success, error)`` of a broadcast with no pending targets left
+    """
+    counts = counts or {'pending': 0, 'sent': 0, 'failed': 0}
+    if counts['failed']:
+        return False, BroadcastDeliveryError(counts['failed'], sum(counts.values()))
+    return True, None
+
+def fail_pending_targets(outcomes):
+    """
+    Mark the still-pending targets of broadcasts that ran out of attempts as failed
+    """
+    exhausted = [message for message, outcome, _ in outcomes if outcome == 'failed' and message.is_broadcast]
+    for message in exhausted:
+        BroadcastTarget.objects.filter(message_id=message.id, status='pending').update(
+            status='failed',
+            last_error=message.last_error
+        )
+
+def set_broadcast_targets(message, channels):
+    """
+    Replace a broadcast's targets with ``channels``
+    """
+    BroadcastTarget.objects.filter(message=message).delete()
+    BroadcastTarget.objects.bulk_create(
+        [BroadcastTarget(message=message, channel=channel) for channel in channels]
+    )
@@ -0,0 +1,166 @@
+"""
+Channel directory: resolve Slack channel names to channel IDs
+
+Channel names are looked up in a per-workspace Redis hash filled from
+paginated conversations.list calls. A miss walks the listing a page at a
+time and stops as soon as the name turns up, remembering where it stopped
+so the next miss resumes there; a full walk marks the directory fresh for
+SLACK_CHANNEL_REFRESH_INTERVAL seconds, during which unknown names are
+rejected without calling Slack.
+"""
+import logging
+import re
+import time
+import redis
+from django.conf import settings
+from slack_sdk.errors import SlackApiError
+
+from .installation_store import resolve_bot_token
+from .rate_limit import SlackRateLimitedError, get_rate_limiter
+from .slack_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Conversation IDs (public/private channels, DMs) and user IDs, which
+# chat.postMessage accepts as a channel to open a DM
+CHANNEL_ID_PATTERN = re.compile(r'^[CGDUW][A-Z0-9]{6,}$')
+
+class ChannelNotFound(Exception):
+    """
+    No channel with this name exists in the workspace (or the bot cannot see it)
+    """
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"Slack channel #{name} was not found; invite the bot or use the channel ID")
+
+def normalize_channel_name(channel):
+    """
+    Strip the leading ``#`` and surrounding whitespace; Slack names are lowercase
+    """
+    return channel.strip().lstrip('#').lower()
+
+class ChannelDirectory:
+    """
+    Redis-backed cache of channel name to channel ID, per workspace
+
+    If Redis or Slack is unreachable, resolve() returns None (the caller
+    keeps the name as given) for a short cooldown rather than blocking
+    scheduling on the directory.
+    """
+    key_prefix = 'slack:channels'
+    lock_timeout = 60
+    failure_cooldown = 30
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url or settings.SLACK_CHANNEL_CACHE_REDIS_URL
+        self._client = redis.Redis.from_url(self.redis_url, decode_responses=True)
+        self._disabled_until = 0
+
+    def _key(self, team_id, name):
+        return f"{self.key_prefix}:{team_id or 'default'}:{name}"
+
+    def _available(self):
+        return time.monotonic() >= self._disabled_until
+
+    def _fail_open(self, error):
+        if self._available():
+            logger.warning(f"Channel directory unavailable, keeping channel names as given: {error}")
+        self._disabled_until = time.monotonic() + self.failure_cooldown
+        return None
+
+    def resolve(self, name, team_id=''):
+        """
+        Return the ID of channel ``name``
+
+        Raises ChannelNotFound if a refresh of the directory does not turn
+        it up. Returns None if the directory is unavailable or another
+        process is refreshing it.
+        """
+        if not self._available():
+            return None
+        names_key = self._key(team_id, 'names')
+        try:
+            channel_id = self._client.hget(names_key, name)
+            if channel_id:
+                return channel_id
+            if self._client.exists(self._key(team_id, 'fresh')):
+                raise ChannelNotFound(name)
+            return self._refresh_until_found(name, team_id)
+        except (redis.RedisError, SlackApiError, SlackRateLimitedError, OSError) as e:
+            return self._fail_open(e)
+
+    def _refresh_until_found(self, name, team_id):
+        lock_key = self._key(team_id, 'lock')
+        if not self._client.set(lock_key, '1', nx=True, ex=self.lock_timeout):
+            # Another process is walking the listing; use whatever it has written so far
+            return self._client.hget(self._key(team_id, 'names'), name)
+        try:
+            return self._walk(name, team_id)
+        finally:
+            self._client.delete(lock_key)
+
+    def _walk(self, name, team_id):
+        token = resolve_bot_token(team_id)
+        client = get_client(token)
+        limiter = get_rate_limiter()
+        names_key = self._key(team_id, 'names')
+        cursor_key = self._key(team_id, 'cursor')
+        cursor = self._client.get(cursor_key)
+
+        while True:
+            if limiter:
+                limiter.acquire('conversations.list', token)
+            response = client.conversations_list(
+                types='public_channel,private_channel',
+                exclude_archived=True,
+                limit=settings.SLACK_CHANNEL_PAGE_SIZE,
+                cursor=cursor or None,
+            )
+            page = {channel['name']: channel['id'] for channel in response.get('channels', [])}
+            cursor = (response.get('response_metadata') or {}).get('next_cursor') or ''
+
+            pipe = self._client.pipeline()
+            if page:
+                pipe.hset(names_key, mapping=page)
+                pipe.expire(names_key, settings.SLACK_CHANNEL_CACHE_TTL)
+            if cursor:
+                pipe.set(cursor_key, cursor, ex=settings.SLACK_CHANNEL_CACHE_TTL)
+            else:
+                pipe.delete(cursor_key)
+                pipe.set(self._key(team_id, 'fresh'), '1', ex=settings.SLACK_CHANNEL_REFRESH_INTERVAL)
+            pipe.execute()
+
+            if name in page:
+                return page[name]
+            if not cursor:
+                raise ChannelNotFound(name)
+
+_directory = None
+
+def get_channel_directory():
+    """
+    Return the process-wide channel directory, or None when it is disabled
+    """
+    global _directory
+    if not settings.SLACK_CHANNEL_CACHE_ENABLED:
+        return None
+    if _directory is None:
+        _directory = ChannelDirectory()
+    return _directory
+
+def resolve_channel(channel, team_id=''):
+    """
+    Normalize a channel given by name or ID to its channel ID
+
+    IDs pass through untouched. Names (with or without ``#``) are looked up
+    in the directory; if it is disabled or unavailable the name is returned
+    as ``#name`` for Slack to resolve at send time. Raises ChannelNotFound
+    for names the workspace does not have.
+    """
+    channel = channel.strip()
+    if CHANNEL_ID_PATTERN.match(channel):
+        return channel
+    name = normalize_channel_name(channel)
+    directory = get_channel_directory()
+    channel_id = directory.resolve(name, team_id) if directory else None
+    return channel_id or f"#{name}"
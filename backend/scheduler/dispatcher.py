@@ -0,0 +1,300 @@
+"""
+Dispatcher engine shared by every entry point that sends due messages
+
+The Celery tasks, the management commands and scheduler_runner.py are thin
+wrappers over Dispatcher, so batch size, concurrency and send backend are
+tuned in one place.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .broadcasts import expand_broadcasts, fail_pending_targets, record_broadcast_results
+from .installation_store import SlackInstallationNotFound, get_bot_tokens
+from .message_templates import render_templates
+from .metrics import observe_tick, record_outcomes
+from .reconciliation import reconcile_stale_sends
+from .services import (
+    DISPATCH_FIELDS,
+    claim_due_messages,
+    due_messages_queryset,
+    get_slack_client,
+    get_worker_id,
+    keyset_after,
+    post_slack_message,
+    rank_due_messages,
+    record_send_results,
+    renew_claims,
+)
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('sync', 'thread', 'async')
+
+def log_result(message, outcome, error):
+    """
+    Default reporter: one log line per dispatched message
+    """
+    if outcome == 'sent':
+        logger.info(f"Successfully sent message {message.id}")
+    elif outcome == 'deferred':
+        logger.warning(f"Retrying message {message.id} at {message.next_attempt_at}: {str(error)}")
+    elif outcome == 'dry-run':
+        logger.info(f"[dry run] Would send message {message.id} to channel {message.channel}")
+    else:
+        logger.error(f"Error processing message {message.id}: {str(error)}")
+
+class ClaimRenewer:
+    """
+    Renew a batch's claims in a background thread while it is being sent
+
+    The lease is pushed out every third of SCHEDULER_CLAIM_LEASE_SECONDS,
+    so a batch held up by rate limits or a slow Slack is never mistaken
+    for one abandoned by a crashed worker, whatever the send backend.
+    """
+    def __init__(self, messages):
+        self.messages = messages
+        self.interval = settings.SCHEDULER_CLAIM_LEASE_SECONDS / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='claim-renewer', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    renew_claims(self.messages)
+                except Exception as e:
+                    logger.error(f"Error renewing claims on {len(self.messages)} messages: {str(e)}")
+        finally:
+            # The thread has its own database connection
+            connection.close()
+
+
+class Dispatcher:
+    """
+    Claim, send and record due messages in batches
+
+    backend:
+        'sync' sends one message at a time, 'thread' uses a thread pool of
+        ``concurrency`` workers sharing one client, and 'async' uses the
+        asyncio engine with ``concurrency`` requests in flight.
+    dry_run:
+        walk the due backlog and report what would be sent without claiming,
+        sending or writing anything.
+    fair:
+        claim batches weighted-fair across workspaces, channels and
+        priorities (see services.fair_order) rather than oldest first;
+        defaults to SCHEDULER_FAIR_DISPATCH.
+    reporter:
+        called as ``reporter(message, outcome, error)`` for every message;
+        defaults to logging.
+    """
+    def __init__(self, batch_size=None, concurrency=None, backend=None, dry_run=False, worker_id=None, reporter=None, fair=None):
+        self.batch_size = batch_size or settings.SCHEDULER_CLAIM_BATCH_SIZE
+        self.concurrency = concurrency or settings.SLACK_SEND_CONCURRENCY
+        self.backend = backend or settings.SCHEDULER_DISPATCH_BACKEND
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown dispatch backend {self.backend!r}; expected one of {', '.join(BACKENDS)}")
+        self.dry_run = dry_run
+        self.worker_id = worker_id or get_worker_id()
+        self.reporter = reporter or log_result
+        self.fair = settings.SCHEDULER_FAIR_DISPATCH if fair is None else fair
+
+    def send(self, messages):
+        """
+        Send a batch of claimed messages with the configured backend
+
+        Broadcasts are expanded into one delivery per pending target and
+        always fanned out concurrently, on a thread pool under the sync
+        backend. Large fan-outs go out in chunks of
+        SCHEDULER_BROADCAST_CHUNK_SIZE deliveries. Bot tokens for every
+        workspace in the batch are resolved up front, in at most one query,
+        and templated messages are rendered; one that cannot be rendered
+        fails without being sent. Returns a list of ``(message, success,
+        error)`` tuples, one per message.
+        """
+        if not messages:
+            return []
+        messages, failures = render_templates(messages)
+        tokens = get_bot_tokens(message.team_id for message in messages)
+        if not any(message.is_broadcast for message in messages):
+            return self._send_all(tokens, messages, concurrent=self.backend == 'thread') + failures
+
+        sendables = expand_broadcasts(messages)
+        chunk_size = settings.SCHEDULER_BROADCAST_CHUNK_SIZE
+        results = []
+        for start in range(0, len(sendables), chunk_size):
+            results.extend(self._send_all(tokens, sendables[start:start + chunk_size], concurrent=True))
+        return record_broadcast_results(messages, results) + failures
+
+    def _send_all(self, tokens, messages, concurrent):
+        if self.backend == 'async':
+            from .async_dispatch import send_messages_async
+            return send_messages_async(messages, concurrency=self.concurrency, tokens=tokens)
+
+        if concurrent and len(messages) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(messages))) as executor:
+                return list(executor.map(lambda message: self._send_one(tokens, message), messages))
+        return [self._send_one(tokens, message) for message in messages]
+
+    def _send_one(self, tokens, message):
+        token = tokens[message.team_id]
+        if token is None and message.team_id:
+            return message, False, SlackInstallationNotFound(message.team_id)
+        try:
+            client = get_slack_client(token)
+            result = post_slack_message(
+                message.message,
+                message.channel,
+                client=client,
+                team_id=message.team_id,
+                idempotency_key=message.idempotency_key,
+                blocks=message.blocks
+            )
+            logger.info(f"Message {message.id} sent to {message.channel}: ts={result.get('ts')}")
+            return message, True, None
+        except Exception as e:
+            return message, False, e
+
+    def dispatch_batch(self, messages):
+        """
+        Send claimed messages and write their outcomes back
+
+        The claims are renewed for as long as the batch takes to send.
+        """
+        with ClaimRenewer(messages):
+            results = self.send(messages)
+        return self.record(results)
+
+    def record(self, results):
+        """
+        Write back ``(message, success, error)`` results of claimed messages and report them
+        """
+        outcomes = record_send_results(results)
+        fail_pending_targets(outcomes)
+        record_outcomes(outcomes)
+        for message, outcome, error in outcomes:
+            self.reporter(message, outcome, error)
+        return outcomes
+
+    def run(self, now=None):
+        """
+        Drain every message due at ``now``
+
+        Messages left 'sending' by a stopped worker are reconciled first, so
+        the ones that were never posted are sent in this same pass. Batches
+        are claimed with a keyset cursor on (scheduled_time, id), so memory
+        stays bounded by the batch size however large the backlog is and any
+        number of dispatchers can run side by side. In fair mode batches are
+        taken from ranked windows instead (see _fair_batches). Returns a
+        dict of counts per outcome plus 'processed'.
+        """
+        now = now or timezone.now()
+        logger.info(
+            f"Processing scheduled messages at {now} as {self.worker_id} "
+            f"(backend={self.backend}, batch_size={self.batch_size}, dry_run={self.dry_run})"
+        )
+
+        stats = {'processed': 0, 'sent': 0, 'failed': 0, 'deferred': 0}
+        with observe_tick('sweep'):
+            if not self.dry_run:
+                reconcile_stale_sends(now=now)
+            batches = self._fair_batches(now) if self.fair and not self.dry_run else self._oldest_first_batches(now)
+            for due_messages in batches:
+                logger.info(f"{'Found' if self.dry_run else 'Claimed'} {len(due_messages)} messages to process")
+
+                if self.dry_run:
+                    for message in due_messages:
+                        self.reporter(message, 'dry-run', None)
+                else:
+                    for _, outcome, _ in self.dispatch_batch(due_messages):
+                        stats[outcome] += 1
+                stats['processed'] += len(due_messages)
+
+        logger.info(f"Finished processing scheduled messages: {stats}")
+        return stats
+
+    def _oldest_first_batches(self, now):
+        cursor = None
+        while True:
+            if self.dry_run:
+                due_messages = self._peek_due_messages(now, cursor)
+            else:
+                due_messages = claim_due_messages(
+                    limit=self.batch_size,
+                    worker_id=self.worker_id,
+                    now=now,
+                    after=cursor
+                )
+            if not due_messages:
+                return
+            cursor = (due_messages[-1].scheduled_time, due_messages[-1].id)
+            yield due_messages
+
+    def _fair_batches(self, now):
+        """
+        Claim batches in fair order, one ranked window of due messages at a time
+
+        Each window (the oldest SCHEDULER_FAIR_WINDOW due messages, see
+        services.rank_due_messages) is ranked once and claimed batch by
+        batch, and the next window is ranked only when it is used up, so a
+        pass ranks each due message about once. Dispatchers running side by
+        side rank the same window: a batch another one claimed first comes
+        back empty and is skipped. If none of a window can be claimed the
+        rest of the pass walks the backlog oldest first, so it always
+        drains.
+        """
+        while True:
+            window = rank_due_messages(now)
+            if not window:
+                return
+            claimed_any = False
+            for start in range(0, len(window), self.batch_size):
+                due_messages = claim_due_messages(
+                    limit=self.batch_size,
+                    worker_id=self.worker_id,
+                    now=now,
+                    ids=window[start:start + self.batch_size]
+                )
+                if due_messages:
+                    claimed_any = True
+                    yield due_messages
+            if not claimed_any:
+                yield from self._oldest_first_batches(now)
+                return
+
+    def _peek_due_messages(self, now, cursor):
+        queryset = due_messages_queryset(now).order_by('scheduled_time', 'id').only(*DISPATCH_FIELDS)
+        return list(keyset_after(queryset, cursor)[:self.batch_size])
+
+    def dispatch_one(self, message_id):
+        """
+        Send one message now if it is still pending and due
+
+        Returns the outcome, or None if the message was already handled,
+        edited to a later time, or claimed by another worker.
+        """
+        if self.dry_run:
+            message = due_messages_queryset().filter(id=message_id).only(*DISPATCH_FIELDS).first()
+            if message is None:
+                return None
+            self.reporter(message, 'dry-run', None)
+            return 'dry-run'
+
+        with observe_tick('single'):
+            due_messages = claim_due_messages(ids=[message_id], worker_id=self.worker_id)
+            if not due_messages:
+                return None
+            _, outcome, _ = self.dispatch_batch(due_messages)[0]
+        return outcome
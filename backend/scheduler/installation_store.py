@@ -0,0 +1,345 @@
+"""
+Database-backed Slack installation store and bot token resolution
+
+The OAuth flow saves one SlackInstallation row per workspace, or one per
+Enterprise Grid organization for an org-wide install. The send path
+resolves each message's bot token through a small in-process LRU cache with
+a TTL, so a dispatch batch spanning many workspaces costs at most one query
+for the tokens it has not seen recently. A version number in Redis, bumped
+on every installation change, empties the caches of every process, not
+just the one that saw the change.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+import redis
+from django.conf import settings
+from django.db.models import Q
+from slack_sdk.oauth.installation_store import InstallationStore
+from slack_sdk.oauth.installation_store.models.bot import Bot
+from slack_sdk.oauth.installation_store.models.installation import Installation
+
+from .models import SlackInstallation
+
+logger = logging.getLogger(__name__)
+
+class SlackInstallationNotFound(Exception):
+    """
+    No installation (and so no bot token) exists for a message's workspace
+    """
+    def __init__(self, team_id):
+        self.team_id = team_id
+        super().__init__(f"The app is not installed in Slack workspace {team_id}")
+
+def _to_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+def _to_timestamp(value):
+    return value.timestamp() if value is not None else None
+
+class DjangoInstallationStore(InstallationStore):
+    """
+    slack_sdk InstallationStore that keeps installations in SlackInstallation
+
+    Only the latest installation per workspace is kept: saving an
+    installation for a workspace that already has one replaces its tokens.
+    """
+    def __init__(self, client_id=None):
+        self.client_id = client_id or settings.SLACK_CLIENT_ID
+        self._logger = logger
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def _workspace(self, enterprise_id, team_id, is_enterprise_install):
+        # Org-wide installs are keyed by the enterprise alone
+        return {
+            'enterprise_id': enterprise_id or '',
+            'team_id': '' if is_enterprise_install else (team_id or ''),
+        }
+
+    def save(self, installation):
+        SlackInstallation.objects.update_or_create(
+            **self._workspace(installation.enterprise_id, installation.team_id, installation.is_enterprise_install),
+            defaults={
+                'app_id': installation.app_id or '',
+                'enterprise_name': installation.enterprise_name or '',
+                'team_name': installation.team_name or '',
+                'is_enterprise_install': bool(installation.is_enterprise_install),
+                'bot_token': installation.bot_token or '',
+                'bot_id': installation.bot_id or '',
+                'bot_user_id': installation.bot_user_id or '',
+                'bot_scopes': ','.join(installation.bot_scopes or []),
+                'bot_refresh_token': installation.bot_refresh_token or '',
+                'bot_token_expires_at': _to_datetime(installation.bot_token_expires_at),
+                'user_id': installation.user_id or '',
+                'user_token': installation.user_token or '',
+                'user_scopes': ','.join(installation.user_scopes or []),
+                'user_refresh_token': installation.user_refresh_token or '',
+                'user_token_expires_at': _to_datetime(installation.user_token_expires_at),
+                'installed_at': _to_datetime(installation.installed_at),
+            },
+        )
+        invalidate_bot_token(installation.team_id, installation.enterprise_id)
+
+    def save_bot(self, bot):
+        updated = SlackInstallation.objects.filter(
+            **self._workspace(bot.enterprise_id, bot.team_id, bot.is_enterprise_install)
+        ).update(
+            bot_token=bot.bot_token,
+            bot_id=bot.bot_id or '',
+            bot_user_id=bot.bot_user_id or '',
+            bot_scopes=','.join(bot.bot_scopes or []),
+            bot_refresh_token=bot.bot_refresh_token or '',
+            bot_token_expires_at=_to_datetime(bot.bot_token_expires_at),
+        )
+        if not updated:
+            logger.warning(f"No installation to update the bot token of for workspace {bot.team_id}")
+        invalidate_bot_token(bot.team_id, bot.enterprise_id)
+
+    def _find(self, enterprise_id, team_id, is_enterprise_install):
+        return SlackInstallation.objects.filter(
+            **self._workspace(enterprise_id, team_id, is_enterprise_install)
+        ).first()
+
+    def find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        row = self._find(enterprise_id, team_id, is_enterprise_install)
+        if row is None or not row.bot_token:
+            return None
+        return Bot(
+            app_id=row.app_id or None,
+            enterprise_id=row.enterprise_id or None,
+            enterprise_name=row.enterprise_name or None,
+            team_id=row.team_id or None,
+            team_name=row.team_name or None,
+            bot_token=row.bot_token,
+            bot_id=row.bot_id,
+            bot_user_id=row.bot_user_id,
+            bot_scopes=row.bot_scopes,
+            bot_refresh_token=row.bot_refresh_token or None,
+            bot_token_expires_at=_to_timestamp(row.bot_token_expires_at),
+            is_enterprise_install=row.is_enterprise_install,
+            installed_at=row.installed_at.timestamp(),
+        )
+
+    def find_installation(self, *, enterprise_id, team_id, user_id=None, is_enterprise_install=False):
+        row = self._find(enterprise_id, team_id, is_enterprise_install)
+        if row is None or (user_id is not None and row.user_id != user_id):
+            return None
+        return Installation(
+            app_id=row.app_id or None,
+            enterprise_id=row.enterprise_id or None,
+            enterprise_name=row.enterprise_name or None,
+            team_id=row.team_id or None,
+            team_name=row.team_name or None,
+            bot_token=row.bot_token or None,
+            bot_id=row.bot_id or None,
+            bot_user_id=row.bot_user_id or None,
+            bot_scopes=row.bot_scopes,
+            bot_refresh_token=row.bot_refresh_token or None,
+            bot_token_expires_at=_to_timestamp(row.bot_token_expires_at),
+            user_id=row.user_id,
+            user_token=row.user_token or None,
+            user_scopes=row.user_scopes,
+            user_refresh_token=row.user_refresh_token or None,
+            user_token_expires_at=_to_timestamp(row.user_token_expires_at),
+            is_enterprise_install=row.is_enterprise_install,
+            installed_at=row.installed_at.timestamp(),
+        )
+
+    def delete_bot(self, *, enterprise_id, team_id):
+        self.delete_installation(enterprise_id=enterprise_id, team_id=team_id)
+
+    def delete_installation(self, *, enterprise_id, team_id, user_id=None):
+        rows = SlackInstallation.objects.filter(**self._workspace(enterprise_id, team_id, False))
+        if user_id is not None:
+            rows = rows.filter(user_id=user_id)
+        rows.delete()
+        invalidate_bot_token(team_id, enterprise_id)
+
+    def delete_all(self, *, enterprise_id, team_id):
+        self.delete_installation(enterprise_id=enterprise_id, team_id=team_id)
+
+installation_store = DjangoInstallationStore()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after ``ttl`` seconds
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class CacheVersion:
+    """
+    Version number of the bot token caches, shared through Redis
+
+    Every installation change bumps it. A process that reads a version
+    other than the one it last saw empties its cache, so a reinstalled,
+    rotated or revoked token stops being used everywhere within
+    ``check_interval`` seconds. If Redis is unreachable the caches rely on
+    their TTL alone for a short cooldown.
+    """
+    key = 'slack:installations:version'
+    check_interval = 1
+    failure_cooldown = 30
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url or settings.SLACK_INSTALLATION_CACHE_REDIS_URL
+        self._client = redis.Redis.from_url(self.redis_url)
+        self._seen = None
+        self._checked_at = None
+        self._disabled_until = 0
+
+    def _available(self):
+        return time.monotonic() >= self._disabled_until
+
+    def _fail_open(self, error):
+        if self._available():
+            logger.warning(f"Installation cache version unavailable, relying on the cache TTL: {error}")
+        self._disabled_until = time.monotonic() + self.failure_cooldown
+
+    def changed(self):
+        """
+        True if the version moved since the last check
+        """
+        now = time.monotonic()
+        if not self._available() or (self._checked_at is not None and now - self._checked_at < self.check_interval):
+            return False
+        try:
+            version = self._client.get(self.key)
+        except redis.RedisError as e:
+            self._fail_open(e)
+            return False
+        changed = self._checked_at is not None and version != self._seen
+        self._seen = version
+        self._checked_at = now
+        return changed
+
+    def bump(self):
+        if not self._available():
+            return
+        try:
+            self._client.incr(self.key)
+        except redis.RedisError as e:
+            self._fail_open(e)
+
+# Missing installations are cached too, so an uninstalled workspace is not re-queried per message
+_MISSING = object()
+
+_bot_tokens = TTLCache(settings.SLACK_INSTALLATION_CACHE_SIZE, settings.SLACK_INSTALLATION_CACHE_TTL)
+_cache_version = CacheVersion()
+
+def get_bot_tokens(team_ids):
+    """
+    Resolve bot tokens for a set of workspaces in at most one query
+
+    Returns a dict of team_id to bot token, or None for workspaces with no
+    installation. A blank team_id maps to the default SLACK_BOT_TOKEN. An
+    enterprise ID resolves to the organization's org-wide installation.
+    """
+    if _cache_version.changed():
+        _bot_tokens.clear()
+    tokens = {}
+    missing = set()
+    for team_id in set(team_ids):
+        if not team_id:
+            tokens[team_id] = settings.SLACK_BOT_TOKEN
+            continue
+        token = _bot_tokens.get(team_id)
+        if token is None:
+            missing.add(team_id)
+        else:
+            tokens[team_id] = None if token is _MISSING else token
+
+    if missing:
+        rows = (
+            SlackInstallation.objects.filter(
+                Q(team_id__in=missing) | Q(enterprise_id__in=missing, is_enterprise_install=True)
+            )
+            .exclude(bot_token='')
+            .values_list('team_id', 'enterprise_id', 'bot_token')
+        )
+        # Org-wide installs are saved without a team_id
+        found = {team_id or enterprise_id: token for team_id, enterprise_id, token in rows}
+        for team_id in missing:
+            token = found.get(team_id)
+            _bot_tokens.set(team_id, token or _MISSING)
+            tokens[team_id] = token
+    return tokens
+
+def resolve_bot_token(team_id):
+    """
+    Return the bot token to send to ``team_id`` with
+
+    Raises SlackInstallationNotFound if the app is not installed there.
+    """
+    if not team_id:
+        return settings.SLACK_BOT_TOKEN
+    token = get_bot_tokens([team_id])[team_id]
+    if token is None:
+        raise SlackInstallationNotFound(team_id)
+    return token
+
+def forget_bot_token(*team_ids):
+    """
+    Drop this process's cached tokens for a set of workspaces
+
+    Used when Slack rejects a token at send time: the next send re-reads
+    the installation without emptying every other process's cache, which
+    a burst of failures against one revoked workspace would otherwise do
+    once per message.
+    """
+    for team_id in team_ids:
+        if team_id:
+            _bot_tokens.pop(team_id)
+
+def invalidate_bot_token(*team_ids):
+    """
+    Forget cached tokens after a reinstall, rotation or revocation
+
+    Takes workspace and enterprise IDs. Other processes drop their caches
+    when they next see the bumped version.
+    """
+    forget_bot_token(*team_ids)
+    _cache_version.bump()
+
+def clear_bot_tokens():
+    """
+    Forget every cached token
+    """
+    _bot_tokens.clear()
@@ -0,0 +1,65 @@
+"""
+Command-line options shared by the message processing commands
+"""
+from scheduler.dispatcher import BACKENDS
+
+def add_dispatch_arguments(parser):
+    """
+    Add the Dispatcher tuning options to a command's parser
+    """
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=None,
+        help='How to send each batch (defaults to SCHEDULER_DISPATCH_BACKEND)',
+    )
+    parser.add_argument(
+        '--async',
+        action='store_const',
+        const='async',
+        dest='backend',
+        help='Shorthand for --backend async',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=None,
+        help='Maximum concurrent Slack requests for the thread and async backends',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help='Number of due messages claimed per batch',
+    )
+    parser.add_argument(
+        '--fair',
+        action='store_const',
+        const=True,
+        default=None,
+        help='Claim weighted-fair across workspaces, channels and priorities (overrides SCHEDULER_FAIR_DISPATCH)',
+    )
+    parser.add_argument(
+        '--oldest-first',
+        action='store_const',
+        const=False,
+        dest='fair',
+        help='Claim strictly oldest first (overrides SCHEDULER_FAIR_DISPATCH)',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='List the messages that would be sent without sending or changing anything',
+    )
+
+def dispatcher_kwargs(options):
+    """
+    Map parsed options onto Dispatcher keyword arguments
+    """
+    return {
+        'backend': options['backend'],
+        'concurrency': options['concurrency'],
+        'batch_size': options['batch_size'],
+        'dry_run': options['dry_run'],
+        'fair': options['fair'],
+    }
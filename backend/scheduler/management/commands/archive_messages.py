@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from scheduler.retention import archive_messages, get_archive_cutoff, get_purge_cutoff, purge_archive
+
+class Command(BaseCommand):
+    help = 'Move old sent and failed messages to the archive and purge expired archived messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Archive messages scheduled more than this many days ago (defaults to SCHEDULER_RETENTION_DAYS, 0 skips archiving)',
+        )
+        parser.add_argument(
+            '--purge-days',
+            type=int,
+            default=None,
+            help='Delete archived messages scheduled more than this many days ago (defaults to SCHEDULER_ARCHIVE_RETENTION_DAYS, 0 keeps them)',
+        )
+        parser.add_argument(
+            '--export-dir',
+            default=None,
+            help='Write purged messages to a gzipped JSONL file in this directory first (defaults to SCHEDULER_ARCHIVE_EXPORT_DIR)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of messages moved or deleted per transaction (defaults to SCHEDULER_ARCHIVE_BATCH_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        archive_cutoff = get_archive_cutoff(now, options['days'])
+        if archive_cutoff is None:
+            self.stdout.write("Archiving is disabled")
+        else:
+            archived = archive_messages(archive_cutoff, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Archived {archived} messages scheduled before {archive_cutoff}"))
+
+        purge_cutoff = get_purge_cutoff(now, options['purge_days'])
+        if purge_cutoff is not None:
+            purged, path = purge_archive(purge_cutoff, options['batch_size'], options['export_dir'], now)
+            self.stdout.write(self.style.SUCCESS(
+                f"Purged {purged} archived messages scheduled before {purge_cutoff}" + (f", exported to {path}" if path else '')
+            ))
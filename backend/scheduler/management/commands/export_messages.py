@@ -0,0 +1,59 @@
+import gzip
+from datetime import datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from scheduler.retention import export_archive
+
+def parse_bound(value):
+    """
+    A date or datetime option as an aware datetime; a date means its midnight
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+class Command(BaseCommand):
+    help = 'Export archived messages as JSONL, gzipped unless written to stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            required=True,
+            help='File to write, e.g. history.jsonl.gz, or - for uncompressed JSONL on stdout',
+        )
+        parser.add_argument(
+            '--since',
+            default=None,
+            help='Only messages scheduled at or after this date or datetime',
+        )
+        parser.add_argument(
+            '--until',
+            default=None,
+            help='Only messages scheduled before this date or datetime',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of rows read per query (defaults to SCHEDULER_ARCHIVE_BATCH_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        since = parse_bound(options['since']) if options['since'] else None
+        until = parse_bound(options['until']) if options['until'] else None
+
+        if options['output'] == '-':
+            export_archive(self.stdout, since, until, options['batch_size'])
+            return
+
+        with gzip.open(options['output'], 'wt', encoding='utf-8') as output:
+            exported = export_archive(output, since, until, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {exported} archived messages to {options['output']}"))
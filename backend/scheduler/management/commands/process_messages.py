@@ -2,18 +2,22 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 import logging
 
-from scheduler.services import process_scheduled_messages
+from scheduler.dispatcher import Dispatcher
+from ._dispatch_options import add_dispatch_arguments, dispatcher_kwargs
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Process scheduled messages that are due to be sent'
 
+    def add_arguments(self, parser):
+        add_dispatch_arguments(parser)
+
     def handle(self, *args, **options):
         self.stdout.write(f"Starting scheduled message processing at {timezone.now()}")
         
-        count = process_scheduled_messages()
+        stats = Dispatcher(**dispatcher_kwargs(options)).run()
         
         self.stdout.write(
-            self.style.SUCCESS(f"Successfully processed {count} scheduled messages")
+            self.style.SUCCESS(f"Successfully processed {stats['processed']} scheduled messages")
         )
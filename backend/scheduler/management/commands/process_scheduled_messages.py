@@ -4,44 +4,38 @@ Management command to process scheduled messages
 import logging
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from scheduler.models import ScheduledMessage
-from scheduler.services import send_slack_message
+from scheduler.dispatcher import Dispatcher
+from ._dispatch_options import add_dispatch_arguments, dispatcher_kwargs
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Process scheduled messages that are due to be sent'
 
+    def add_arguments(self, parser):
+        add_dispatch_arguments(parser)
+
+    def report(self, message, outcome, error):
+        """
+        Write one line per dispatched message
+        """
+        if outcome == 'sent':
+            self.stdout.write(self.style.SUCCESS(f"Successfully sent message {message.id}"))
+        elif outcome == 'deferred':
+            self.stdout.write(self.style.WARNING(f"Retrying message {message.id} at {message.next_attempt_at}: {str(error)}"))
+        elif outcome == 'dry-run':
+            self.stdout.write(f"Would send message {message.id} to channel {message.channel}")
+        else:
+            logger.error(f"Error processing message {message.id}: {str(error)}")
+            self.stdout.write(self.style.ERROR(f"Error processing message {message.id}: {str(error)}"))
+
     def handle(self, *args, **options):
         now = timezone.now()
         self.stdout.write(f"Processing scheduled messages at {now}")
         
-        # Get all pending messages that are due
-        due_messages = ScheduledMessage.objects.filter(
-            status='pending',
-            scheduled_time__lte=now
-        )
-        
-        self.stdout.write(f"Found {due_messages.count()} messages to process")
-        
-        for message in due_messages:
-            self.stdout.write(f"Processing message {message.id} to channel {message.channel}")
-            
-            try:
-                success = send_slack_message(message.message, message.channel)
-                
-                if success:
-                    message.status = 'sent'
-                    message.save()
-                    self.stdout.write(self.style.SUCCESS(f"Successfully sent message {message.id}"))
-                else:
-                    message.status = 'failed'
-                    message.save()
-                    self.stdout.write(self.style.ERROR(f"Failed to send message {message.id}"))
-            except Exception as e:
-                message.status = 'failed'
-                message.save()
-                logger.error(f"Error processing message {message.id}: {str(e)}")
-                self.stdout.write(self.style.ERROR(f"Error processing message {message.id}: {str(e)}"))
+        stats = Dispatcher(reporter=self.report, **dispatcher_kwargs(options)).run(now=now)
         
-        self.stdout.write(self.style.SUCCESS("Finished processing scheduled messages"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished processing scheduled messages: {stats['sent']} sent, "
+            f"{stats['deferred']} retrying, {stats['failed']} failed"
+        ))
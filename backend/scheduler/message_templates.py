@@ -0,0 +1,119 @@
+"""
+Message templates: text and Block Kit bodies with {{ variable }} placeholders
+
+A scheduled message that uses a template stores only the template
+reference and its own variables, so a personalized campaign costs one
+small row per recipient rather than one fully expanded body. Messages are
+rendered at dispatch time. Each template is compiled once into literal
+chunks and variable slots and kept in a process-wide LRU cache
+(SCHEDULER_TEMPLATE_CACHE_SIZE entries), keyed by its source, so
+rendering thousands of variants only joins strings. Values are escaped
+for Slack (&, < and >), so a variable cannot inject mentions or links.
+"""
+import json
+import re
+from functools import lru_cache
+from django.conf import settings
+
+from .models import MessageTemplate
+
+VARIABLE_PATTERN = re.compile(r'{{\s*([A-Za-z_][A-Za-z0-9_]*)\s*}}')
+
+class TemplateRenderError(Exception):
+    """
+    A template could not be rendered with a message's variables
+    """
+
+def escape_value(value):
+    """
+    Escape a variable's value as Slack requires for message text
+    """
+    return str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+class CompiledText:
+    """
+    A template string split into literal chunks and variable names
+
+    re.split with one group yields literal, name, literal, ... so the names
+    sit at the odd indexes.
+    """
+    __slots__ = ('chunks', 'variables')
+
+    def __init__(self, source):
+        self.chunks = VARIABLE_PATTERN.split(source)
+        self.variables = frozenset(self.chunks[1::2])
+
+    def render(self, values):
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        chunks = self.chunks[:]
+        for index in range(1, len(chunks), 2):
+            chunks[index] = values[chunks[index]]
+        return ''.join(chunks)
+
+class CompiledTemplate:
+    """
+    A compiled template, rendered as ``render(variables) -> (text, blocks)``
+
+    Blocks are compiled as their JSON, with each value JSON-escaped on the
+    way in, so rendering them is one join and one json.loads whatever the
+    block structure.
+    """
+    __slots__ = ('text', 'blocks', 'variables')
+
+    def __init__(self, text, blocks_json=None):
+        self.text = CompiledText(text)
+        self.blocks = CompiledText(blocks_json) if blocks_json is not None else None
+        self.variables = self.text.variables | (self.blocks.variables if self.blocks else frozenset())
+
+    def render(self, variables):
+        missing = self.variables.difference(variables or {})
+        if missing:
+            raise TemplateRenderError(f"Missing template variables: {', '.join(sorted(missing))}")
+        values = {name: escape_value(variables[name]) for name in self.variables}
+        text = self.text.render(values)
+        if self.blocks is None:
+            return text, None
+        # json.dumps adds the quotes; the placeholder already sits inside a JSON string
+        json_values = {name: json.dumps(value)[1:-1] for name, value in values.items()}
+        return text, json.loads(self.blocks.render(json_values))
+
+@lru_cache(maxsize=settings.SCHEDULER_TEMPLATE_CACHE_SIZE)
+def _compile(text, blocks_json):
+    return CompiledTemplate(text, blocks_json)
+
+def compile_template(text, blocks=None):
+    """
+    Compiled form of a template's text and Block Kit blocks, from the LRU cache
+    """
+    return _compile(text, json.dumps(blocks) if blocks is not None else None)
+
+def render_templates(messages):
+    """
+    Render the templated messages of a batch in place
+
+    Templates are loaded in one query. Each templated message gets its
+    rendered ``message`` text and ``blocks``; they are never written back.
+    Returns ``(rendered, failures)``: the messages ready to send, and
+    ``(message, False, TemplateRenderError)`` results for the ones that
+    could not be rendered.
+    """
+    template_ids = {message.template_id for message in messages if message.template_id}
+    if not template_ids:
+        return list(messages), []
+
+    templates = {
+        template.id: compile_template(template.text, template.blocks)
+        for template in MessageTemplate.objects.filter(id__in=template_ids).only('id', 'text', 'blocks')
+    }
+    rendered = []
+    failures = []
+    for message in messages:
+        if message.template_id:
+            try:
+                message.message, message.blocks = templates[message.template_id].render(message.variables)
+            except TemplateRenderError as e:
+                failures.append((message, False, e))
+                continue
+        rendered.append(message)
+    return rendered, failures
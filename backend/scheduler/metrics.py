@@ -0,0 +1,174 @@
+"""
+Prometheus metrics for the dispatcher and the Slack client
+
+Hot-path instrumentation is limited to counter increments and histogram
+observations, each a few microseconds. Anything that needs a query (the
+due backlog) is computed when /metrics is scraped, never while sending.
+
+With several processes (gunicorn workers, Celery prefork children) set
+PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the processes
+of one service; the exporter then aggregates every process's samples.
+"""
+import os
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from slack_sdk.errors import SlackApiError
+
+MESSAGES = Counter(
+    'slack_scheduler_messages_total',
+    'Messages dispatched, by outcome (sent, failed, deferred)',
+    ['outcome'],
+)
+SCHEDULE_LAG = Histogram(
+    'slack_scheduler_schedule_lag_seconds',
+    'Seconds from a message\'s scheduled_time to its successful send',
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+SLACK_API_LATENCY = Histogram(
+    'slack_scheduler_slack_api_duration_seconds',
+    'Slack Web API call latency, by method and error code (ok on success)',
+    ['method', 'error'],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DISPATCH_TICK = Histogram(
+    'slack_scheduler_dispatch_tick_seconds',
+    'Wall time of one dispatcher tick (a sweep, or one timed send)',
+    ['trigger'],
+)
+DISPATCH_DB = Histogram(
+    'slack_scheduler_dispatch_db_seconds',
+    'Database time spent in one dispatcher tick',
+    ['trigger'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+@contextmanager
+def observe_slack_call(method):
+    """
+    Time a Slack Web API call, labelled with its error code
+    """
+    started = time.perf_counter()
+    error = 'ok'
+    try:
+        yield
+    except SlackApiError as e:
+        response = e.response
+        error = (response.get('error') if response is not None else None) or 'unknown'
+        raise
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        if settings.SCHEDULER_METRICS_ENABLED:
+            SLACK_API_LATENCY.labels(method, error).observe(time.perf_counter() - started)
+
+@contextmanager
+def observe_tick(trigger):
+    """
+    Time a dispatcher tick and the database queries made during it
+    """
+    if not settings.SCHEDULER_METRICS_ENABLED:
+        yield
+        return
+
+    db_time = [0.0]
+
+    def time_query(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            db_time[0] += time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(time_query):
+            yield
+    finally:
+        DISPATCH_TICK.labels(trigger).observe(time.perf_counter() - started)
+        DISPATCH_DB.labels(trigger).observe(db_time[0])
+
+def record_outcomes(outcomes, now=None):
+    """
+    Count dispatched messages and observe the schedule lag of sent ones
+    """
+    if not settings.SCHEDULER_METRICS_ENABLED:
+        return
+    now = now or timezone.now()
+    for message, outcome, _ in outcomes:
+        MESSAGES.labels(outcome).inc()
+        if outcome == 'sent':
+            SCHEDULE_LAG.observe(max((now - message.scheduled_time).total_seconds(), 0))
+
+class DueBacklogCollector:
+    """
+    Report the due backlog at scrape time: how many messages are waiting and how overdue the oldest is
+    """
+    def collect(self):
+        from .services import due_messages_queryset
+
+        now = timezone.now()
+        due = due_messages_queryset(now)
+        backlog = GaugeMetricFamily(
+            'slack_scheduler_due_backlog',
+            'Pending messages that are due and not claimed or backing off',
+        )
+        backlog.add_metric([], due.count())
+        yield backlog
+
+        oldest = due.order_by('scheduled_time').values_list('scheduled_time', flat=True).first()
+        age = GaugeMetricFamily(
+            'slack_scheduler_oldest_due_age_seconds',
+            'Seconds the oldest due message has been waiting',
+        )
+        age.add_metric([], (now - oldest).total_seconds() if oldest else 0)
+        yield age
+
+_registry = None
+
+def get_registry():
+    """
+    Registry to export: every process's samples in multiprocess mode, else this process's
+    """
+    global _registry
+    if _registry is None:
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        registry.register(DueBacklogCollector())
+        _registry = registry
+    return _registry
+
+def render_metrics():
+    """
+    Return the exposition body and its content type
+    """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+def start_metrics_server(port=None):
+    """
+    Serve /metrics on its own port, for processes without a web server
+
+    Does nothing unless SCHEDULER_METRICS_PORT (or ``port``) is set.
+    """
+    port = port or settings.SCHEDULER_METRICS_PORT
+    if not port or not settings.SCHEDULER_METRICS_ENABLED:
+        return False
+    start_http_server(port, registry=get_registry())
+    return True
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, help_text='When the current claim was taken; claims expire after the lease', null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='claimed_by',
+            field=models.CharField(blank=True, help_text='The dispatcher worker currently holding this message', max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0002_scheduledmessage_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Number of send attempts made so far'),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='last_error',
+            field=models.TextField(blank=True, default='', help_text='Error from the most recent failed attempt'),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='Earliest time a retry may be attempted', null=True),
+        ),
+    ]
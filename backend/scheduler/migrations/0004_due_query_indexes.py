@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:37
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """
+    Build the index without locking writes on PostgreSQL, where the table is
+    large; other backends (SQLite in development) get a plain CREATE INDEX.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('scheduler', '0003_scheduledmessage_retry'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='scheduledmessage',
+            index=models.Index(fields=['status', 'scheduled_time'], name='scheduler_status_time_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='scheduledmessage',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['scheduled_time', 'id'], name='scheduler_pending_due_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0004_due_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackInstallation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_id', models.CharField(blank=True, default='', max_length=32)),
+                ('enterprise_id', models.CharField(blank=True, default='', max_length=32)),
+                ('enterprise_name', models.CharField(blank=True, default='', max_length=200)),
+                ('team_id', models.CharField(blank=True, default='', max_length=32)),
+                ('team_name', models.CharField(blank=True, default='', max_length=200)),
+                ('is_enterprise_install', models.BooleanField(default=False)),
+                ('bot_token', models.TextField(help_text='Bot token used to send messages to this workspace')),
+                ('bot_id', models.CharField(blank=True, default='', max_length=32)),
+                ('bot_user_id', models.CharField(blank=True, default='', max_length=32)),
+                ('bot_scopes', models.TextField(blank=True, default='')),
+                ('bot_refresh_token', models.TextField(blank=True, default='')),
+                ('bot_token_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('user_id', models.CharField(blank=True, default='', help_text='The user who installed the app', max_length=32)),
+                ('user_token', models.TextField(blank=True, default='')),
+                ('user_scopes', models.TextField(blank=True, default='')),
+                ('user_refresh_token', models.TextField(blank=True, default='')),
+                ('user_token_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('installed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='team_id',
+            field=models.CharField(blank=True, default='', help_text='Slack workspace to send from; blank uses the default bot token', max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='slackinstallation',
+            constraint=models.UniqueConstraint(fields=('enterprise_id', 'team_id'), name='scheduler_installation_workspace_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+from scheduler.operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('scheduler', '0006_oauth_state'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='scheduledmessage',
+            index=models.Index(fields=['scheduled_time', 'id'], name='scheduler_time_id_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='scheduledmessage',
+            index=models.Index(fields=['channel', 'scheduled_time', 'id'], name='scheduler_channel_time_idx'),
+        ),
+    ]
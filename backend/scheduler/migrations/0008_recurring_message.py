@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0007_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField(help_text='The message content to be sent')),
+                ('channel', models.CharField(help_text='The Slack channel to send the message to', max_length=100)),
+                ('team_id', models.CharField(blank=True, default='', help_text='Slack workspace to send from; blank uses the default bot token', max_length=32)),
+                ('rrule', models.TextField(help_text='RFC 5545 recurrence rule, e.g. FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;BYHOUR=9;BYMINUTE=30')),
+                ('dtstart', models.DateTimeField(help_text='First occurrence; the rule repeats from here')),
+                ('timezone', models.CharField(default='UTC', help_text="Time zone the rule's wall-clock times are in", max_length=64)),
+                ('is_active', models.BooleanField(default=True)),
+                ('next_occurrence_at', models.DateTimeField(blank=True, help_text='Next occurrence not yet materialized; empty once the rule is exhausted', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recurringmessage',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['next_occurrence_at'], name='scheduler_recurring_next_idx'),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='recurring',
+            field=models.ForeignKey(blank=True, help_text='The recurring message this is an occurrence of', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='scheduler.recurringmessage'),
+        ),
+        migrations.AddConstraint(
+            model_name='scheduledmessage',
+            constraint=models.UniqueConstraint(condition=models.Q(('recurring__isnull', False)), fields=('recurring', 'scheduled_time'), name='scheduler_recurring_occurrence_uniq'),
+        ),
+    ]
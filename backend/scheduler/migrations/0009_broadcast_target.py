@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0008_recurring_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='is_broadcast',
+            field=models.BooleanField(default=False, help_text='Sent to every channel in targets instead of channel'),
+        ),
+        migrations.AlterField(
+            model_name='scheduledmessage',
+            name='channel',
+            field=models.CharField(blank=True, help_text='The Slack channel to send the message to; blank for broadcasts', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='BroadcastTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(help_text='The Slack channel to send the message to', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('last_error', models.TextField(blank=True, default='', help_text='Error from the most recent failed attempt')),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='scheduler.scheduledmessage')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='broadcasttarget',
+            constraint=models.UniqueConstraint(fields=('message', 'channel'), name='scheduler_broadcast_target_uniq'),
+        ),
+    ]
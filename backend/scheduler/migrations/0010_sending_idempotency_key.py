@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:20
+
+import uuid
+from django.db import migrations, models
+
+
+def populate_idempotency_keys(apps, schema_editor):
+    # A callable default is evaluated once for AddField, so existing rows get their own keys here
+    ScheduledMessage = apps.get_model('scheduler', 'ScheduledMessage')
+    batch = []
+    for message in ScheduledMessage.objects.filter(idempotency_key__isnull=True).only('id').iterator(chunk_size=1000):
+        message.idempotency_key = uuid.uuid4()
+        batch.append(message)
+        if len(batch) >= 1000:
+            ScheduledMessage.objects.bulk_update(batch, ['idempotency_key'])
+            batch = []
+    if batch:
+        ScheduledMessage.objects.bulk_update(batch, ['idempotency_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0009_broadcast_target'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scheduledmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='idempotency_key',
+            field=models.UUIDField(null=True, editable=False),
+        ),
+        migrations.RunPython(populate_idempotency_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='scheduledmessage',
+            name='idempotency_key',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Sent with the post as Slack message metadata, to find it again after a crash'),
+        ),
+    ]
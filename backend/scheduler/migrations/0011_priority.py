@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0010_sending_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringmessage',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Low'), (1, 'Normal'), (2, 'High')], default=1, help_text='Priority of the messages it writes'),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Low'), (1, 'Normal'), (2, 'High')], default=1, help_text="Low for bulk campaigns, high for urgent messages; weights the message's share of dispatch"),
+        ),
+    ]
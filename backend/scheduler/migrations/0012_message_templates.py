@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0011_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('text', models.TextField(help_text='Message text, also the notification fallback when blocks are given')),
+                ('blocks', models.JSONField(blank=True, help_text='Optional Block Kit blocks; placeholders in any string are rendered', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='variables',
+            field=models.JSONField(blank=True, default=dict, help_text="Values for the template's {{ variables }}"),
+        ),
+        migrations.AlterField(
+            model_name='scheduledmessage',
+            name='message',
+            field=models.TextField(blank=True, help_text='The message content to be sent; blank when a template is used'),
+        ),
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='template',
+            field=models.ForeignKey(blank=True, help_text='Template rendered with variables at dispatch time, instead of message', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='scheduler.messagetemplate'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0012_message_templates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('message', models.TextField(blank=True)),
+                ('channel', models.CharField(blank=True, max_length=100)),
+                ('is_broadcast', models.BooleanField(default=False)),
+                ('team_id', models.CharField(blank=True, default='', max_length=32)),
+                ('scheduled_time', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], max_length=20)),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'Low'), (1, 'Normal'), (2, 'High')], default=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('idempotency_key', models.UUIDField()),
+                ('template_id', models.BigIntegerField(blank=True, null=True)),
+                ('variables', models.JSONField(blank=True, default=dict)),
+                ('recurring_id', models.BigIntegerField(blank=True, null=True)),
+                ('targets', models.JSONField(blank=True, default=list, help_text='Channel, status, last error and send time of each broadcast target')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(help_text='When the outcome was recorded')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scheduled_time', 'id'], name='scheduler_archive_time_idx')],
+            },
+        ),
+    ]
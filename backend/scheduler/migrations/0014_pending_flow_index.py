@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+from scheduler.operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('scheduler', '0013_archived_messages'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='scheduledmessage',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['team_id', 'channel', '-priority', 'scheduled_time', 'id'], name='scheduler_pending_flow_idx'),
+        ),
+    ]
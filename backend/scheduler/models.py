@@ -1,3 +1,6 @@
+import uuid
+from zoneinfo import ZoneInfo
+from dateutil.rrule import rrulestr
 from django.db import models
 from django.utils import timezone
 
@@ -7,21 +10,232 @@ class ScheduledMessage(models.Model):
     """Model for scheduled Slack messages"""
     STATUS_CHOICES = (
         ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
     )
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_HIGH = 2
+    PRIORITY_CHOICES = (
+        (PRIORITY_LOW, 'Low'),
+        (PRIORITY_NORMAL, 'Normal'),
+        (PRIORITY_HIGH, 'High'),
+    )
     
-    message = models.TextField(help_text="The message content to be sent")
-    channel = models.CharField(max_length=100, help_text="The Slack channel to send the message to")
+    message = models.TextField(blank=True, help_text="The message content to be sent; blank when a template is used")
+    channel = models.CharField(max_length=100, blank=True, help_text="The Slack channel to send the message to; blank for broadcasts")
+    is_broadcast = models.BooleanField(default=False, help_text="Sent to every channel in targets instead of channel")
+    team_id = models.CharField(max_length=32, blank=True, default='', help_text="Slack workspace to send from; blank uses the default bot token")
     scheduled_time = models.DateTimeField(help_text="When the message should be sent")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL, help_text="Low for bulk campaigns, high for urgent messages; weights the message's share of dispatch")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True, help_text="The dispatcher worker currently holding this message")
+    claimed_at = models.DateTimeField(null=True, blank=True, help_text="When the current claim was taken; claims expire after the lease")
+    attempts = models.PositiveIntegerField(default=0, help_text="Number of send attempts made so far")
+    next_attempt_at = models.DateTimeField(null=True, blank=True, help_text="Earliest time a retry may be attempted")
+    last_error = models.TextField(blank=True, default='', help_text="Error from the most recent failed attempt")
+    idempotency_key = models.UUIDField(default=uuid.uuid4, editable=False, help_text="Sent with the post as Slack message metadata, to find it again after a crash")
+    recurring = models.ForeignKey(
+        'RecurringMessage',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='occurrences',
+        help_text="The recurring message this is an occurrence of"
+    )
+    template = models.ForeignKey(
+        'MessageTemplate',
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='messages',
+        help_text="Template rendered with variables at dispatch time, instead of message"
+    )
+    variables = models.JSONField(default=dict, blank=True, help_text="Values for the template's {{ variables }}")
+    
+    # Block Kit blocks rendered from the template at dispatch time; never stored
+    blocks = None
+    
+    class Meta:
+        constraints = [
+            # Materializing the same occurrence twice is a no-op; partial, so one-shot rows stay out of the index
+            models.UniqueConstraint(
+                fields=['recurring', 'scheduled_time'],
+                condition=models.Q(recurring__isnull=False),
+                name='scheduler_recurring_occurrence_uniq',
+            ),
+        ]
+        indexes = [
+            # Serves the dispatcher's due-query and the status filters in the API
+            models.Index(fields=['status', 'scheduled_time'], name='scheduler_status_time_idx'),
+            # Only pending rows are ever dispatched; a partial index stays small as sent history grows
+            models.Index(
+                fields=['scheduled_time', 'id'],
+                condition=models.Q(status='pending'),
+                name='scheduler_pending_due_idx',
+            ),
+            # Keyset order of the paginated message list, unfiltered and filtered by channel
+            models.Index(fields=['scheduled_time', 'id'], name='scheduler_time_id_idx'),
+            # Per-channel order of the weighted-fair claim, so its window functions need no sort
+            models.Index(
+                fields=['team_id', 'channel', '-priority', 'scheduled_time', 'id'],
+                condition=models.Q(status='pending'),
+                name='scheduler_pending_flow_idx',
+            ),
+            models.Index(fields=['channel', 'scheduled_time', 'id'], name='scheduler_channel_time_idx'),
+        ]
     
     def __str__(self):
+        if self.is_broadcast:
+            return f"Broadcast at {self.scheduled_time}"
         return f"Message to {self.channel} at {self.scheduled_time}"
     
     @property
     def is_due(self):
         """Check if the message is due to be sent"""
         return self.status == 'pending' and self.scheduled_time <= timezone.now()
+
+
+class BroadcastTarget(models.Model):
+    """One channel a broadcast message is sent to, with its own delivery status"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    
+    message = models.ForeignKey(ScheduledMessage, on_delete=models.CASCADE, related_name='targets')
+    channel = models.CharField(max_length=100, help_text="The Slack channel to send the message to")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    last_error = models.TextField(blank=True, default='', help_text="Error from the most recent failed attempt")
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            # Also serves the dispatcher's lookup of a broadcast's targets
+            models.UniqueConstraint(fields=['message', 'channel'], name='scheduler_broadcast_target_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"Broadcast {self.message_id} to {self.channel}"
+
+
+class RecurringMessage(models.Model):
+    """Message sent on a recurrence rule, e.g. a daily standup prompt"""
+    message = models.TextField(help_text="The message content to be sent")
+    channel = models.CharField(max_length=100, help_text="The Slack channel to send the message to")
+    team_id = models.CharField(max_length=32, blank=True, default='', help_text="Slack workspace to send from; blank uses the default bot token")
+    rrule = models.TextField(help_text="RFC 5545 recurrence rule, e.g. FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;BYHOUR=9;BYMINUTE=30")
+    dtstart = models.DateTimeField(help_text="First occurrence; the rule repeats from here")
+    timezone = models.CharField(max_length=64, default='UTC', help_text="Time zone the rule's wall-clock times are in")
+    priority = models.PositiveSmallIntegerField(choices=ScheduledMessage.PRIORITY_CHOICES, default=ScheduledMessage.PRIORITY_NORMAL, help_text="Priority of the messages it writes")
+    is_active = models.BooleanField(default=True)
+    next_occurrence_at = models.DateTimeField(null=True, blank=True, help_text="Next occurrence not yet materialized; empty once the rule is exhausted")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # The materializer only looks at active rules whose next occurrence is near
+            models.Index(
+                fields=['next_occurrence_at'],
+                condition=models.Q(is_active=True),
+                name='scheduler_recurring_next_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Recurring message to {self.channel} ({self.rrule})"
+    
+    def get_rrule(self):
+        """Build the dateutil rule, anchored at dtstart in the rule's time zone"""
+        dtstart = self.dtstart.astimezone(ZoneInfo(self.timezone))
+        return rrulestr(self.rrule, dtstart=dtstart)
+
+
+class SlackInstallation(models.Model):
+    """Bot installation of the app in one Slack workspace, saved by the OAuth flow"""
+    app_id = models.CharField(max_length=32, blank=True, default='')
+    enterprise_id = models.CharField(max_length=32, blank=True, default='')
+    enterprise_name = models.CharField(max_length=200, blank=True, default='')
+    team_id = models.CharField(max_length=32, blank=True, default='')
+    team_name = models.CharField(max_length=200, blank=True, default='')
+    is_enterprise_install = models.BooleanField(default=False)
+    bot_token = models.TextField(help_text="Bot token used to send messages to this workspace")
+    bot_id = models.CharField(max_length=32, blank=True, default='')
+    bot_user_id = models.CharField(max_length=32, blank=True, default='')
+    bot_scopes = models.TextField(blank=True, default='')
+    bot_refresh_token = models.TextField(blank=True, default='')
+    bot_token_expires_at = models.DateTimeField(null=True, blank=True)
+    user_id = models.CharField(max_length=32, blank=True, default='', help_text="The user who installed the app")
+    user_token = models.TextField(blank=True, default='')
+    user_scopes = models.TextField(blank=True, default='')
+    user_refresh_token = models.TextField(blank=True, default='')
+    user_token_expires_at = models.DateTimeField(null=True, blank=True)
+    installed_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            # One row per workspace; reinstalling replaces the tokens
+            models.UniqueConstraint(fields=['enterprise_id', 'team_id'], name='scheduler_installation_workspace_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"Installation for {self.team_name or self.team_id or self.enterprise_id}"
+
+
+class MessageTemplate(models.Model):
+    """Reusable message body with {{ variable }} placeholders, rendered per message at dispatch time"""
+    name = models.CharField(max_length=100, unique=True)
+    text = models.TextField(help_text="Message text, also the notification fallback when blocks are given")
+    blocks = models.JSONField(null=True, blank=True, help_text="Optional Block Kit blocks; placeholders in any string are rendered")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class ArchivedMessage(models.Model):
+    """Sent or failed scheduled message moved out of the hot table by the retention job"""
+    # The original primary key; related rows are plain ids, as the template or rule may be deleted later
+    id = models.BigIntegerField(primary_key=True)
+    message = models.TextField(blank=True)
+    channel = models.CharField(max_length=100, blank=True)
+    is_broadcast = models.BooleanField(default=False)
+    team_id = models.CharField(max_length=32, blank=True, default='')
+    scheduled_time = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=ScheduledMessage.STATUS_CHOICES)
+    priority = models.PositiveSmallIntegerField(choices=ScheduledMessage.PRIORITY_CHOICES, default=ScheduledMessage.PRIORITY_NORMAL)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    idempotency_key = models.UUIDField()
+    template_id = models.BigIntegerField(null=True, blank=True)
+    variables = models.JSONField(default=dict, blank=True)
+    recurring_id = models.BigIntegerField(null=True, blank=True)
+    targets = models.JSONField(default=list, blank=True, help_text="Channel, status, last error and send time of each broadcast target")
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(help_text="When the outcome was recorded")
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            # Export and purge walk the archive in scheduled-time order
+            models.Index(fields=['scheduled_time', 'id'], name='scheduler_archive_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived message {self.id} ({self.status})"
+
+
+class OAuthState(models.Model):
+    """One-time OAuth state parameter issued when a Slack install starts"""
+    state = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"OAuth state expiring at {self.expires_at}"
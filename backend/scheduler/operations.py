@@ -0,0 +1,22 @@
+"""
+Custom migration operations for the scheduler app
+"""
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """
+    Build the index without locking writes on PostgreSQL, where the table is
+    large; other backends (SQLite in development) get a plain CREATE INDEX.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+    
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
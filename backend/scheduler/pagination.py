@@ -0,0 +1,26 @@
+"""
+Pagination for the scheduler API
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+class ScheduledMessagePagination(CursorPagination):
+    """
+    Cursor pagination over (scheduled_time, id), newest first
+
+    Each page is one indexed range scan after the previous page's last row,
+    so a page costs the same however deep into the history it is.
+    """
+    ordering = ('-scheduled_time', '-id')
+    page_size = settings.SCHEDULER_API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SCHEDULER_API_MAX_PAGE_SIZE
+
+class BroadcastTargetPagination(CursorPagination):
+    """
+    Cursor pagination over a broadcast's targets, in the order they were added
+    """
+    ordering = ('id',)
+    page_size = settings.SCHEDULER_API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SCHEDULER_API_MAX_PAGE_SIZE
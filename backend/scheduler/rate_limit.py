@@ -0,0 +1,252 @@
+"""
+Shared Slack rate limiting backed by Redis
+
+Every worker reserves a token from the same Redis buckets before calling
+Slack, so the limits hold across Celery workers, scheduler_runner instances
+and web processes alike.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Requests per minute for Slack's documented Web API tiers
+TIER_RATES_PER_MINUTE = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+# Tier of each Web API method we call. chat.postMessage is in Slack's
+# "special" tier: roughly one message per second per channel, plus a
+# workspace-wide ceiling that is configured separately.
+METHOD_TIERS = {
+    'chat.postMessage': 'special',
+    'conversations.list': 2,
+    'conversations.history': 3,
+    'conversations.info': 3,
+    'oauth.v2.access': 4,
+}
+
+# Reserves one token from each bucket and returns how long the caller must
+# wait before using it. Tokens may go negative: that is a queued reservation,
+# so concurrent callers are spaced out instead of all retrying at once.
+# Each bucket also has a companion "blocked until" key set from Retry-After.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+
+for i = 1, #KEYS, 2 do
+    local bucket_key = KEYS[i]
+    local block_key = KEYS[i + 1]
+    local rate = tonumber(ARGV[i])
+    local capacity = tonumber(ARGV[i + 1])
+
+    local state = redis.call('HMGET', bucket_key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate) - 1
+
+    if tokens < 0 then
+        wait = math.max(wait, -tokens / rate)
+    end
+
+    redis.call('HSET', bucket_key, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', bucket_key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+
+    local blocked_until = tonumber(redis.call('GET', block_key))
+    if blocked_until and blocked_until > now then
+        wait = math.max(wait, blocked_until - now)
+    end
+end
+
+return tostring(wait)
+"""
+
+# Hands back a reservation the caller gave up on, so it does not delay the
+# callers queued behind it. Buckets that have already expired are left alone.
+TOKEN_REFUND_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('HINCRBYFLOAT', KEYS[i], 'tokens', 1)
+    end
+end
+return 1
+"""
+
+class SlackRateLimitedError(Exception):
+    """
+    Slack kept answering ``ratelimited``, or the shared limiter asked for a
+    longer wait than SLACK_RATE_LIMIT_MAX_WAIT, and the call should be
+    retried later
+    """
+    def __init__(self, channel, retry_after):
+        self.channel = channel
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited by Slack on {channel}; retry after {retry_after}s")
+
+def get_retry_after(error):
+    """
+    Return the Retry-After delay in seconds for a rate-limited SlackApiError, else None
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    if response.status_code != 429 and response.get('error') != 'ratelimited':
+        return None
+    headers = {name.lower(): value for name, value in (response.headers or {}).items()}
+    retry_after = headers.get('retry-after')
+    if isinstance(retry_after, list):
+        retry_after = retry_after[0] if retry_after else None
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+def _workspace_key(token):
+    """
+    Identify a workspace by a digest of its bot token, never the token itself
+    """
+    return hashlib.sha256((token or '').encode('utf-8')).hexdigest()[:16]
+
+class SlackRateLimiter:
+    """
+    Token-bucket limiter keyed by Slack method, workspace token and channel
+
+    If Redis is unreachable the limiter fails open (no waiting) for a short
+    cooldown, so an outage of the shared store never stops message delivery.
+    A caller is never made to wait longer than SLACK_RATE_LIMIT_MAX_WAIT:
+    past that its reservation is returned and SlackRateLimitedError raised.
+    """
+    key_prefix = 'slack:ratelimit'
+    failure_cooldown = 30
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url or settings.SLACK_RATE_LIMIT_REDIS_URL
+        self._client = redis.Redis.from_url(self.redis_url)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._refund_script = self._client.register_script(TOKEN_REFUND_SCRIPT)
+        self._disabled_until = 0
+
+    def _buckets(self, method, token, channel=None):
+        """
+        Build the (bucket key, block key, rate, capacity) entries for a call
+        """
+        workspace = _workspace_key(token)
+        tier = METHOD_TIERS.get(method, 3)
+        buckets = []
+
+        if tier == 'special':
+            if channel:
+                buckets.append((
+                    f"{self.key_prefix}:{workspace}:channel:{channel}",
+                    settings.SLACK_CHANNEL_RATE_PER_SECOND,
+                    settings.SLACK_CHANNEL_BURST,
+                ))
+            buckets.append((
+                f"{self.key_prefix}:{workspace}:{method}",
+                settings.SLACK_WORKSPACE_RATE_PER_SECOND,
+                settings.SLACK_WORKSPACE_BURST,
+            ))
+        else:
+            per_second = TIER_RATES_PER_MINUTE[tier] / 60.0
+            buckets.append((
+                f"{self.key_prefix}:{workspace}:{method}",
+                per_second,
+                max(1, TIER_RATES_PER_MINUTE[tier] // 10),
+            ))
+
+        keys = []
+        args = []
+        for bucket_key, rate, capacity in buckets:
+            keys.extend([bucket_key, f"{bucket_key}:blocked"])
+            args.extend([rate, capacity])
+        return keys, args
+
+    def _available(self):
+        return time.monotonic() >= self._disabled_until
+
+    def _fail_open(self, error):
+        # Concurrent callers can fail together; only the first one logs
+        if self._available():
+            logger.warning(f"Slack rate limiter unavailable, sending without limits: {error}")
+        self._disabled_until = time.monotonic() + self.failure_cooldown
+        return 0.0
+
+    def reserve(self, method, token, channel=None):
+        """
+        Reserve a slot and return the seconds to wait before making the call
+
+        Raises SlackRateLimitedError, without keeping the slot, when the wait
+        would exceed SLACK_RATE_LIMIT_MAX_WAIT.
+        """
+        if not self._available():
+            return 0.0
+        keys, args = self._buckets(method, token, channel)
+        try:
+            wait = float(self._script(keys=keys, args=args))
+        except redis.RedisError as e:
+            return self._fail_open(e)
+        if wait > settings.SLACK_RATE_LIMIT_MAX_WAIT:
+            try:
+                self._refund_script(keys=keys[::2])
+            except redis.RedisError as e:
+                self._fail_open(e)
+            raise SlackRateLimitedError(channel or method, wait)
+        return wait
+
+    def acquire(self, method, token, channel=None):
+        """
+        Block until a call to ``method`` is allowed
+        """
+        wait = self.reserve(method, token, channel)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, method, token, channel=None):
+        """
+        Asyncio variant of acquire() that waits without blocking the event loop
+
+        The reservation goes through the sync client in a worker thread:
+        async Redis clients are bound to the loop that created them, and
+        the async dispatcher starts a new loop for every batch.
+        """
+        wait = await asyncio.to_thread(self.reserve, method, token, channel)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def block(self, method, token, channel, retry_after):
+        """
+        Record a Retry-After from Slack so every worker backs off the channel
+        """
+        if not self._available():
+            return
+        keys, _ = self._buckets(method, token, channel)
+        block_key = keys[1]
+        try:
+            seconds, microseconds = self._client.time()
+            until = seconds + microseconds / 1000000 + retry_after
+            self._client.set(block_key, until, px=int(retry_after * 1000) + 1000)
+        except redis.RedisError as e:
+            self._fail_open(e)
+
+_rate_limiter = None
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter, or None when limiting is disabled
+    """
+    global _rate_limiter
+    if not settings.SLACK_RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = SlackRateLimiter()
+    return _rate_limiter
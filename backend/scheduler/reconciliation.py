@@ -0,0 +1,229 @@
+"""
+Settle messages left in 'sending' by a worker that stopped mid-send
+
+A claimed message is 'sending' from its claim until its outcome is
+written. If the worker dies in between, nobody knows whether Slack got the
+post. Every post carries the message's idempotency key as message
+metadata, so once the claim's lease has run out the channel history since
+the claim is searched for it: a post that is found is recorded as sent,
+and only a message that verifiably was not posted goes back to pending to
+be sent again.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from slack_sdk.errors import SlackApiError
+
+from .broadcasts import count_targets, get_broadcast_result
+from .channels import CHANNEL_ID_PATTERN, resolve_channel
+from .installation_store import get_bot_tokens
+from .models import BroadcastTarget, ScheduledMessage
+from .rate_limit import get_rate_limiter
+from .services import (
+    DISPATCH_FIELDS,
+    METADATA_EVENT_TYPE,
+    classify_send_error,
+    get_slack_client,
+)
+
+logger = logging.getLogger(__name__)
+
+# The post cannot exist: Slack would have refused it for the same reason
+NOT_POSTED_ERRORS = {'channel_not_found', 'not_in_channel', 'is_archived'}
+
+# History is searched from this long before the claim, in case our clock runs ahead of Slack's
+CLOCK_SKEW = timedelta(minutes=5)
+
+class UnverifiedSendError(Exception):
+    """
+    Whether a message was posted before its worker stopped cannot be checked
+    """
+    def __init__(self, error):
+        super().__init__(f"Could not check whether the message was posted before its worker stopped: {error}")
+
+class UnresolvedChannelError(Exception):
+    """
+    A channel stored by name could not be resolved to the ID its history is read by
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        super().__init__(f"Channel {channel} is stored by name and could not be resolved to a channel ID")
+
+def find_posted_message(client, channel, idempotency_key, since):
+    """
+    Return the ts of the post tagged with ``idempotency_key`` in ``channel``, or None
+
+    Only history newer than ``since`` is searched.
+    """
+    limiter = get_rate_limiter()
+    key = str(idempotency_key)
+    oldest = f"{(since - CLOCK_SKEW).timestamp():.6f}"
+    cursor = None
+    while True:
+        if limiter:
+            limiter.acquire('conversations.history', client.token)
+        response = client.conversations_history(
+            channel=channel,
+            oldest=oldest,
+            include_all_metadata=True,
+            limit=200,
+            cursor=cursor,
+        )
+        for message in response.get('messages', []):
+            metadata = message.get('metadata') or {}
+            if (
+                metadata.get('event_type') == METADATA_EVENT_TYPE
+                and (metadata.get('event_payload') or {}).get('idempotency_key') == key
+            ):
+                return message['ts']
+        cursor = (response.get('response_metadata') or {}).get('next_cursor')
+        if not cursor:
+            return None
+
+def check_posted(client, channel, message):
+    """
+    True if the post is in the channel, False if it verifiably is not
+
+    Raises the SlackApiError (or network error) if the history cannot be read.
+    conversations.history only takes IDs, so a channel stored by name (the
+    directory was off or unavailable when it was scheduled) is resolved
+    first; if that fails UnresolvedChannelError is raised, because Slack's
+    channel_not_found for a name says nothing about whether it was posted.
+    """
+    if not CHANNEL_ID_PATTERN.match(channel):
+        try:
+            resolved = resolve_channel(channel, message.team_id)
+        except Exception as e:
+            raise UnresolvedChannelError(channel) from e
+        if not CHANNEL_ID_PATTERN.match(resolved):
+            raise UnresolvedChannelError(channel)
+        channel = resolved
+    try:
+        return find_posted_message(client, channel, message.idempotency_key, message.claimed_at) is not None
+    except SlackApiError as e:
+        # A DM posted to a user ID lives in a conversation the user ID cannot be looked up as
+        if e.response.get('error') in NOT_POSTED_ERRORS and not channel.startswith(('U', 'W')):
+            return False
+        raise
+
+def settle(message, now, **fields):
+    """
+    Write a reconciled outcome, unless the claim changed hands meanwhile
+    """
+    return ScheduledMessage.objects.filter(
+        id=message.id,
+        status='sending',
+        claimed_by=message.claimed_by
+    ).update(claimed_by=None, claimed_at=None, updated_at=now, **fields)
+
+def settle_sent(message, now):
+    return settle(message, now, status='sent', attempts=F('attempts') + 1, next_attempt_at=None, last_error='')
+
+def settle_failed(message, now, error):
+    return settle(message, now, status='failed', attempts=F('attempts') + 1, next_attempt_at=None, last_error=str(error))
+
+def settle_unverified(message, now, error):
+    """
+    Apply SCHEDULER_RESEND_UNVERIFIED to a message whose post cannot be looked up
+    """
+    logger.warning(f"Cannot verify whether message {message.id} was posted: {error}")
+    if settings.SCHEDULER_RESEND_UNVERIFIED:
+        return settle(message, now, status='pending')
+    return settle_failed(message, now, UnverifiedSendError(error))
+
+def reconcile_message(message, client, now):
+    """
+    Settle one stale message; returns 'sent', 'failed', 'pending', or None to try again later
+    """
+    try:
+        if message.is_broadcast:
+            return reconcile_broadcast(message, client, now)
+        if check_posted(client, message.channel, message):
+            settle_sent(message, now)
+            return 'sent'
+        settle(message, now, status='pending')
+        return 'pending'
+    except Exception as e:
+        transient, _ = classify_send_error(e)
+        if transient:
+            logger.warning(f"Reconciling message {message.id} failed, will retry: {e}")
+            return None
+        settle_unverified(message, now, e)
+        return 'pending' if settings.SCHEDULER_RESEND_UNVERIFIED else 'failed'
+
+def reconcile_broadcast(message, client, now):
+    """
+    Check every pending target of a stale broadcast, marking the ones already posted
+    """
+    posted = []
+    unverified = []
+    for target in BroadcastTarget.objects.filter(message=message, status='pending').only('id', 'channel'):
+        try:
+            if check_posted(client, target.channel, message):
+                posted.append(target.id)
+        except Exception as e:
+            if classify_send_error(e)[0]:
+                raise
+            target.last_error = str(UnverifiedSendError(e))
+            unverified.append(target)
+
+    if posted:
+        BroadcastTarget.objects.filter(id__in=posted).update(status='sent', sent_at=now, last_error='')
+    if unverified and not settings.SCHEDULER_RESEND_UNVERIFIED:
+        for target in unverified:
+            target.status = 'failed'
+        BroadcastTarget.objects.bulk_update(unverified, ['status', 'last_error'])
+
+    counts = count_targets([message.id]).get(message.id)
+    if counts and counts['pending']:
+        settle(message, now, status='pending')
+        return 'pending'
+    success, error = get_broadcast_result(counts)
+    if success:
+        settle_sent(message, now)
+        return 'sent'
+    settle_failed(message, now, error)
+    return 'failed'
+
+def stale_sends_queryset(now=None):
+    """
+    Messages stuck in 'sending' past the claim lease
+    """
+    now = now or timezone.now()
+    lease_expired_before = now - timedelta(seconds=settings.SCHEDULER_CLAIM_LEASE_SECONDS)
+    return ScheduledMessage.objects.filter(status='sending', claimed_at__lt=lease_expired_before)
+
+def reconcile_stale_sends(now=None, limit=None):
+    """
+    Settle up to ``limit`` messages whose worker stopped mid-send
+
+    Messages found in their channel's history are marked sent; messages
+    that were not posted go back to pending and are sent by the next
+    dispatch. Returns a dict of counts per outcome.
+    """
+    now = now or timezone.now()
+    limit = limit or settings.SCHEDULER_CLAIM_BATCH_SIZE
+    stale = list(
+        stale_sends_queryset(now)
+        .order_by('claimed_at')
+        .only(*DISPATCH_FIELDS, 'claimed_at')[:limit]
+    )
+    stats = {'sent': 0, 'failed': 0, 'pending': 0, 'retry': 0}
+    if not stale:
+        return stats
+
+    tokens = get_bot_tokens(message.team_id for message in stale)
+    for message in stale:
+        token = tokens[message.team_id]
+        if token is None and message.team_id:
+            # Uninstalled workspace: nothing can be checked, and nothing could be resent
+            settle_failed(message, now, UnverifiedSendError('the workspace is not installed'))
+            stats['failed'] += 1
+            continue
+        outcome = reconcile_message(message, get_slack_client(token), now)
+        stats[outcome or 'retry'] += 1
+
+    logger.info(f"Reconciled messages left sending by stopped workers: {stats}")
+    return stats
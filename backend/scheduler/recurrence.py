@@ -0,0 +1,152 @@
+"""
+Materialize recurring messages into ScheduledMessage rows
+
+Only occurrences inside a rolling horizon are ever written, so the
+scheduled message table and the due-query stay small however long a
+recurrence runs. Each rule keeps a cursor (``next_occurrence_at``), so a
+pass only expands occurrences it has not written yet, and the unique
+(recurring, scheduled_time) constraint makes repeating a pass harmless.
+"""
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RecurringMessage, ScheduledMessage
+
+logger = logging.getLogger(__name__)
+
+def get_next_occurrence(recurring, after, inclusive=False):
+    """
+    First occurrence of the rule after ``after``, or None if it has ended
+    """
+    occurrence = recurring.get_rrule().after(after, inc=inclusive)
+    return occurrence.astimezone(dt_timezone.utc) if occurrence else None
+
+def reset_recurrence(recurring, now=None):
+    """
+    Restart a rule's cursor after it is created or edited
+
+    Pending occurrences that have not come due are removed so they are
+    rematerialized from the current rule; the cursor restarts at the first
+    occurrence from now on.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        ScheduledMessage.objects.filter(
+            recurring=recurring,
+            status='pending',
+            scheduled_time__gt=now
+        ).delete()
+        recurring.next_occurrence_at = (
+            get_next_occurrence(recurring, now, inclusive=True) if recurring.is_active else None
+        )
+        RecurringMessage.objects.filter(id=recurring.id).update(next_occurrence_at=recurring.next_occurrence_at)
+
+def materialize_recurring_message(recurring, now=None):
+    """
+    Write a rule's occurrences that fall inside the horizon
+
+    At most SCHEDULER_RECURRING_MAX_OCCURRENCES rows are written per rule
+    per pass. Occurrences more than SCHEDULER_RECURRING_MAX_LATENESS behind
+    (e.g. after an outage) are skipped rather than sent late. The cursor
+    only advances if no other worker moved it first, so concurrent passes
+    never skip or duplicate an occurrence. Returns the ``(id, scheduled_time,
+    priority)`` of each message written.
+    """
+    now = now or timezone.now()
+    horizon_end = now + timedelta(seconds=settings.SCHEDULER_RECURRING_HORIZON)
+    cursor = recurring.next_occurrence_at
+    occurrence = cursor
+
+    earliest = now - timedelta(seconds=settings.SCHEDULER_RECURRING_MAX_LATENESS)
+    if occurrence is not None and occurrence < earliest:
+        occurrence = get_next_occurrence(recurring, earliest, inclusive=True)
+
+    occurrences = []
+    while (
+        occurrence is not None
+        and occurrence <= horizon_end
+        and len(occurrences) < settings.SCHEDULER_RECURRING_MAX_OCCURRENCES
+    ):
+        occurrences.append(occurrence)
+        occurrence = get_next_occurrence(recurring, occurrence)
+
+    if occurrence == cursor:
+        return []
+
+    with transaction.atomic():
+        advanced = RecurringMessage.objects.filter(
+            id=recurring.id,
+            next_occurrence_at=cursor
+        ).update(next_occurrence_at=occurrence)
+        if not advanced:
+            # Another pass got here first, or the rule was edited meanwhile
+            return []
+        ScheduledMessage.objects.bulk_create(
+            [
+                ScheduledMessage(
+                    message=recurring.message,
+                    channel=recurring.channel,
+                    team_id=recurring.team_id,
+                    scheduled_time=scheduled_time,
+                    priority=recurring.priority,
+                    recurring=recurring,
+                )
+                for scheduled_time in occurrences
+            ],
+            ignore_conflicts=True,
+        )
+    recurring.next_occurrence_at = occurrence
+
+    # ignore_conflicts leaves primary keys unset, so read back what was written
+    return list(
+        ScheduledMessage.objects.filter(recurring=recurring, scheduled_time__in=occurrences)
+        .values_list('id', 'scheduled_time', 'priority')
+    )
+
+def schedule_recurring_message(recurring, now=None):
+    """
+    Reset a created or edited rule and write its first occurrences at once
+
+    Timed sends for them are enqueued after the surrounding transaction
+    commits.
+    """
+    from .tasks import enqueue_messages_dispatch
+
+    reset_recurrence(recurring, now=now)
+    if recurring.next_occurrence_at is None:
+        return []
+    written = materialize_recurring_message(recurring, now=now)
+    if written:
+        transaction.on_commit(lambda: enqueue_messages_dispatch(written))
+    return written
+
+def materialize_recurring_messages(now=None):
+    """
+    Materialize every active rule whose next occurrence is inside the horizon
+
+    Returns the number of occurrences written. Timed sends are enqueued for
+    them, since bulk_create sends no post_save.
+    """
+    from .tasks import enqueue_messages_dispatch
+
+    now = now or timezone.now()
+    horizon_end = now + timedelta(seconds=settings.SCHEDULER_RECURRING_HORIZON)
+    rules = RecurringMessage.objects.filter(
+        is_active=True,
+        next_occurrence_at__lte=horizon_end
+    ).order_by('next_occurrence_at')
+
+    written = []
+    for recurring in rules.iterator():
+        try:
+            written.extend(materialize_recurring_message(recurring, now=now))
+        except Exception as e:
+            logger.error(f"Error materializing recurring message {recurring.id}: {str(e)}")
+
+    if written:
+        logger.info(f"Materialized {len(written)} recurring message occurrences")
+        enqueue_messages_dispatch(written)
+    return len(written)
@@ -0,0 +1,183 @@
+"""
+Retention of sent and failed message history
+
+The dispatcher and the message list only need pending and recent rows, so
+finished messages older than SCHEDULER_RETENTION_DAYS are moved, in
+batches, from scheduler_scheduledmessage to the ArchivedMessage table.
+Archived history can be exported as gzipped JSONL, and once older than
+SCHEDULER_ARCHIVE_RETENTION_DAYS it is deleted, after being written to
+SCHEDULER_ARCHIVE_EXPORT_DIR when that is set. Every step works in short
+transactions of SCHEDULER_ARCHIVE_BATCH_SIZE rows, so the hot table is
+never locked for long however much history has built up.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from .models import ArchivedMessage, BroadcastTarget, ScheduledMessage
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('sent', 'failed')
+
+def get_archive_cutoff(now=None, days=None):
+    """
+    Messages scheduled before this are old enough to archive, or None if archiving is off
+    """
+    days = settings.SCHEDULER_RETENTION_DAYS if days is None else days
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+def get_purge_cutoff(now=None, days=None):
+    """
+    Archived messages scheduled before this are deleted, or None to keep them forever
+    """
+    days = settings.SCHEDULER_ARCHIVE_RETENTION_DAYS if days is None else days
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+def to_archived(message, targets):
+    return ArchivedMessage(
+        id=message.id,
+        message=message.message,
+        channel=message.channel,
+        is_broadcast=message.is_broadcast,
+        team_id=message.team_id,
+        scheduled_time=message.scheduled_time,
+        status=message.status,
+        priority=message.priority,
+        attempts=message.attempts,
+        last_error=message.last_error,
+        idempotency_key=message.idempotency_key,
+        template_id=message.template_id,
+        variables=message.variables,
+        recurring_id=message.recurring_id,
+        targets=targets,
+        created_at=message.created_at,
+        updated_at=message.updated_at,
+    )
+
+def archive_messages(cutoff=None, batch_size=None, now=None):
+    """
+    Move sent and failed messages scheduled before ``cutoff`` to the archive
+
+    Each batch is copied and deleted in one transaction, oldest first, so
+    a message is always in exactly one of the two tables, even if the run
+    is interrupted. Returns the number of messages archived.
+    """
+    cutoff = cutoff or get_archive_cutoff(now)
+    if cutoff is None:
+        return 0
+    batch_size = batch_size or settings.SCHEDULER_ARCHIVE_BATCH_SIZE
+    candidates = ScheduledMessage.objects.filter(
+        status__in=TERMINAL_STATUSES,
+        scheduled_time__lt=cutoff
+    ).order_by('scheduled_time', 'id')
+
+    total = 0
+    while True:
+        with transaction.atomic():
+            messages = list(candidates[:batch_size])
+            if not messages:
+                return total
+            ids = [message.id for message in messages]
+            targets = {}
+            for target in BroadcastTarget.objects.filter(message_id__in=ids).order_by('id'):
+                targets.setdefault(target.message_id, []).append({
+                    'channel': target.channel,
+                    'status': target.status,
+                    'last_error': target.last_error,
+                    'sent_at': target.sent_at.isoformat() if target.sent_at else None,
+                })
+            ArchivedMessage.objects.bulk_create(
+                [to_archived(message, targets.get(message.id, [])) for message in messages]
+            )
+            # Broadcast targets go with their message (on_delete=CASCADE)
+            ScheduledMessage.objects.filter(id__in=ids).delete()
+        total += len(messages)
+        logger.info(f"Archived {total} messages scheduled before {cutoff}")
+
+def serialize_archived(message):
+    """
+    One archived message as a line of JSON
+    """
+    return json.dumps(model_to_dict(message), cls=DjangoJSONEncoder, ensure_ascii=False)
+
+def export_archive(output, since=None, until=None, batch_size=None):
+    """
+    Write archived messages scheduled in ``[since, until)`` to ``output`` as JSONL
+
+    ``output`` is an open text file, e.g. from gzip.open(path, 'wt'). Rows
+    are streamed in chunks of SCHEDULER_ARCHIVE_BATCH_SIZE, so memory stays
+    flat however large the archive is. Returns the number written.
+    """
+    batch_size = batch_size or settings.SCHEDULER_ARCHIVE_BATCH_SIZE
+    queryset = ArchivedMessage.objects.order_by('scheduled_time', 'id')
+    if since:
+        queryset = queryset.filter(scheduled_time__gte=since)
+    if until:
+        queryset = queryset.filter(scheduled_time__lt=until)
+
+    total = 0
+    for message in queryset.iterator(chunk_size=batch_size):
+        output.write(serialize_archived(message) + '\n')
+        total += 1
+    return total
+
+def purge_archive(cutoff=None, batch_size=None, export_dir=None, now=None):
+    """
+    Delete archived messages scheduled before ``cutoff``
+
+    With an ``export_dir`` (default SCHEDULER_ARCHIVE_EXPORT_DIR) each
+    batch is first appended to one gzipped JSONL file per run, named after
+    the cutoff and the run time. Every batch is written as a complete gzip
+    member and closed before its rows are deleted, so nothing is deleted
+    that was not written out, even if the run is interrupted. Returns
+    ``(deleted, path)``; path is None when nothing was exported.
+    """
+    now = now or timezone.now()
+    cutoff = cutoff or get_purge_cutoff(now)
+    if cutoff is None:
+        return 0, None
+    batch_size = batch_size or settings.SCHEDULER_ARCHIVE_BATCH_SIZE
+    export_dir = settings.SCHEDULER_ARCHIVE_EXPORT_DIR if export_dir is None else export_dir
+    candidates = ArchivedMessage.objects.filter(scheduled_time__lt=cutoff).order_by('scheduled_time', 'id')
+
+    path = None
+    total = 0
+    while True:
+        messages = list(candidates[:batch_size])
+        if not messages:
+            break
+        if export_dir:
+            if path is None:
+                os.makedirs(export_dir, exist_ok=True)
+                path = os.path.join(export_dir, f"scheduled-messages-before-{cutoff:%Y%m%d}-{now:%Y%m%dT%H%M%S}.jsonl.gz")
+            # Concatenated gzip members read back as one stream
+            with gzip.open(path, 'at', encoding='utf-8') as output:
+                output.writelines(serialize_archived(message) + '\n' for message in messages)
+        ArchivedMessage.objects.filter(id__in=[message.id for message in messages]).delete()
+        total += len(messages)
+    if total:
+        logger.info(f"Purged {total} archived messages scheduled before {cutoff}" + (f", exported to {path}" if path else ''))
+    return total, path
+
+def apply_retention(now=None):
+    """
+    Archive old history, then purge the archive past its own retention window
+
+    Returns ``(archived, purged, export_path)``.
+    """
+    now = now or timezone.now()
+    archived = archive_messages(now=now)
+    purged, path = purge_archive(now=now)
+    return archived, purged, path
@@ -1,9 +1,209 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil.rrule import rrulestr
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from .models import ScheduledMessage
+from .broadcasts import set_broadcast_targets
+from .channels import ChannelNotFound, resolve_channel
+from .installation_store import SlackInstallationNotFound
+from .message_templates import compile_template
+from .models import BroadcastTarget, MessageTemplate, RecurringMessage, ScheduledMessage
 
-class ScheduledMessageSerializer(serializers.ModelSerializer):
-    """Serializer for the ScheduledMessage model"""
+# Slack rejects messages with more blocks than this
+MAX_BLOCKS = 50
+
+class ChannelResolutionMixin:
+    """
+    Normalize ``channel`` to a Slack channel ID on write
+
+    Names are resolved through the channel directory, so an unknown
+    channel is rejected when the message is scheduled rather than when it
+    is sent.
+    """
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if 'channel' in attrs or 'team_id' in attrs:
+            channel = attrs.get('channel', getattr(self.instance, 'channel', ''))
+            if channel:
+                attrs['channel'] = self.resolve_channel(channel, attrs, 'channel')
+        return attrs
+    
+    def resolve_channel(self, channel, attrs, field):
+        team_id = attrs.get('team_id', getattr(self.instance, 'team_id', ''))
+        try:
+            return resolve_channel(channel, team_id)
+        except ChannelNotFound as e:
+            raise serializers.ValidationError({field: str(e)})
+        except SlackInstallationNotFound as e:
+            raise serializers.ValidationError({'team_id': str(e)})
+
+class TemplateField(serializers.PrimaryKeyRelatedField):
+    """
+    Template reference that loads each template once, however many bulk items use it
+    """
+    def to_internal_value(self, data):
+        templates = self.__dict__.setdefault('_templates', {})
+        if data not in templates:
+            templates[data] = super().to_internal_value(data)
+        return templates[data]
+
+class ScheduledMessageSerializer(ChannelResolutionMixin, serializers.ModelSerializer):
+    """
+    Serializer for the ScheduledMessage model
+
+    Give either ``channel`` or, for a broadcast, ``channels``: a list of
+    channels that each receive the message. Give either ``message`` or a
+    ``template`` with the ``variables`` it uses. Pass ``fields`` to
+    serialize only a subset of the fields.
+    """
+    template = TemplateField(queryset=MessageTemplate.objects.all(), required=False, allow_null=True)
+    channels = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        write_only=True,
+        required=False,
+        min_length=1,
+        max_length=settings.SCHEDULER_BROADCAST_MAX_TARGETS,
+    )
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+    
     class Meta:
         model = ScheduledMessage
-        fields = ['id', 'message', 'channel', 'scheduled_time', 'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'status', 'created_at', 'updated_at']
+        fields = [
+            'id', 'message', 'template', 'variables', 'channel', 'channels', 'is_broadcast', 'team_id', 'scheduled_time',
+            'priority', 'status', 'attempts', 'next_attempt_at', 'last_error', 'idempotency_key', 'recurring',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'is_broadcast', 'status', 'attempts', 'next_attempt_at', 'last_error', 'idempotency_key',
+            'recurring', 'created_at', 'updated_at'
+        ]
+    
+    def validate_variables(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Give the template variables as an object")
+        return value
+    
+    def validate(self, attrs):
+        channels = attrs.get('channels')
+        if channels is not None and attrs.get('channel'):
+            raise serializers.ValidationError("Give either channel or channels, not both")
+        if self.instance is None and channels is None and not attrs.get('channel'):
+            raise serializers.ValidationError({'channel': 'This field is required.'})
+        self.validate_content(attrs)
+        
+        attrs = super().validate(attrs)
+        if channels is not None:
+            # Resolved IDs, deduplicated in the order given
+            attrs['channels'] = list(dict.fromkeys(
+                self.resolve_channel(channel, attrs, 'channels') for channel in channels
+            ))
+            attrs['channel'] = ''
+            attrs['is_broadcast'] = True
+        elif attrs.get('channel'):
+            attrs['is_broadcast'] = False
+        return attrs
+    
+    def validate_content(self, attrs):
+        """
+        Require message text or a template, and every variable the template uses
+        """
+        message = attrs.get('message', getattr(self.instance, 'message', ''))
+        template = attrs.get('template', getattr(self.instance, 'template', None))
+        if message and template:
+            raise serializers.ValidationError("Give either message or template, not both")
+        if not message and not template:
+            raise serializers.ValidationError({'message': 'This field is required.'})
+        if template:
+            variables = attrs.get('variables', getattr(self.instance, 'variables', None)) or {}
+            missing = compile_template(template.text, template.blocks).variables.difference(variables)
+            if missing:
+                raise serializers.ValidationError({'variables': f"Missing template variables: {', '.join(sorted(missing))}"})
+    
+    def create(self, validated_data):
+        channels = validated_data.pop('channels', None)
+        # Targets are written before the commit that enqueues the timed send
+        with transaction.atomic():
+            message = super().create(validated_data)
+            if channels is not None:
+                set_broadcast_targets(message, channels)
+        return message
+    
+    def update(self, instance, validated_data):
+        channels = validated_data.pop('channels', None)
+        was_broadcast = instance.is_broadcast
+        with transaction.atomic():
+            message = super().update(instance, validated_data)
+            if channels is not None:
+                set_broadcast_targets(message, channels)
+            elif was_broadcast and not message.is_broadcast:
+                BroadcastTarget.objects.filter(message=message).delete()
+        return message
+
+
+class BroadcastTargetSerializer(serializers.ModelSerializer):
+    """Serializer for the delivery status of one broadcast channel"""
+    class Meta:
+        model = BroadcastTarget
+        fields = ['id', 'channel', 'status', 'last_error', 'sent_at']
+        read_only_fields = fields
+
+
+class MessageTemplateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the MessageTemplate model
+
+    ``variables`` lists the placeholder names messages using it must give.
+    """
+    variables = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = MessageTemplate
+        fields = ['id', 'name', 'text', 'blocks', 'variables', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def get_variables(self, template):
+        return sorted(compile_template(template.text, template.blocks).variables)
+    
+    def validate_blocks(self, value):
+        if value is None:
+            return value
+        if not isinstance(value, list) or not all(isinstance(block, dict) for block in value):
+            raise serializers.ValidationError("Give Block Kit blocks as a list of objects")
+        if len(value) > MAX_BLOCKS:
+            raise serializers.ValidationError(f"Slack allows at most {MAX_BLOCKS} blocks")
+        return value
+
+
+class RecurringMessageSerializer(ChannelResolutionMixin, serializers.ModelSerializer):
+    """Serializer for the RecurringMessage model"""
+    class Meta:
+        model = RecurringMessage
+        fields = [
+            'id', 'message', 'channel', 'team_id', 'rrule', 'dtstart', 'timezone', 'priority', 'is_active',
+            'next_occurrence_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'next_occurrence_at', 'created_at', 'updated_at']
+    
+    def validate_timezone(self, value):
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError(f"Unknown time zone: {value}")
+        return value
+    
+    def validate_rrule(self, value):
+        value = value.strip()
+        if value.upper().startswith('RRULE:'):
+            value = value[len('RRULE:'):]
+        if '\n' in value or 'DTSTART' in value.upper():
+            raise serializers.ValidationError("Give a single RRULE; the start is set with dtstart")
+        try:
+            rrulestr(value)
+        except (ValueError, TypeError) as e:
+            raise serializers.ValidationError(f"Invalid recurrence rule: {e}")
+        return value
@@ -1,69 +1,493 @@
 """
 Service for handling scheduled message sending
 """
+import asyncio
 import logging
+import os
+import random
+import socket
+import time
+import uuid
+from urllib.error import URLError
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Min, Q, Value, When, Window
+from django.db.models.functions import Cast, Greatest, RowNumber
 from django.utils import timezone
 from django.conf import settings
-from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+import aiohttp
 
+from .installation_store import SlackInstallationNotFound, forget_bot_token, resolve_bot_token
 from .models import ScheduledMessage
+from .rate_limit import SlackRateLimitedError, get_rate_limiter, get_retry_after
+from .slack_clients import get_client, invalidate_client, is_token_error
 
 logger = logging.getLogger(__name__)
 
-def get_slack_client():
+# Columns loaded for a claimed message; everything written back is assigned before saving
+DISPATCH_FIELDS = [
+    'id', 'message', 'channel', 'is_broadcast', 'team_id', 'scheduled_time', 'status', 'priority', 'attempts',
+    'claimed_by', 'idempotency_key', 'template', 'variables'
+]
+
+# Columns written back after a send; the message body is never rewritten
+SEND_RESULT_FIELDS = [
+    'status', 'attempts', 'next_attempt_at', 'last_error', 'claimed_by', 'claimed_at', 'updated_at'
+]
+
+# Event type of the message metadata that carries a post's idempotency key
+METADATA_EVENT_TYPE = 'scheduled_message'
+
+# Slack error codes that describe a temporary condition on Slack's side
+TRANSIENT_SLACK_ERRORS = {
+    'ratelimited',
+    'internal_error',
+    'fatal_error',
+    'service_unavailable',
+    'request_timeout',
+}
+
+# Network-level failures that are worth another attempt
+TRANSIENT_EXCEPTIONS = (
+    TimeoutError,
+    ConnectionError,
+    URLError,
+    asyncio.TimeoutError,
+    aiohttp.ClientError,
+)
+
+def get_slack_client(token=None):
     """
-    Get a Slack client instance with the configured token
+    Get the shared, connection-pooled Slack client for a token
+    Defaults to the configured bot token
     """
-    return WebClient(token=settings.SLACK_BOT_TOKEN)
+    return get_client(token or settings.SLACK_BOT_TOKEN)
 
-def send_slack_message(message, channel):
+def get_message_metadata(idempotency_key):
+    """
+    Slack message metadata tagging a post with its idempotency key
+    """
+    return {
+        'event_type': METADATA_EVENT_TYPE,
+        'event_payload': {'idempotency_key': str(idempotency_key)},
+    }
+
+def post_slack_message(message, channel, client=None, team_id=None, idempotency_key=None, blocks=None):
+    """
+    Post a message through the shared rate limiter
+
+    Without a ``client`` the bot token of ``team_id`` is resolved through the
+    installation store; a blank team_id uses the default SLACK_BOT_TOKEN.
+    An ``idempotency_key`` is attached as message metadata so the post can
+    be found in the channel history if the outcome is lost. Block Kit
+    ``blocks`` are sent with the text as their notification fallback.
+
+    Waits for a per-channel and per-workspace token before each call. When
+    Slack answers ``ratelimited`` the Retry-After delay is shared with every
+    worker and the call is retried; if Slack is still limiting after
+    SLACK_RATE_LIMIT_MAX_RETRIES attempts, or asks for a longer wait than
+    SLACK_RATE_LIMIT_MAX_WAIT, SlackRateLimitedError is raised so the caller
+    can leave the message pending. Any other SlackApiError propagates.
+    """
+    client = client or get_slack_client(resolve_bot_token(team_id))
+    limiter = get_rate_limiter()
+    kwargs = {'channel': channel, 'text': message}
+    if blocks:
+        kwargs['blocks'] = blocks
+    if idempotency_key:
+        kwargs['metadata'] = get_message_metadata(idempotency_key)
+    
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire('chat.postMessage', client.token, channel)
+        try:
+            return client.chat_postMessage(**kwargs)
+        except SlackApiError as e:
+            if is_token_error(e):
+                invalidate_client(client.token)
+                forget_bot_token(team_id)
+            retry_after = get_retry_after(e)
+            if retry_after is None:
+                raise
+            
+            logger.warning(f"Rate limited sending to {channel}, Retry-After {retry_after}s")
+            if limiter:
+                limiter.block('chat.postMessage', client.token, channel, retry_after)
+            
+            attempt += 1
+            if attempt > settings.SLACK_RATE_LIMIT_MAX_RETRIES or retry_after > settings.SLACK_RATE_LIMIT_MAX_WAIT:
+                raise SlackRateLimitedError(channel, retry_after) from e
+            if not limiter:
+                time.sleep(retry_after)
+
+def send_slack_message(message, channel, team_id=None, idempotency_key=None, blocks=None):
     """
     Send a message to a Slack channel
     """
-    client = get_slack_client()
     try:
-        result = client.chat_postMessage(channel=channel, text=message)
+        result = post_slack_message(message, channel, team_id=team_id, idempotency_key=idempotency_key, blocks=blocks)
         logger.info(f"Message sent to {channel}: {result}")
         return True
-    except SlackApiError as e:
+    except (SlackApiError, SlackRateLimitedError, SlackInstallationNotFound) as e:
         logger.error(f"Error sending message to Slack: {e}")
         return False
 
-def process_scheduled_messages():
+def send_message_now(message_id):
     """
-    Process all due scheduled messages
-    This would typically be run by a scheduler like Celery
+    Claim a pending message and send it immediately, whatever its scheduled time
+
+    The row is claimed first (see claim_message_now), so a dispatcher or
+    the message's send task cannot post it as well. The send then goes
+    through the dispatcher like any other: templates are rendered,
+    broadcasts fanned out, and the outcome recorded under the claim, so a
+    transient error leaves the message 'deferred' for a retry. Returns
+    ``(outcome, error)`` with the outcome 'sent', 'failed' or 'deferred'
+    and the error as text, or ``(None, error)`` if the message is not
+    pending or is already being sent.
+    """
+    from .dispatcher import Dispatcher
+    message = claim_message_now(message_id)
+    if message is None:
+        return None, 'Message is not pending or is already being sent'
+    _, outcome, error = Dispatcher(backend='sync').dispatch_batch([message])[0]
+    return outcome, str(error) if error else None
+
+def classify_send_error(error):
+    """
+    Decide whether a send error is worth retrying
+
+    Returns ``(transient, retry_after)``. Rate limits, Slack 5xx/internal
+    errors and network timeouts are transient; Slack errors about the
+    request itself (``channel_not_found``, ``not_in_channel``,
+    ``invalid_auth`` ...) and anything unexpected are permanent.
+    """
+    if isinstance(error, SlackRateLimitedError):
+        return True, error.retry_after
+    if isinstance(error, SlackApiError):
+        response = error.response
+        if response is not None and (
+            (response.status_code or 0) >= 500 or response.get('error') in TRANSIENT_SLACK_ERRORS
+        ):
+            return True, get_retry_after(error)
+        return False, None
+    if isinstance(error, TRANSIENT_EXCEPTIONS):
+        return True, None
+    return False, None
+
+def get_retry_delay(attempts, retry_after=None):
+    """
+    Seconds to wait before retry number ``attempts``
+
+    Exponential backoff from SCHEDULER_RETRY_BASE_DELAY, capped at
+    SCHEDULER_RETRY_MAX_DELAY, with equal jitter so messages that failed
+    together do not all retry in the same instant. Never shorter than a
+    Retry-After Slack asked for.
+    """
+    delay = min(settings.SCHEDULER_RETRY_MAX_DELAY, settings.SCHEDULER_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0)
+
+def apply_send_result(message, success, error, now=None):
+    """
+    Record the outcome of a send on a claimed message and release the claim
+
+    Transient failures put the message back to pending with ``next_attempt_at``
+    pushed out by a jittered exponential backoff, until
+    SCHEDULER_MAX_ATTEMPTS is reached. Permanent failures fail at once.
+    Returns 'sent', 'failed' or 'deferred'; the caller saves the message.
     """
-    now = timezone.now()
-    logger.info(f"Processing scheduled messages at {now}")
+    now = now or timezone.now()
+    release_claim(message)
+    message.attempts += 1
     
-    # Get all pending messages that are due
-    due_messages = ScheduledMessage.objects.filter(
-        status='pending',
-        scheduled_time__lte=now
-    )
+    if success:
+        message.status = 'sent'
+        message.next_attempt_at = None
+        message.last_error = ''
+        return 'sent'
     
-    logger.info(f"Found {due_messages.count()} messages to process")
+    message.last_error = str(error) if error is not None else 'Failed to send message to Slack'
+    transient, retry_after = classify_send_error(error)
+    if transient and message.attempts < settings.SCHEDULER_MAX_ATTEMPTS:
+        message.status = 'pending'
+        message.next_attempt_at = now + timedelta(seconds=get_retry_delay(message.attempts, retry_after))
+        return 'deferred'
     
-    for message in due_messages:
-        logger.info(f"Processing message {message.id} to channel {message.channel}")
-        
-        try:
-            success = send_slack_message(message.message, message.channel)
-            
-            if success:
-                message.status = 'sent'
-                message.save()
-                logger.info(f"Successfully sent message {message.id}")
-            else:
-                message.status = 'failed'
-                message.save()
-                logger.error(f"Failed to send message {message.id}")
-        except Exception as e:
-            message.status = 'failed'
-            message.save()
-            logger.error(f"Error processing message {message.id}: {str(e)}")
+    message.status = 'failed'
+    message.next_attempt_at = None
+    return 'failed'
+
+def record_send_results(results, now=None):
+    """
+    Apply a batch of send results and write them back in one transaction
+
+    Successful sends become one UPDATE ... WHERE id IN (...) per claim;
+    retries and failures, which carry a per-row error and backoff, go out
+    in one bulk_update per claim. Every write is conditional on the row
+    still being 'sending' under the claim it was sent with, so a result
+    that arrives after the lease ran out never overwrites the outcome of
+    reconcile_stale_sends() or of the worker that re-claimed the row. Only
+    the dispatch bookkeeping columns are written, never the message body.
+    Returns ``(message, outcome, error)`` tuples for logging.
+    """
+    now = now or timezone.now()
+    outcomes = []
+    sent_ids = {}
+    others = {}
+    
+    for message, success, error in results:
+        claimed_by = message.claimed_by
+        outcome = apply_send_result(message, success, error, now=now)
+        message.updated_at = now
+        outcomes.append((message, outcome, error))
+        if outcome == 'sent':
+            sent_ids.setdefault(claimed_by, []).append(message.id)
+        else:
+            others.setdefault(claimed_by, []).append(message)
+    
+    written = 0
+    with transaction.atomic():
+        for claimed_by, ids in sent_ids.items():
+            written += ScheduledMessage.objects.filter(id__in=ids, status='sending', claimed_by=claimed_by).update(
+                status='sent',
+                attempts=F('attempts') + 1,
+                next_attempt_at=None,
+                last_error='',
+                claimed_by=None,
+                claimed_at=None,
+                updated_at=now
+            )
+        for claimed_by, messages in others.items():
+            written += ScheduledMessage.objects.filter(status='sending', claimed_by=claimed_by).bulk_update(
+                messages, SEND_RESULT_FIELDS
+            )
+    if written < len(outcomes):
+        logger.warning(f"{len(outcomes) - written} send results not recorded: their claim had expired and changed hands")
+    
+    # Retries fire at their backoff time rather than waiting for a sweep
+    from .tasks import enqueue_message_dispatch
+    for message, outcome, _ in outcomes:
+        if outcome == 'deferred':
+            enqueue_message_dispatch(message.id, message.next_attempt_at, message.priority)
     
-    logger.info("Finished processing scheduled messages")
-    return due_messages.count()
+    return outcomes
+
+def get_worker_id():
+    """
+    Identify this dispatcher process in claim columns
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def due_messages_queryset(now=None):
+    """
+    Pending messages that are due, not backing off and not held by a live claim
+    """
+    now = now or timezone.now()
+    lease_expired_before = now - timedelta(seconds=settings.SCHEDULER_CLAIM_LEASE_SECONDS)
+    return ScheduledMessage.objects.filter(
+        status='pending',
+        scheduled_time__lte=now
+    ).filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    ).filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=lease_expired_before)
+    )
+
+def keyset_after(queryset, after):
+    """
+    Restrict a queryset ordered by (scheduled_time, id) to rows after the cursor
+    """
+    if after is None:
+        return queryset
+    after_time, after_id = after
+    return queryset.filter(
+        Q(scheduled_time__gt=after_time) | Q(scheduled_time=after_time, id__gt=after_id)
+    )
+
+def fair_order(queryset):
+    """
+    Order messages weighted-fair across workspaces and channels
+
+    Each channel of a workspace is a flow. A message's virtual time is its
+    rank within its channel, or its rank within its workspace divided by
+    the workspace's share of a round (SLACK_WORKSPACE_RATE_PER_SECOND /
+    SLACK_CHANNEL_RATE_PER_SECOND channels), whichever is later, divided by
+    its priority weight. Taking the lowest virtual times first is round
+    robin: one message per channel per round, each workspace capped at
+    what Slack will let it send in that time, so a campaign in one
+    workspace cannot hold back the others, and higher priorities get
+    proportionally more rounds. Within a channel higher priority goes
+    first, then oldest first. Both ranks are window functions over the
+    whole queryset, so restrict it (see rank_due_messages) before ordering.
+    """
+    flow_order = [F('priority').desc(), F('scheduled_time').asc(), F('id').asc()]
+    channel_rank = Window(RowNumber(), partition_by=[F('team_id'), F('channel')], order_by=flow_order)
+    team_rank = Window(RowNumber(), partition_by=[F('team_id')], order_by=flow_order)
+    team_share = max(1.0, settings.SLACK_WORKSPACE_RATE_PER_SECOND / settings.SLACK_CHANNEL_RATE_PER_SECOND)
+    weights = settings.SCHEDULER_PRIORITY_WEIGHTS
+    weight = Case(
+        *[When(priority=priority, then=Value(weights[priority])) for priority in range(len(weights) - 1)],
+        default=Value(weights[-1]),
+        output_field=FloatField()
+    )
+    return queryset.annotate(
+        fair_time=Greatest(
+            Cast(channel_rank, FloatField()),
+            Cast(team_rank, FloatField()) / Value(team_share)
+        ) / weight
+    ).order_by('fair_time', 'scheduled_time', 'id')
+
+def rank_due_messages(now=None, window=None):
+    """
+    Ids of a bounded window of due messages, in fair_order()
+
+    The window is the oldest ``window`` (SCHEDULER_FAIR_WINDOW) due
+    messages plus the earliest-created due message of every channel, both
+    picked by subqueries before anything is ranked, so a ranking costs one
+    grouped scan of the due rows and a sort of at most the window and one
+    row per channel. Every channel thus competes in every window however
+    far back its messages are queued. Without window functions the ids
+    are returned oldest first.
+    """
+    window = window or settings.SCHEDULER_FAIR_WINDOW
+    due = due_messages_queryset(now)
+    oldest = due.order_by('scheduled_time', 'id').values('id')[:window]
+    if not connection.features.supports_over_clause:
+        return list(oldest.values_list('id', flat=True))
+    channel_heads = due.order_by().values('team_id', 'channel').annotate(first_id=Min('id')).values('first_id')
+    candidates = due.filter(Q(id__in=oldest) | Q(id__in=channel_heads))
+    return list(fair_order(candidates).values_list('id', flat=True))
+
+def get_claim_token(worker_id=None):
+    """
+    A unique token per claim, so a worker reads back exactly the rows it won
+    """
+    return f"{worker_id or get_worker_id()}:{uuid.uuid4().hex[:8]}"
+
+def claim_due_messages(limit=None, worker_id=None, now=None, ids=None, after=None):
+    """
+    Atomically claim up to ``limit`` due messages for this worker
+
+    On databases that support it (PostgreSQL) the candidate rows are locked
+    with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers each get a
+    disjoint set without waiting on one another. Elsewhere (SQLite) a single
+    conditional UPDATE re-checks the claim predicate, so a row that another
+    worker grabbed in the meantime is simply not updated.
+
+    Pass ``ids`` to restrict the claim to specific messages, as the
+    event-driven send task and the fair dispatcher do; the claimed rows
+    then come back in the order of ``ids``. ``after`` is a
+    ``(scheduled_time, id)`` keyset cursor: only rows ordered after it are
+    considered, so a pass walks the backlog in fixed-size chunks and never
+    revisits a row it deferred. Claimed rows move to 'sending' until their
+    outcome is recorded; rows left there by a crashed worker are settled by
+    reconcile_stale_sends(), never simply re-claimed. Returns the claimed
+    ScheduledMessage instances with only the columns dispatch needs loaded.
+    """
+    now = now or timezone.now()
+    limit = limit or settings.SCHEDULER_CLAIM_BATCH_SIZE
+    claim_token = get_claim_token(worker_id)
+
+    candidates = due_messages_queryset(now).order_by('scheduled_time', 'id')
+    if ids is not None:
+        candidates = candidates.filter(id__in=ids)
+    candidates = keyset_after(candidates, after)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed_ids = list(
+                candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit]
+            )
+            if claimed_ids:
+                ScheduledMessage.objects.filter(id__in=claimed_ids).update(
+                    status='sending',
+                    claimed_by=claim_token,
+                    claimed_at=now
+                )
+    else:
+        claimed_ids = list(candidates.values_list('id', flat=True)[:limit])
+        if claimed_ids:
+            # Re-apply the due predicate so rows claimed by a concurrent worker are skipped
+            due_messages_queryset(now).filter(id__in=claimed_ids).update(
+                status='sending',
+                claimed_by=claim_token,
+                claimed_at=now
+            )
+
+    if not claimed_ids:
+        return []
+
+    claimed = list(
+        ScheduledMessage.objects.filter(id__in=claimed_ids, claimed_by=claim_token)
+        .only(*DISPATCH_FIELDS)
+        .order_by('scheduled_time', 'id')
+    )
+    if ids is not None:
+        position = {message_id: index for index, message_id in enumerate(ids)}
+        claimed.sort(key=lambda message: position[message.id])
+    return claimed
+
+def claim_message_now(message_id, worker_id=None, now=None):
+    """
+    Claim one pending message for an immediate send, whatever its scheduled time
+
+    One conditional UPDATE, so the claim fails if a dispatcher or another
+    immediate send holds the message, or it has already been sent or
+    failed; a message backing off before a retry can be claimed. Returns
+    the claimed message with the dispatch columns loaded, or None.
+    """
+    now = now or timezone.now()
+    claim_token = get_claim_token(worker_id)
+    lease_expired_before = now - timedelta(seconds=settings.SCHEDULER_CLAIM_LEASE_SECONDS)
+    claimed = ScheduledMessage.objects.filter(id=message_id, status='pending').filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=lease_expired_before)
+    ).update(status='sending', claimed_by=claim_token, claimed_at=now)
+    if not claimed:
+        return None
+    return ScheduledMessage.objects.only(*DISPATCH_FIELDS).get(id=message_id, claimed_by=claim_token)
+
+def renew_claims(messages, now=None):
+    """
+    Push the lease of claimed messages out again while they are still being sent
+
+    Only rows still held under the same claim are touched, so a claim that
+    has already been taken over is left alone.
+    """
+    now = now or timezone.now()
+    claims = {}
+    for message in messages:
+        claims.setdefault(message.claimed_by, []).append(message.id)
+    for claimed_by, ids in claims.items():
+        ScheduledMessage.objects.filter(id__in=ids, claimed_by=claimed_by, status='sending').update(claimed_at=now)
+
+def release_claim(message):
+    """
+    Clear the claim columns on a message that has been dealt with
+    """
+    message.claimed_by = None
+    message.claimed_at = None
+
+def process_scheduled_message(message_id):
+    """
+    Send one message now if it is still pending and due
+
+    Used by the event-driven send task that fires at the message's
+    scheduled time. Returns the outcome ('sent', 'failed', 'deferred'), or
+    None if the message was already handled, edited to a later time, or
+    claimed by another worker.
+    """
+    from .dispatcher import Dispatcher
+    return Dispatcher(backend='sync').dispatch_one(message_id)
+
+def process_scheduled_messages(backend=None, concurrency=None, batch_size=None, fair=None):
+    """
+    Process all due scheduled messages
+    This would typically be run by a scheduler like Celery
+
+    Thin wrapper over Dispatcher; returns the number of messages processed.
+    """
+    from .dispatcher import Dispatcher
+    stats = Dispatcher(backend=backend, concurrency=concurrency, batch_size=batch_size, fair=fair).run()
+    return stats['processed']
@@ -0,0 +1,53 @@
+"""
+Signal handlers for the scheduler app
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import RecurringMessage, ScheduledMessage
+
+@receiver(post_save, sender=ScheduledMessage)
+def schedule_message_dispatch(sender, instance, **kwargs):
+    """
+    Enqueue a timed send when a pending message is created or edited
+
+    The task is enqueued only after the transaction commits, so the worker
+    always sees the saved row. Earlier tasks for an edited message find it
+    no longer due and do nothing.
+    """
+    if instance.status != 'pending':
+        return
+    
+    from .tasks import enqueue_message_dispatch, get_dispatch_time
+    
+    message_id = instance.id
+    eta = get_dispatch_time(instance)
+    priority = instance.priority
+    transaction.on_commit(lambda: enqueue_message_dispatch(message_id, eta, priority))
+
+@receiver(post_save, sender=RecurringMessage)
+def schedule_recurring_message(sender, instance, update_fields=None, **kwargs):
+    """
+    Rematerialize a recurring message's upcoming occurrences when it is created or edited
+
+    Saves limited to ``update_fields`` come from the materializer itself
+    and are skipped.
+    """
+    if update_fields:
+        return
+    
+    from .recurrence import schedule_recurring_message as schedule
+    schedule(instance)
+
+@receiver(pre_delete, sender=RecurringMessage)
+def delete_upcoming_occurrences(sender, instance, **kwargs):
+    """
+    Drop occurrences that have not come due yet, so a deleted rule stops sending
+    """
+    ScheduledMessage.objects.filter(
+        recurring=instance,
+        status='pending',
+        scheduled_time__gt=timezone.now()
+    ).delete()
@@ -2,23 +2,15 @@
 Slack authentication utilities
 """
 import logging
-import os
 from django.conf import settings
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from slack_sdk.oauth import AuthorizeUrlGenerator
-from slack_sdk.oauth.installation_store import FileInstallationStore
-from slack_sdk.oauth.state_store import FileOAuthStateStore
 
-logger = logging.getLogger(__name__)
-
-# Create installation store and state store directories
-os.makedirs('slack_installation', exist_ok=True)
-os.makedirs('slack_state', exist_ok=True)
+from .installation_store import installation_store
+from .state_store import state_store
 
-# Initialize installation store and state store
-installation_store = FileInstallationStore(base_dir='slack_installation')
-state_store = FileOAuthStateStore(expiration_seconds=300, base_dir='slack_state')
+logger = logging.getLogger(__name__)
 
 # Use ngrok URL for local development, production URL for production
 if settings.DEBUG:
@@ -44,7 +36,8 @@ def get_authorize_url(request):
     
     authorize_url_generator = AuthorizeUrlGenerator(
         client_id=settings.SLACK_CLIENT_ID,
-        scopes=["chat:write", "channels:read", "groups:read"],
+        # The history scopes let a post be looked up by its idempotency key after a worker crash
+        scopes=["chat:write", "channels:read", "groups:read", "channels:history", "groups:history"],
         redirect_uri=redirect_uri,
     )
     
@@ -75,8 +68,8 @@ def handle_oauth_callback(request):
         return HttpResponseRedirect(reverse('slack_auth_error'))
     
     # Exchange the authorization code for an access token
-    from slack_sdk.web.client import WebClient
-    client = WebClient()
+    from .slack_clients import get_client
+    client = get_client(None)
     
     try:
         # Use the appropriate URL based on environment
@@ -96,36 +89,31 @@ def handle_oauth_callback(request):
             redirect_uri=redirect_uri,
         )
         
-        # Log the full OAuth response for debugging
-        logger.info(f"OAuth response: {oauth_response}")
-        
-        # Extract the refresh token if available
-        refresh_token = oauth_response.get("refresh_token", "")
-        if refresh_token:
-            # In a production environment, you would securely store this
-            # For now, we'll log it (not recommended for production)
-            logger.info(f"Received refresh token: {refresh_token}")
-            
-            # You might want to update your .env file or store in a secure database
-            # For this example, we'll just use the one from settings
-        
-        # Save the installation
+        # Save the installation; with token rotation enabled Slack also
+        # returns a refresh token and expiry for the bot token
+        authed_user = oauth_response.get("authed_user", {})
         installation = Installation(
             app_id=oauth_response.get("app_id"),
-            enterprise_id=oauth_response.get("enterprise_id"),
-            team_id=oauth_response.get("team_id"),
+            enterprise_id=(oauth_response.get("enterprise") or {}).get("id"),
+            enterprise_name=(oauth_response.get("enterprise") or {}).get("name"),
+            team_id=(oauth_response.get("team") or {}).get("id"),
+            team_name=(oauth_response.get("team") or {}).get("name"),
             bot_token=oauth_response.get("access_token"),
             bot_id=oauth_response.get("bot_user_id"),
             bot_user_id=oauth_response.get("bot_user_id"),
-            bot_scopes=oauth_response.get("scope", "").split(","),
-            user_id=oauth_response.get("authed_user", {}).get("id"),
-            user_token=oauth_response.get("authed_user", {}).get("access_token"),
-            user_scopes=oauth_response.get("authed_user", {}).get("scope", "").split(","),
-            installed_at=oauth_response.get("installer_user_id"),
-            # Store the refresh token in the installation
-            user_refresh_token=refresh_token,
+            bot_scopes=oauth_response.get("scope", ""),
+            bot_refresh_token=oauth_response.get("refresh_token"),
+            bot_token_expires_in=oauth_response.get("expires_in"),
+            user_id=authed_user.get("id"),
+            user_token=authed_user.get("access_token"),
+            user_scopes=authed_user.get("scope", ""),
+            user_refresh_token=authed_user.get("refresh_token"),
+            user_token_expires_in=authed_user.get("expires_in"),
+            is_enterprise_install=oauth_response.get("is_enterprise_install", False),
+            token_type=oauth_response.get("token_type"),
         )
         installation_store.save(installation)
+        logger.info(f"Saved Slack installation for team {installation.team_id} ({installation.team_name})")
         
         return HttpResponseRedirect(reverse('slack_auth_success'))
     
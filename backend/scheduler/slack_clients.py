@@ -0,0 +1,182 @@
+"""
+Process-wide registry of Slack Web API clients
+
+slack_sdk's WebClient opens a new urllib connection for every call. The
+clients handed out here send over a urllib3 connection pool instead, and
+one client is kept per bot token, so TCP/TLS connections are reused across
+sends from the views, the OAuth flow and the dispatcher alike.
+
+The sync WebClient has no public transport hook, so the pool is plugged in
+by overriding WebClient._perform_urllib_http_request_internal. slack-sdk is
+pinned in requirements.txt for that reason, and this module refuses to
+import if the method it overrides is missing or has changed shape, rather
+than silently falling back to a connection per call.
+"""
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+from urllib.error import URLError
+import urllib3
+from django.conf import settings
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackRequestError
+from slack_sdk.version import __version__ as slack_sdk_version
+
+from .metrics import observe_slack_call
+
+logger = logging.getLogger(__name__)
+
+# Slack errors meaning the token itself is no longer usable
+TOKEN_ERRORS = {'invalid_auth', 'token_revoked', 'token_expired', 'account_inactive'}
+
+# slack_sdk method PooledWebClient replaces, and the parameters it must take
+TRANSPORT_HOOK = '_perform_urllib_http_request_internal'
+TRANSPORT_HOOK_PARAMETERS = ['self', 'url', 'req']
+
+# urllib3 errors raised before the request left this host, so retrying cannot post twice
+CONNECT_ERRORS = (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError)
+
+def to_transport_error(error):
+    """
+    Translate a urllib3 error into what slack_sdk's retry handlers expect
+
+    Only connect-phase failures become URLError, which the default
+    ConnectionErrorRetryHandler replays. Once the request may have reached
+    Slack, a read timeout is raised as TimeoutError and anything else as
+    SlackRequestError, neither of which is retried, so a post is never
+    sent twice by the client itself.
+    """
+    if isinstance(error, urllib3.exceptions.MaxRetryError) and error.reason is not None:
+        error = error.reason
+    if isinstance(error, CONNECT_ERRORS):
+        return URLError(error)
+    if isinstance(error, urllib3.exceptions.ReadTimeoutError):
+        return TimeoutError(str(error))
+    return SlackRequestError(str(error))
+
+def check_transport_hook():
+    """
+    Raise ImportError unless WebClient still has the transport method we override
+    """
+    hook = getattr(WebClient, TRANSPORT_HOOK, None)
+    if hook is None or list(inspect.signature(hook).parameters) != TRANSPORT_HOOK_PARAMETERS:
+        raise ImportError(
+            f"slack_sdk {slack_sdk_version} has no WebClient.{TRANSPORT_HOOK}(url, req); "
+            f"PooledWebClient needs the slack-sdk version pinned in requirements.txt"
+        )
+
+check_transport_hook()
+
+class PooledWebClient(WebClient):
+    """
+    WebClient that keeps HTTP connections alive between calls
+
+    Only the transport is replaced: request building, retry handlers and
+    response parsing are slack_sdk's own. Failures to connect are raised as
+    URLError and retried like the stock client's; failures after the
+    request was sent are not (see to_transport_error).
+    """
+    def __init__(self, *args, pool_size=None, connect_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool_kwargs = {
+            'maxsize': pool_size or settings.SLACK_HTTP_POOL_SIZE,
+            'timeout': urllib3.Timeout(
+                connect=connect_timeout or settings.SLACK_API_CONNECT_TIMEOUT,
+                read=self.timeout,
+            ),
+            # Only retry establishing a connection; a POST that reached Slack is never replayed
+            'retries': urllib3.Retry(total=1, connect=1, read=False, status=False, redirect=False),
+        }
+        if isinstance(self.proxy, str):
+            self.pool = urllib3.ProxyManager(self.proxy, **pool_kwargs)
+        else:
+            self.pool = urllib3.PoolManager(**pool_kwargs)
+
+    def api_call(self, api_method, **kwargs):
+        with observe_slack_call(api_method):
+            return super().api_call(api_method, **kwargs)
+
+    def _perform_urllib_http_request_internal(self, url, req):
+        if self.ssl is not None:
+            # Keep honoring a caller-supplied SSLContext through urllib
+            return super()._perform_urllib_http_request_internal(url, req)
+        try:
+            resp = self.pool.request(
+                'POST',
+                url,
+                body=req.data,
+                # urllib3 computes Content-Length itself
+                headers={name: value for name, value in req.header_items() if name.lower() != 'content-length'},
+            )
+        except urllib3.exceptions.HTTPError as e:
+            raise to_transport_error(e) from e
+
+        content_type = resp.headers.get('Content-Type', '')
+        if content_type.startswith('application/gzip'):
+            return {'status': resp.status, 'headers': resp.headers, 'body': resp.data}
+        charset = 'utf-8'
+        if 'charset=' in content_type:
+            charset = content_type.split('charset=', 1)[1].split(';', 1)[0].strip() or charset
+        return {'status': resp.status, 'headers': resp.headers, 'body': resp.data.decode(charset)}
+
+    def close(self):
+        self.pool.clear()
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+def get_client(token):
+    """
+    Return the shared client for ``token``, creating it on first use
+
+    ``token`` may be None for unauthenticated calls such as oauth.v2.access.
+    Clients are keyed by token and SLACK_API_BASE_URL. The registry is an
+    LRU capped at SLACK_CLIENT_CACHE_SIZE clients; the least recently used
+    client is closed when the cap is exceeded.
+    """
+    key = (token, settings.SLACK_API_BASE_URL)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+
+        client = PooledWebClient(
+            token=token,
+            base_url=settings.SLACK_API_BASE_URL,
+            timeout=settings.SLACK_API_TIMEOUT,
+        )
+        _clients[key] = client
+        while len(_clients) > settings.SLACK_CLIENT_CACHE_SIZE:
+            _, evicted = _clients.popitem(last=False)
+            evicted.close()
+        return client
+
+def invalidate_client(token):
+    """
+    Drop the client for a rotated or revoked token and close its connections
+    """
+    with _clients_lock:
+        clients = [_clients.pop(key) for key in list(_clients) if key[0] == token]
+    for client in clients:
+        client.close()
+    if clients:
+        logger.info("Dropped cached Slack client after token rotation or revocation")
+
+def clear_clients():
+    """
+    Close and forget every cached client
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+def is_token_error(error):
+    """
+    True if a SlackApiError says the token can no longer be used
+    """
+    response = getattr(error, 'response', None)
+    return response is not None and response.get('error') in TOKEN_ERRORS
@@ -0,0 +1,67 @@
+"""
+Database-backed Slack OAuth state store
+
+States live in the OAuthState table, so any web replica can verify a
+callback for an install flow another replica started.
+"""
+import logging
+import secrets
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from slack_sdk.oauth.state_store import OAuthStateStore
+
+from .models import OAuthState
+
+logger = logging.getLogger(__name__)
+
+class DjangoOAuthStateStore(OAuthStateStore):
+    """
+    slack_sdk OAuthStateStore that keeps one-time states in OAuthState
+
+    consume() is a single conditional DELETE on the unique state column, so
+    when two requests present the same state only one of them succeeds.
+    """
+    def __init__(self, expiration_seconds=None):
+        self.expiration_seconds = expiration_seconds or settings.SLACK_OAUTH_STATE_EXPIRATION
+        self._logger = logger
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def issue(self, *args, **kwargs):
+        state = secrets.token_urlsafe(32)
+        OAuthState.objects.create(
+            state=state,
+            expires_at=timezone.now() + timedelta(seconds=self.expiration_seconds),
+        )
+        return state
+
+    def consume(self, state):
+        if not state:
+            return False
+        deleted, _ = OAuthState.objects.filter(state=state, expires_at__gt=timezone.now()).delete()
+        if not deleted:
+            logger.warning("OAuth state is unknown, expired or already used")
+        return bool(deleted)
+
+def purge_expired_states(batch_size=None, now=None):
+    """
+    Delete expired OAuth states in batches
+
+    Each batch is one short DELETE by primary key, so a large backlog of
+    abandoned install flows never holds a long lock on the table. Returns
+    the number of states deleted.
+    """
+    batch_size = batch_size or settings.SLACK_OAUTH_STATE_PURGE_BATCH_SIZE
+    now = now or timezone.now()
+    total = 0
+    while True:
+        ids = list(OAuthState.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return total
+        deleted, _ = OAuthState.objects.filter(id__in=ids).delete()
+        total += deleted
+
+state_store = DjangoOAuthStateStore()
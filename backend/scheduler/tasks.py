@@ -1,19 +1,295 @@
 """
 Celery tasks for the scheduler app
 """
+import hashlib
+import hmac
+import ipaddress
+import json
 import logging
+import socket
+from datetime import timedelta
+from urllib.parse import urlparse
+import requests
 from celery import shared_task
-from .services import process_scheduled_messages
+from django.conf import settings
+from django.utils import timezone
+from .models import ScheduledMessage
+from .recurrence import materialize_recurring_messages
+from .retention import apply_retention
+from .services import get_retry_delay, process_scheduled_message, process_scheduled_messages, send_message_now
+from .state_store import purge_expired_states
 
 logger = logging.getLogger(__name__)
 
+# A task that fires this close to the send time (clock skew between the
+# broker and the database) re-enqueues itself instead of giving up
+EARLY_FIRE_TOLERANCE = timedelta(seconds=5)
+
+def get_dispatch_time(message):
+    """
+    When a pending message should next be attempted
+    """
+    if message.next_attempt_at and message.next_attempt_at > message.scheduled_time:
+        return message.next_attempt_at
+    return message.scheduled_time
+
+def get_dispatch_queue(priority):
+    """
+    Celery queue for timed sends of a message with this priority, or None for the default queue
+    """
+    if priority is None or priority == ScheduledMessage.PRIORITY_NORMAL:
+        return None
+    if priority > ScheduledMessage.PRIORITY_NORMAL:
+        return settings.SCHEDULER_HIGH_PRIORITY_QUEUE
+    return settings.SCHEDULER_LOW_PRIORITY_QUEUE
+
+def enqueue_message_dispatch(message_id, eta, priority=None):
+    """
+    Enqueue a send task that fires at ``eta``
+
+    The task goes to the queue for the message's priority, so a bulk
+    campaign's sends wait on their own worker instead of ahead of normal
+    ones. Messages further out than SCHEDULER_EVENT_HORIZON are left to the
+    sweeper, which enqueues them once they come within the horizon; this
+    keeps ETA tasks shorter than the broker's visibility timeout. Broker
+    errors are logged and swallowed, the sweeper is the safety net.
+    """
+    if not settings.SCHEDULER_EVENT_DISPATCH:
+        return False
+    if eta > timezone.now() + timedelta(seconds=settings.SCHEDULER_EVENT_HORIZON):
+        return False
+    try:
+        send_scheduled_message.apply_async(args=[message_id], eta=eta, retry=False, queue=get_dispatch_queue(priority))
+        return True
+    except Exception as e:
+        logger.warning(f"Could not enqueue dispatch for message {message_id}, leaving it to the sweeper: {e}")
+        return False
+
+def enqueue_messages_dispatch(messages):
+    """
+    Enqueue timed sends for messages saved without post_save, e.g. by bulk_create
+
+    ``messages`` are ``(message_id, eta, priority)`` tuples. Stops at the first broker
+    error instead of paying the connection timeout once per message; the
+    sweeper enqueues whatever was left out.
+    """
+    if not settings.SCHEDULER_EVENT_DISPATCH:
+        return 0
+    horizon_end = timezone.now() + timedelta(seconds=settings.SCHEDULER_EVENT_HORIZON)
+    count = 0
+    for message_id, eta, priority in messages:
+        if eta > horizon_end:
+            continue
+        if not enqueue_message_dispatch(message_id, eta, priority):
+            break
+        count += 1
+    return count
+
+def enqueue_upcoming_messages(now=None):
+    """
+    Enqueue send tasks for messages that entered the event horizon since the last sweep
+
+    The window overlaps the previous sweep by one interval so a late sweep
+    never leaves a gap; a duplicate task is harmless because sends claim
+    their row first.
+    """
+    if not settings.SCHEDULER_EVENT_DISPATCH:
+        return 0
+    now = now or timezone.now()
+    horizon_end = now + timedelta(seconds=settings.SCHEDULER_EVENT_HORIZON)
+    horizon_start = horizon_end - timedelta(seconds=2 * settings.SCHEDULER_SWEEP_INTERVAL)
+    upcoming = ScheduledMessage.objects.filter(
+        status='pending',
+        scheduled_time__gt=max(now, horizon_start),
+        scheduled_time__lte=horizon_end
+    ).values_list('id', 'scheduled_time', 'priority')
+    
+    count = 0
+    for message_id, scheduled_time, priority in upcoming.iterator():
+        count += enqueue_message_dispatch(message_id, scheduled_time, priority)
+    return count
+
+@shared_task(ignore_result=True)
+def send_scheduled_message(message_id):
+    """
+    Task to send one scheduled message at its scheduled time
+    This task is enqueued with an ETA when a message is created or edited
+    """
+    outcome = process_scheduled_message(message_id)
+    if outcome is None:
+        message = ScheduledMessage.objects.filter(id=message_id, status='pending').first()
+        if message:
+            dispatch_time = get_dispatch_time(message)
+            if timezone.now() < dispatch_time <= timezone.now() + EARLY_FIRE_TOLERANCE:
+                send_scheduled_message.apply_async(
+                    args=[message_id],
+                    eta=dispatch_time,
+                    queue=get_dispatch_queue(message.priority)
+                )
+    return outcome
+
+@shared_task(bind=True, track_started=True)
+def send_message_immediately(self, message_id, callback_url=None):
+    """
+    Task behind the async mode of the immediate-send endpoints
+
+    Routed to the SCHEDULER_IMMEDIATE_QUEUE queue, so it never waits behind
+    a sweep. Its result is what GET /api/send-jobs/<id>/ reports, and is
+    POSTed to ``callback_url`` when one was given.
+    """
+    if not ScheduledMessage.objects.filter(id=message_id).exists():
+        result = {'message_id': message_id, 'status': 'failed', 'error': 'Message not found'}
+    else:
+        outcome, error = send_message_now(message_id)
+        # None: a dispatcher or another send got to the message first
+        result = {'message_id': message_id, 'status': outcome or 'conflict', 'error': error}
+    if callback_url:
+        deliver_send_callback.delay(callback_url, {'job_id': self.request.id, **result})
+    return result
+
+def get_send_job(job_id):
+    """
+    Status of an immediate-send job for GET /api/send-jobs/<id>/
+
+    Celery reports ids it has no result for as pending, so unknown and
+    expired (after CELERY_RESULT_EXPIRES) jobs read as queued.
+    """
+    result = send_message_immediately.AsyncResult(job_id)
+    job = {'job_id': job_id, 'status': 'queued'}
+    if result.state == 'STARTED':
+        job['status'] = 'running'
+    elif result.state == 'SUCCESS':
+        job.update(result.result)
+    elif result.state in ('FAILURE', 'REVOKED'):
+        job.update(status='error', error=str(result.result))
+    return job
+
+def sign_callback(body):
+    """
+    ``X-Scheduler-Signature`` header value for a callback body, or None without SCHEDULER_CALLBACK_SECRET
+    """
+    if not settings.SCHEDULER_CALLBACK_SECRET:
+        return None
+    digest = hmac.new(settings.SCHEDULER_CALLBACK_SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+def is_public_address(address):
+    """
+    False for loopback, private, link-local, reserved, multicast and unspecified addresses
+    """
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if getattr(ip, 'ipv4_mapped', None):
+        ip = ip.ipv4_mapped
+    return not (
+        ip.is_loopback or ip.is_private or ip.is_link_local
+        or ip.is_reserved or ip.is_multicast or ip.is_unspecified
+    )
+
+def is_callback_host_allowed(host):
+    """
+    Whether result callbacks may be POSTed to ``host``
+
+    With SCHEDULER_CALLBACK_ALLOWED_HOSTS set, only the hosts listed are
+    allowed. Without it a host is allowed only if every address it
+    resolves to is public, so an API caller cannot make the workers POST
+    to internal services or a cloud metadata endpoint.
+    """
+    if not host:
+        return False
+    allowed = settings.SCHEDULER_CALLBACK_ALLOWED_HOSTS
+    if allowed:
+        return host in allowed
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return False
+    return bool(addresses) and all(is_public_address(address) for address in addresses)
+
+@shared_task(bind=True, ignore_result=True, max_retries=3)
+def deliver_send_callback(self, url, payload):
+    """
+    POST the result of an immediate send to the caller's callback URL
+
+    Runs on the default queue so a slow receiver never holds up sends.
+    Failed deliveries are retried with backoff, then dropped; the result
+    can still be polled. The host is checked again here, since what it
+    resolves to may have changed since the request, and redirects are not
+    followed.
+    """
+    if not is_callback_host_allowed(urlparse(url).hostname):
+        logger.error(f"Not delivering callback for job {payload.get('job_id')}: {url} is not an allowed host")
+        return
+    body = json.dumps(payload)
+    headers = {'Content-Type': 'application/json'}
+    signature = sign_callback(body)
+    if signature:
+        headers['X-Scheduler-Signature'] = signature
+    try:
+        response = requests.post(
+            url, data=body, headers=headers, timeout=settings.SCHEDULER_CALLBACK_TIMEOUT, allow_redirects=False
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Giving up on callback for job {payload.get('job_id')} to {url}: {e}")
+            return
+        logger.warning(f"Callback for job {payload.get('job_id')} to {url} failed, retrying: {e}")
+        raise self.retry(exc=e, countdown=get_retry_delay(self.request.retries + 1))
+
+def enqueue_immediate_send(message_id, callback_url=None):
+    """
+    Enqueue an immediate send and return its job id, or None if the broker is unreachable
+    """
+    try:
+        result = send_message_immediately.apply_async(args=[message_id, callback_url], retry=False)
+    except Exception as e:
+        logger.warning(f"Could not enqueue immediate send of message {message_id}: {e}")
+        return None
+    return result.id
+
 @shared_task
-def process_due_messages():
+def process_due_messages(backend=None, concurrency=None, batch_size=None):
     """
     Task to process all due scheduled messages
     This task is scheduled to run periodically via Celery Beat
+
+    With event-driven dispatch enabled this is a low-frequency sweeper: it
+    catches anything a send task missed and enqueues messages that have
+    come within the event horizon. ``backend``, ``concurrency`` and
+    ``batch_size`` override the dispatcher settings for this run.
     """
     logger.info("Starting scheduled task to process due messages")
-    processed_count = process_scheduled_messages()
+    processed_count = process_scheduled_messages(backend=backend, concurrency=concurrency, batch_size=batch_size)
     logger.info(f"Processed {processed_count} scheduled messages")
+    enqueued_count = enqueue_upcoming_messages()
+    if enqueued_count:
+        logger.info(f"Enqueued {enqueued_count} upcoming messages for timed dispatch")
     return processed_count
+
+@shared_task
+def materialize_recurring():
+    """
+    Task to write the upcoming occurrences of recurring messages
+    This task is scheduled to run periodically via Celery Beat
+    """
+    return materialize_recurring_messages()
+
+@shared_task(ignore_result=True)
+def purge_expired_oauth_states():
+    """
+    Task to delete OAuth states from install flows that were never completed
+    This task is scheduled to run periodically via Celery Beat
+    """
+    deleted = purge_expired_states()
+    if deleted:
+        logger.info(f"Purged {deleted} expired OAuth states")
+
+@shared_task(ignore_result=True)
+def archive_message_history():
+    """
+    Task to move old sent and failed messages to the archive and purge expired archive rows
+    This task is scheduled to run periodically via Celery Beat
+    """
+    archived, purged, path = apply_retention()
+    if archived or purged:
+        logger.info(f"Archived {archived} messages, purged {purged} archived messages" + (f" to {path}" if path else ''))
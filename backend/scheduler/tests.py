@@ -1,3 +1,1243 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.error import URLError
+import fakeredis
+import redis
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
 
-# Create your tests here.
+from . import installation_store, reconciliation, services
+from .channels import ChannelDirectory, ChannelNotFound, resolve_channel
+from .dispatcher import Dispatcher
+from .message_templates import TemplateRenderError, compile_template, render_templates
+from .installation_store import CacheVersion, SlackInstallationNotFound, TTLCache, get_bot_tokens, resolve_bot_token
+from .models import ArchivedMessage, BroadcastTarget, MessageTemplate, OAuthState, RecurringMessage, ScheduledMessage, SlackInstallation
+from .recurrence import materialize_recurring_message, materialize_recurring_messages
+from .retention import archive_messages, export_archive, purge_archive
+from .rate_limit import SlackRateLimitedError, SlackRateLimiter
+from .services import (
+    apply_send_result, claim_due_messages, claim_message_now, classify_send_error, rank_due_messages, record_send_results
+)
+from .slack_clients import PooledWebClient
+from .state_store import DjangoOAuthStateStore, purge_expired_states
+from .tasks import deliver_send_callback, send_message_immediately
+from .views import validate_callback_url
+
+def create_message(**fields):
+    """
+    Save a pending message that is due now unless ``fields`` say otherwise
+    """
+    fields.setdefault('message', 'Hello')
+    fields.setdefault('channel', 'C0000001')
+    fields.setdefault('scheduled_time', timezone.now() - timedelta(minutes=1))
+    return ScheduledMessage.objects.create(**fields)
+
+def slack_error(error, status_code=200, headers=None):
+    """
+    A SlackApiError as the client raises it for an ``ok: false`` response
+    """
+    response = SlackResponse(
+        client=None,
+        http_verb='POST',
+        api_url='https://slack.com/api/chat.postMessage',
+        req_args={},
+        data={'ok': False, 'error': error},
+        headers=headers or {},
+        status_code=status_code,
+    )
+    return SlackApiError(f"The request to the Slack API failed: {error}", response)
+
+# Keep tests off the Celery broker and the Redis-backed limiter and channel cache
+@override_settings(SCHEDULER_EVENT_DISPATCH=False, SLACK_RATE_LIMIT_ENABLED=False, SLACK_CHANNEL_CACHE_ENABLED=False)
+class SchedulerTestCase(TestCase):
+    client_class = APIClient
+
+
+class ClaimTests(SchedulerTestCase):
+    def test_claim_moves_rows_to_sending_under_one_token(self):
+        messages = [create_message() for _ in range(3)]
+
+        claimed = claim_due_messages(limit=10, worker_id='worker-a')
+
+        self.assertEqual([message.id for message in claimed], [message.id for message in messages])
+        self.assertEqual(len({message.claimed_by for message in claimed}), 1)
+        self.assertTrue(claimed[0].claimed_by.startswith('worker-a:'))
+        self.assertEqual(ScheduledMessage.objects.filter(status='sending').count(), 3)
+
+    def test_workers_claim_disjoint_rows(self):
+        for _ in range(5):
+            create_message()
+
+        first = claim_due_messages(limit=3, worker_id='worker-a')
+        second = claim_due_messages(limit=3, worker_id='worker-b')
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({message.id for message in first} & {message.id for message in second})
+        self.assertEqual(claim_due_messages(limit=3, worker_id='worker-c'), [])
+
+    def test_skips_messages_not_due_backing_off_or_claimed(self):
+        now = timezone.now()
+        due = create_message()
+        create_message(scheduled_time=now + timedelta(minutes=5))
+        create_message(next_attempt_at=now + timedelta(minutes=5))
+        create_message(claimed_by='other', claimed_at=now)
+
+        claimed = claim_due_messages(worker_id='worker-a', now=now)
+
+        self.assertEqual([message.id for message in claimed], [due.id])
+
+    def test_pending_message_with_expired_lease_is_claimed_again(self):
+        now = timezone.now()
+        message = create_message(claimed_by='gone', claimed_at=now - timedelta(seconds=301))
+
+        with override_settings(SCHEDULER_CLAIM_LEASE_SECONDS=300):
+            claimed = claim_due_messages(worker_id='worker-a', now=now)
+
+        self.assertEqual([claimed_message.id for claimed_message in claimed], [message.id])
+
+    def test_claimed_ids_keep_the_order_asked_for(self):
+        messages = [create_message() for _ in range(3)]
+        ids = [messages[2].id, messages[0].id, messages[1].id]
+
+        claimed = claim_due_messages(worker_id='worker-a', ids=ids)
+
+        self.assertEqual([message.id for message in claimed], ids)
+
+    def test_conditional_update_skips_row_claimed_in_between(self):
+        """
+        Without SKIP LOCKED a row another worker claims between the read and the UPDATE is left to it
+        """
+        first, second = create_message(), create_message()
+        due_messages_queryset = services.due_messages_queryset
+        calls = []
+
+        def claim_first_in_between(now=None):
+            calls.append(now)
+            if len(calls) == 2:
+                # The candidates have been read; another worker wins one of them
+                ScheduledMessage.objects.filter(id=first.id).update(status='sending', claimed_by='other', claimed_at=now)
+            return due_messages_queryset(now)
+
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False), \
+                mock.patch.object(services, 'due_messages_queryset', side_effect=claim_first_in_between):
+            claimed = claim_due_messages(worker_id='worker-a')
+
+        self.assertEqual([message.id for message in claimed], [second.id])
+        self.assertEqual(ScheduledMessage.objects.get(id=first.id).claimed_by, 'other')
+
+    def test_claim_message_now_is_exclusive(self):
+        message = create_message(scheduled_time=timezone.now() + timedelta(days=1))
+
+        claimed = claim_message_now(message.id, worker_id='web')
+
+        self.assertEqual(claimed.id, message.id)
+        self.assertEqual(claimed.claimed_by, ScheduledMessage.objects.get(id=message.id).claimed_by)
+        self.assertIsNone(claim_message_now(message.id, worker_id='web'))
+        self.assertEqual(claim_due_messages(worker_id='worker-a', ids=[message.id]), [])
+
+
+class SendErrorTests(SchedulerTestCase):
+    def test_transient_errors(self):
+        self.assertEqual(classify_send_error(SlackRateLimitedError('C0000001', 12)), (True, 12))
+        self.assertEqual(classify_send_error(slack_error('ratelimited', 429, {'Retry-After': '7'})), (True, 7.0))
+        self.assertEqual(classify_send_error(slack_error('internal_error')), (True, None))
+        self.assertEqual(classify_send_error(slack_error('unknown', 503)), (True, None))
+        self.assertEqual(classify_send_error(URLError('connection refused')), (True, None))
+        self.assertEqual(classify_send_error(TimeoutError()), (True, None))
+
+    def test_permanent_errors(self):
+        for error in ('channel_not_found', 'not_in_channel', 'invalid_auth'):
+            self.assertEqual(classify_send_error(slack_error(error)), (False, None))
+        self.assertEqual(classify_send_error(ValueError('bad template')), (False, None))
+
+    @override_settings(SCHEDULER_MAX_ATTEMPTS=3, SCHEDULER_RETRY_BASE_DELAY=30, SCHEDULER_RETRY_MAX_DELAY=3600)
+    def test_transient_failure_backs_off_until_attempts_run_out(self):
+        now = timezone.now()
+        message = create_message(status='sending', claimed_by='worker-a', claimed_at=now)
+
+        self.assertEqual(apply_send_result(message, False, slack_error('internal_error'), now=now), 'deferred')
+        self.assertEqual(message.status, 'pending')
+        self.assertIsNone(message.claimed_by)
+        self.assertTrue(now + timedelta(seconds=15) <= message.next_attempt_at <= now + timedelta(seconds=30))
+
+        self.assertEqual(apply_send_result(message, False, slack_error('internal_error'), now=now), 'deferred')
+        self.assertTrue(now + timedelta(seconds=30) <= message.next_attempt_at <= now + timedelta(seconds=60))
+
+        self.assertEqual(apply_send_result(message, False, slack_error('internal_error'), now=now), 'failed')
+        self.assertEqual(message.attempts, 3)
+        self.assertIsNone(message.next_attempt_at)
+
+    def test_retry_waits_at_least_retry_after(self):
+        now = timezone.now()
+        message = create_message(status='sending', claimed_by='worker-a', claimed_at=now)
+
+        apply_send_result(message, False, SlackRateLimitedError('C0000001', 900), now=now)
+
+        self.assertGreaterEqual(message.next_attempt_at, now + timedelta(seconds=900))
+
+    def test_permanent_failure_fails_at_once(self):
+        message = create_message(status='sending', claimed_by='worker-a', claimed_at=timezone.now())
+
+        self.assertEqual(apply_send_result(message, False, slack_error('channel_not_found')), 'failed')
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('channel_not_found', message.last_error)
+
+
+class RecordSendResultsTests(SchedulerTestCase):
+    def test_outcomes_are_written_back(self):
+        for _ in range(3):
+            create_message()
+        sent, deferred, failed = claim_due_messages(worker_id='worker-a')
+
+        outcomes = record_send_results([
+            (sent, True, None),
+            (deferred, False, slack_error('internal_error')),
+            (failed, False, slack_error('channel_not_found')),
+        ])
+
+        self.assertEqual([outcome for _, outcome, _ in outcomes], ['sent', 'deferred', 'failed'])
+        rows = ScheduledMessage.objects.in_bulk([sent.id, deferred.id, failed.id])
+        self.assertEqual(rows[sent.id].status, 'sent')
+        self.assertEqual(rows[sent.id].attempts, 1)
+        self.assertEqual(rows[deferred.id].status, 'pending')
+        self.assertIsNotNone(rows[deferred.id].next_attempt_at)
+        self.assertIn('internal_error', rows[deferred.id].last_error)
+        self.assertEqual(rows[failed.id].status, 'failed')
+        for row in rows.values():
+            self.assertIsNone(row.claimed_by)
+            self.assertIsNone(row.claimed_at)
+            self.assertEqual(row.message, 'Hello')
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def count_queries(size):
+            ScheduledMessage.objects.all().delete()
+            for _ in range(size):
+                create_message()
+            claimed = claim_due_messages(worker_id='worker-a')
+            results = [(message, index % 2 == 0, slack_error('channel_not_found')) for index, message in enumerate(claimed)]
+            with CaptureQueriesContext(connection) as queries:
+                record_send_results(results)
+            return len(queries)
+
+        self.assertEqual(count_queries(4), count_queries(40))
+
+
+class ClaimLeaseTests(SchedulerTestCase):
+    def test_result_is_dropped_once_the_claim_changed_hands(self):
+        create_message()
+        stale, = claim_due_messages(worker_id='worker-a')
+        # The lease ran out and reconciliation or another worker took the row over
+        ScheduledMessage.objects.filter(id=stale.id).update(status='sent', claimed_by=None, claimed_at=None)
+
+        record_send_results([(stale, False, slack_error('channel_not_found'))])
+
+        self.assertEqual(ScheduledMessage.objects.get(id=stale.id).status, 'sent')
+
+    def test_result_is_dropped_for_a_reclaimed_row(self):
+        now = timezone.now()
+        create_message(scheduled_time=now - timedelta(hours=2))
+        stale, = claim_due_messages(worker_id='worker-a', now=now - timedelta(hours=1))
+        ScheduledMessage.objects.filter(id=stale.id).update(status='pending')
+        current, = claim_due_messages(worker_id='worker-b', now=now)
+
+        record_send_results([(stale, True, None)])
+
+        row = ScheduledMessage.objects.get(id=stale.id)
+        self.assertEqual(row.status, 'sending')
+        self.assertEqual(row.claimed_by, current.claimed_by)
+
+    def test_renew_claims_only_extends_claims_still_held(self):
+        then = timezone.now() - timedelta(minutes=4)
+        create_message(scheduled_time=then)
+        create_message(scheduled_time=then)
+        held, lost = claim_due_messages(worker_id='worker-a', now=then)
+        ScheduledMessage.objects.filter(id=lost.id).update(claimed_by='worker-b')
+
+        now = timezone.now()
+        services.renew_claims([held, lost], now=now)
+
+        self.assertEqual(ScheduledMessage.objects.get(id=held.id).claimed_at, now)
+        self.assertEqual(ScheduledMessage.objects.get(id=lost.id).claimed_at, then)
+
+
+@override_settings(SCHEDULER_CLAIM_LEASE_SECONDS=300, SCHEDULER_RESEND_UNVERIFIED=True)
+class ReconciliationTests(SchedulerTestCase):
+    def create_stale_message(self, **fields):
+        return create_message(
+            status='sending',
+            claimed_by='gone:1:abcdef12',
+            claimed_at=timezone.now() - timedelta(minutes=10),
+            **fields
+        )
+
+    def reconcile(self, history=None, error=None):
+        client = mock.Mock(token='xoxb-test')
+        if error is not None:
+            client.conversations_history.side_effect = error
+        else:
+            client.conversations_history.return_value = {'messages': history or []}
+        with mock.patch('scheduler.reconciliation.get_slack_client', return_value=client), \
+                mock.patch('scheduler.reconciliation.get_bot_tokens', side_effect=lambda ids: {team_id: 'xoxb-test' for team_id in ids}):
+            return reconciliation.reconcile_stale_sends()
+
+    def posted(self, message):
+        return {
+            'ts': '1700000000.000100',
+            'metadata': {
+                'event_type': services.METADATA_EVENT_TYPE,
+                'event_payload': {'idempotency_key': str(message.idempotency_key)},
+            },
+        }
+
+    def test_message_found_in_history_is_sent(self):
+        message = self.create_stale_message()
+
+        stats = self.reconcile(history=[{'ts': '1700000000.000099'}, self.posted(message)])
+
+        self.assertEqual(stats['sent'], 1)
+        row = ScheduledMessage.objects.get(id=message.id)
+        self.assertEqual(row.status, 'sent')
+        self.assertEqual(row.attempts, 1)
+        self.assertIsNone(row.claimed_by)
+
+    def test_message_missing_from_history_goes_back_to_pending(self):
+        message = self.create_stale_message()
+
+        stats = self.reconcile(history=[self.posted(create_message())])
+
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'pending')
+
+    def test_channel_the_post_cannot_be_in_goes_back_to_pending(self):
+        message = self.create_stale_message()
+
+        self.reconcile(error=slack_error('channel_not_found'))
+
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'pending')
+
+    def test_transient_history_error_leaves_the_message_for_the_next_pass(self):
+        message = self.create_stale_message()
+
+        stats = self.reconcile(error=slack_error('internal_error'))
+
+        self.assertEqual(stats['retry'], 1)
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'sending')
+
+    @override_settings(SCHEDULER_RESEND_UNVERIFIED=False)
+    def test_unverifiable_message_fails_unless_resending_is_allowed(self):
+        message = self.create_stale_message()
+
+        self.reconcile(error=slack_error('missing_scope'))
+
+        row = ScheduledMessage.objects.get(id=message.id)
+        self.assertEqual(row.status, 'failed')
+        self.assertIn('missing_scope', row.last_error)
+
+    @override_settings(SCHEDULER_RESEND_UNVERIFIED=False)
+    def test_channel_stored_by_name_is_not_taken_as_unposted(self):
+        """
+        history answers channel_not_found for any name; that must not lead to a second post
+        """
+        message = self.create_stale_message(channel='#general')
+        client = mock.Mock(token='xoxb-test')
+
+        with mock.patch('scheduler.reconciliation.get_slack_client', return_value=client), \
+                mock.patch('scheduler.reconciliation.get_bot_tokens', side_effect=lambda ids: {team_id: 'xoxb-test' for team_id in ids}):
+            stats = reconciliation.reconcile_stale_sends()
+
+        client.conversations_history.assert_not_called()
+        self.assertEqual(stats['failed'], 1)
+        row = ScheduledMessage.objects.get(id=message.id)
+        self.assertEqual(row.status, 'failed')
+        self.assertIn('stored by name', row.last_error)
+
+    def test_channel_stored_by_name_is_checked_under_its_resolved_id(self):
+        message = self.create_stale_message(channel='#general')
+
+        with mock.patch('scheduler.reconciliation.resolve_channel', return_value='C0000042') as resolve:
+            self.reconcile(history=[self.posted(message)])
+
+        resolve.assert_called_once_with('#general', '')
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'sent')
+
+    def test_live_claims_are_left_alone(self):
+        message = create_message(status='sending', claimed_by='worker-a:1:abcdef12', claimed_at=timezone.now())
+
+        stats = self.reconcile()
+
+        self.assertEqual(stats, {'sent': 0, 'failed': 0, 'pending': 0, 'retry': 0})
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'sending')
+
+
+class BulkScheduleTests(SchedulerTestCase):
+    url = reverse('message-bulk')
+
+    def item(self, **fields):
+        return {'message': 'Hello', 'channel': 'C0000001', 'scheduled_time': '2030-01-01T09:00:00Z', **fields}
+
+    def test_json_array_is_created_in_one_request(self):
+        response = self.client.post(self.url, [self.item(), self.item(channel='C0000002')], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            list(ScheduledMessage.objects.order_by('id').values_list('id', 'channel')),
+            list(zip(response.data['ids'], ['C0000001', 'C0000002']))
+        )
+
+    def test_invalid_items_are_reported_by_index_and_nothing_is_created(self):
+        payload = [self.item(), self.item(channel=''), self.item(), self.item(scheduled_time='soon')]
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 3])
+        self.assertIn('channel', response.data['errors'][0]['errors'])
+        self.assertIn('scheduled_time', response.data['errors'][1]['errors'])
+        self.assertFalse(ScheduledMessage.objects.exists())
+
+    def test_ndjson_stream_is_created(self):
+        body = '{"message": "One", "channel": "C0000001", "scheduled_time": "2030-01-01T09:00:00Z"}\n\n' \
+               '{"message": "Two", "channel": "C0000002", "scheduled_time": "2030-01-01T09:00:00Z"}\n'
+
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(ScheduledMessage.objects.order_by('id').values_list('message', flat=True)), ['One', 'Two'])
+
+    def test_ndjson_parse_error_names_the_line(self):
+        body = '{"message": "One", "channel": "C0000001", "scheduled_time": "2030-01-01T09:00:00Z"}\n{"message": \n'
+
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 2', response.data['detail'])
+        self.assertFalse(ScheduledMessage.objects.exists())
+
+    @override_settings(SCHEDULER_BULK_MAX_ITEMS=2)
+    def test_payload_over_the_limit_is_refused(self):
+        response = self.client.post(self.url, [self.item()] * 3, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScheduledMessage.objects.exists())
+
+
+class MessageListTests(SchedulerTestCase):
+    url = reverse('message-list')
+
+    def setUp(self):
+        start = timezone.now()
+        self.messages = [create_message(scheduled_time=start + timedelta(minutes=index)) for index in range(5)]
+
+    def test_cursor_pages_walk_every_message_newest_first(self):
+        seen = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(message['id'] for message in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, [message.id for message in reversed(self.messages)])
+
+    def test_new_rows_do_not_shift_the_next_page(self):
+        first = self.client.get(f"{self.url}?page_size=2")
+        create_message(scheduled_time=timezone.now() + timedelta(days=1))
+
+        second = self.client.get(first.data['next'])
+
+        self.assertEqual(
+            [message['id'] for message in second.data['results']],
+            [self.messages[2].id, self.messages[1].id]
+        )
+
+    def test_fields_selects_the_serialized_fields(self):
+        response = self.client.get(f"{self.url}?fields=id,channel,status")
+
+        self.assertEqual(response.status_code, 200)
+        for message in response.data['results']:
+            self.assertEqual(set(message), {'id', 'channel', 'status'})
+
+    def test_fields_rejects_unknown_and_write_only_fields(self):
+        for fields in ('id,nope', 'channels'):
+            response = self.client.get(f"{self.url}?fields={fields}")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fields', response.data)
+
+    def test_filters(self):
+        ScheduledMessage.objects.filter(id=self.messages[0].id).update(status='failed', channel='C0000009')
+
+        by_status = self.client.get(f"{self.url}?status=failed&fields=id")
+        by_channel = self.client.get(f"{self.url}?channel=C0000009&fields=id")
+
+        self.assertEqual([message['id'] for message in by_status.data['results']], [self.messages[0].id])
+        self.assertEqual([message['id'] for message in by_channel.data['results']], [self.messages[0].id])
+        self.assertEqual(self.client.get(f"{self.url}?status=nope").status_code, 400)
+
+
+@override_settings(SCHEDULER_RECURRING_HORIZON=3 * 86400, SCHEDULER_RECURRING_MAX_OCCURRENCES=100)
+class RecurrenceTests(SchedulerTestCase):
+    def setUp(self):
+        # Far enough ahead that saving the rule writes nothing yet
+        self.recurring = RecurringMessage.objects.create(
+            message='Standup',
+            channel='C0000001',
+            rrule='FREQ=DAILY;BYHOUR=9;BYMINUTE=30',
+            dtstart=datetime(2030, 3, 8, 9, 30, tzinfo=dt_timezone.utc),
+            timezone='America/New_York',
+        )
+        self.now = datetime(2030, 3, 8, 12, 0, tzinfo=dt_timezone.utc)
+
+    def occurrences(self):
+        return list(
+            ScheduledMessage.objects.filter(recurring=self.recurring)
+            .order_by('scheduled_time')
+            .values_list('scheduled_time', flat=True)
+        )
+
+    def test_writes_the_occurrences_inside_the_horizon_in_local_time(self):
+        self.assertEqual(self.occurrences(), [])
+
+        self.assertEqual(materialize_recurring_messages(now=self.now), 3)
+
+        # 09:30 New York each day, before and after the switch to daylight time on March 10
+        self.assertEqual(self.occurrences(), [
+            datetime(2030, 3, 8, 14, 30, tzinfo=dt_timezone.utc),
+            datetime(2030, 3, 9, 14, 30, tzinfo=dt_timezone.utc),
+            datetime(2030, 3, 10, 13, 30, tzinfo=dt_timezone.utc),
+        ])
+
+    def test_repeating_a_pass_writes_nothing(self):
+        materialize_recurring_messages(now=self.now)
+
+        self.assertEqual(materialize_recurring_messages(now=self.now), 0)
+        self.assertEqual(len(self.occurrences()), 3)
+
+    def test_concurrent_pass_with_a_stale_cursor_writes_nothing(self):
+        stale = RecurringMessage.objects.get(id=self.recurring.id)
+        materialize_recurring_messages(now=self.now)
+
+        self.assertEqual(materialize_recurring_message(stale, now=self.now), [])
+        self.assertEqual(len(self.occurrences()), 3)
+
+    def test_rewound_cursor_does_not_duplicate_occurrences(self):
+        materialize_recurring_messages(now=self.now)
+        first = self.occurrences()[0]
+        RecurringMessage.objects.filter(id=self.recurring.id).update(next_occurrence_at=first)
+
+        materialize_recurring_messages(now=self.now)
+
+        self.assertEqual(len(self.occurrences()), 3)
+
+    def test_later_pass_only_adds_new_occurrences(self):
+        materialize_recurring_messages(now=self.now)
+
+        self.assertEqual(materialize_recurring_messages(now=self.now + timedelta(days=2)), 2)
+        self.assertEqual(len(self.occurrences()), 5)
+
+
+class MessageTemplateTests(SchedulerTestCase):
+    def setUp(self):
+        self.template = MessageTemplate.objects.create(
+            name='welcome',
+            text='Hi {{ name }}, welcome to {{team}}',
+            blocks=[{'type': 'section', 'text': {'type': 'mrkdwn', 'text': '*{{ name }}* joined'}}],
+        )
+
+    def test_renders_text_and_blocks_with_escaped_values(self):
+        text, blocks = compile_template(self.template.text, self.template.blocks).render(
+            {'name': 'Ana "<!channel>"', 'team': 'R&D'}
+        )
+
+        self.assertEqual(text, 'Hi Ana "&lt;!channel&gt;", welcome to R&amp;D')
+        self.assertEqual(blocks[0]['text']['text'], '*Ana "&lt;!channel&gt;"* joined')
+
+    def test_missing_variables_are_named(self):
+        with self.assertRaisesMessage(TemplateRenderError, 'Missing template variables: name, team'):
+            compile_template(self.template.text).render({})
+
+    def test_batch_renders_what_it_can_and_fails_the_rest(self):
+        good = create_message(message='', template=self.template, variables={'name': 'Ana', 'team': 'Ops'})
+        bad = create_message(message='', template=self.template, variables={'name': 'Bo'})
+
+        rendered, failures = render_templates([good, bad])
+
+        self.assertEqual(rendered, [good])
+        self.assertEqual(good.message, 'Hi Ana, welcome to Ops')
+        (failed, success, error), = failures
+        self.assertEqual((failed, success), (bad, False))
+        self.assertIn('team', str(error))
+
+    def test_scheduling_without_every_variable_is_refused(self):
+        response = self.client.post(reverse('message-list'), {
+            'template': self.template.id,
+            'variables': {'name': 'Ana'},
+            'channel': 'C0000001',
+            'scheduled_time': '2030-01-01T09:00:00Z',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Missing template variables: team', str(response.data['variables']))
+
+    def test_message_missing_a_variable_at_dispatch_fails_without_sending(self):
+        create_message(message='', template=self.template, variables={'name': 'Ana', 'team': 'Ops'})
+        # The template gained a variable after the message was scheduled
+        MessageTemplate.objects.filter(id=self.template.id).update(text='{{ greeting }} {{ name }}')
+        message, = claim_due_messages(worker_id='worker-a')
+
+        with mock.patch('scheduler.dispatcher.post_slack_message') as post:
+            (_, outcome, error), = Dispatcher(backend='sync').dispatch_batch([message])
+
+        post.assert_not_called()
+        self.assertEqual(outcome, 'failed')
+        self.assertIsInstance(error, TemplateRenderError)
+        row = ScheduledMessage.objects.get(id=message.id)
+        self.assertEqual(row.status, 'failed')
+        self.assertIn('greeting', row.last_error)
+        self.assertEqual(row.message, '')
+
+
+class RetentionTests(SchedulerTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        old = self.now - timedelta(days=40)
+        self.sent = [create_message(status='sent', attempts=1, scheduled_time=old + timedelta(minutes=index)) for index in range(3)]
+        self.failed = create_message(status='failed', last_error='channel_not_found', scheduled_time=old)
+        self.broadcast = create_message(status='sent', channel='', is_broadcast=True, scheduled_time=old)
+        BroadcastTarget.objects.create(message=self.broadcast, channel='C0000001', status='sent', sent_at=old)
+        BroadcastTarget.objects.create(message=self.broadcast, channel='C0000002', status='failed', last_error='is_archived')
+        self.pending = create_message(scheduled_time=old)
+        self.recent = create_message(status='sent', scheduled_time=self.now - timedelta(days=1))
+        self.archived_ids = sorted([message.id for message in self.sent] + [self.failed.id, self.broadcast.id])
+
+    def test_archive_moves_only_old_finished_messages(self):
+        archived = archive_messages(cutoff=self.now - timedelta(days=30), batch_size=2)
+
+        self.assertEqual(archived, 5)
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('id', flat=True)), self.archived_ids)
+        self.assertEqual(
+            sorted(ScheduledMessage.objects.values_list('id', flat=True)),
+            sorted([self.pending.id, self.recent.id])
+        )
+        self.assertFalse(BroadcastTarget.objects.exists())
+        self.assertEqual(
+            [(target['channel'], target['status']) for target in ArchivedMessage.objects.get(id=self.broadcast.id).targets],
+            [('C0000001', 'sent'), ('C0000002', 'failed')]
+        )
+
+    def test_export_round_trips_the_archived_rows(self):
+        archive_messages(cutoff=self.now - timedelta(days=30))
+        output = io.StringIO()
+
+        self.assertEqual(export_archive(output, batch_size=2), 5)
+
+        rows = {row['id']: row for row in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(sorted(rows), self.archived_ids)
+        for message in self.sent + [self.failed, self.broadcast]:
+            row = rows[message.id]
+            self.assertEqual(row['status'], message.status)
+            self.assertEqual(row['channel'], message.channel)
+            self.assertEqual(row['last_error'], message.last_error)
+            self.assertEqual(row['idempotency_key'], str(message.idempotency_key))
+        self.assertEqual(rows[self.broadcast.id]['targets'][1]['last_error'], 'is_archived')
+
+    def test_purge_exports_every_row_it_deletes(self):
+        archive_messages(cutoff=self.now - timedelta(days=30))
+
+        with tempfile.TemporaryDirectory() as export_dir:
+            purged, path = purge_archive(cutoff=self.now, batch_size=2, export_dir=export_dir, now=self.now)
+            with gzip.open(path, 'rt', encoding='utf-8') as exported:
+                rows = [json.loads(line) for line in exported]
+
+        self.assertEqual(purged, 5)
+        self.assertEqual(sorted(row['id'] for row in rows), self.archived_ids)
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+
+class SlowSlackHandler(BaseHTTPRequestHandler):
+    """
+    Counts POSTs and answers only after ``delay`` seconds
+    """
+    delay = 1.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.posts += 1
+        time.sleep(self.delay)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(b'{"ok": true, "ts": "1700000000.000100"}')
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWebClientTests(SchedulerTestCase):
+    def start_server(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SlowSlackHandler)
+        server.daemon_threads = True
+        server.posts = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_read_timeout_posts_exactly_once(self):
+        server = self.start_server()
+        client = PooledWebClient(token='xoxb-test', base_url=f"http://127.0.0.1:{server.server_port}/api/", timeout=0.2)
+
+        with self.assertRaises(TimeoutError):
+            client.chat_postMessage(channel='C0000001', text='Hello')
+
+        client.close()
+        self.assertEqual(server.posts, 1)
+
+    def test_connect_failure_is_a_retryable_url_error(self):
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            port = unused.getsockname()[1]
+        client = PooledWebClient(token='xoxb-test', base_url=f"http://127.0.0.1:{port}/api/", retry_handlers=[])
+
+        with self.assertRaises(URLError):
+            client.chat_postMessage(channel='C0000001', text='Hello')
+
+
+class CallbackUrlTests(SchedulerTestCase):
+    def resolve_to(self, address):
+        return mock.patch('scheduler.tasks.socket.getaddrinfo', return_value=[(None, None, None, '', (address, 0))])
+
+    def test_internal_addresses_are_refused(self):
+        for url in (
+            'http://169.254.169.254/latest/meta-data/',
+            'http://localhost:6379/',
+            'http://127.0.0.1/x',
+            'http://10.0.0.1/x',
+            'http://192.168.1.5/x',
+            'http://[::1]/x',
+            'http://[::ffff:10.0.0.1]/x',
+            'http://0.0.0.0/x',
+        ):
+            self.assertEqual(validate_callback_url(url), 'callback_url host is not allowed', url)
+
+    def test_name_resolving_to_a_private_address_is_refused(self):
+        with self.resolve_to('10.1.2.3'):
+            self.assertEqual(validate_callback_url('https://hooks.example.com/done'), 'callback_url host is not allowed')
+
+    def test_public_host_is_allowed(self):
+        with self.resolve_to('93.184.216.34'):
+            self.assertIsNone(validate_callback_url('https://hooks.example.com/done'))
+
+    def test_unresolvable_host_and_other_schemes_are_refused(self):
+        with mock.patch('scheduler.tasks.socket.getaddrinfo', side_effect=socket.gaierror):
+            self.assertEqual(validate_callback_url('https://nowhere.invalid/'), 'callback_url host is not allowed')
+        self.assertEqual(validate_callback_url('file:///etc/passwd'), 'callback_url must be an http(s) URL')
+
+    @override_settings(SCHEDULER_CALLBACK_ALLOWED_HOSTS=['hooks.internal'])
+    def test_allowed_hosts_replace_the_address_check(self):
+        self.assertIsNone(validate_callback_url('http://hooks.internal/done'))
+        with self.resolve_to('93.184.216.34'):
+            self.assertEqual(validate_callback_url('https://hooks.example.com/done'), 'callback_url host is not allowed')
+
+    def test_delivery_rechecks_the_host(self):
+        with self.resolve_to('169.254.169.254'), mock.patch('scheduler.tasks.requests.post') as post:
+            deliver_send_callback.apply(args=['https://hooks.example.com/done', {'job_id': 'job-1'}])
+
+        post.assert_not_called()
+
+    def test_send_with_an_internal_callback_is_refused(self):
+        message = create_message()
+
+        response = self.client.post(
+            reverse('message-send', args=[message.id]),
+            {'callback_url': 'http://169.254.169.254/latest/meta-data/'},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'pending')
+
+
+class SendJobTests(SchedulerTestCase):
+    def test_async_send_is_queued_as_a_job_to_poll(self):
+        message = create_message()
+
+        with mock.patch.object(send_message_immediately, 'apply_async', return_value=mock.Mock(id='job-1')) as apply_async:
+            response = self.client.post(f"{reverse('message-send', args=[message.id])}?async=true")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['job_id'], 'job-1')
+        self.assertEqual(response['Location'], response.data['status_url'])
+        self.assertTrue(response.data['status_url'].endswith(reverse('send-job', args=['job-1'])))
+        apply_async.assert_called_once_with(args=[message.id, None], retry=False)
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'pending')
+
+    def test_job_status_reports_the_task_state(self):
+        url = reverse('send-job', args=['job-1'])
+        for state, result, expected in (
+            ('PENDING', None, {'job_id': 'job-1', 'status': 'queued'}),
+            ('STARTED', None, {'job_id': 'job-1', 'status': 'running'}),
+            ('SUCCESS', {'message_id': 7, 'status': 'sent', 'error': None}, {'job_id': 'job-1', 'message_id': 7, 'status': 'sent', 'error': None}),
+            ('FAILURE', RuntimeError('boom'), {'job_id': 'job-1', 'status': 'error', 'error': 'boom'}),
+        ):
+            with mock.patch.object(send_message_immediately, 'AsyncResult', return_value=mock.Mock(state=state, result=result)):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, expected)
+
+    def test_async_send_of_a_missing_message_is_not_queued(self):
+        with mock.patch.object(send_message_immediately, 'apply_async') as apply_async:
+            response = self.client.post(f"{reverse('message-send', args=[999])}?async=true")
+
+        self.assertEqual(response.status_code, 404)
+        apply_async.assert_not_called()
+
+    def test_task_sends_once_then_reports_conflict(self):
+        message = create_message()
+
+        with mock.patch('scheduler.dispatcher.post_slack_message', return_value={'ts': '1'}) as post, \
+                mock.patch.object(deliver_send_callback, 'delay') as deliver:
+            first = send_message_immediately.apply(args=[message.id, 'https://hooks.example.com/done']).result
+            second = send_message_immediately.apply(args=[message.id]).result
+
+        self.assertEqual(first, {'message_id': message.id, 'status': 'sent', 'error': None})
+        self.assertEqual(second['status'], 'conflict')
+        post.assert_called_once()
+        deliver.assert_called_once()
+        self.assertEqual(deliver.call_args.args[1]['status'], 'sent')
+
+
+class BroadcastTests(SchedulerTestCase):
+    channels = ['C0000001', 'C0000002', 'C0000003']
+
+    def setUp(self):
+        self.broadcast = create_message(channel='', is_broadcast=True)
+        BroadcastTarget.objects.bulk_create([BroadcastTarget(message=self.broadcast, channel=channel) for channel in self.channels])
+
+    def dispatch(self, errors=None, now=None):
+        """
+        Claim and send the broadcast, failing the channels in ``errors``; returns the outcome and the channels posted to
+        """
+        errors = errors or {}
+        posted = []
+        lock = threading.Lock()
+
+        def post(text, channel, **kwargs):
+            with lock:
+                posted.append(channel)
+            if channel in errors:
+                raise errors[channel]
+            return {'ts': '1700000000.000100'}
+
+        message, = claim_due_messages(worker_id='worker-a', now=now)
+        with mock.patch('scheduler.dispatcher.post_slack_message', side_effect=post):
+            (_, outcome, error), = Dispatcher(backend='sync').dispatch_batch([message])
+        return outcome, error, sorted(posted)
+
+    def target_statuses(self):
+        return dict(BroadcastTarget.objects.filter(message=self.broadcast).values_list('channel', 'status'))
+
+    def test_transient_failure_only_resends_the_failed_target(self):
+        outcome, _, posted = self.dispatch({'C0000002': slack_error('internal_error')})
+
+        self.assertEqual(outcome, 'deferred')
+        self.assertEqual(posted, self.channels)
+        self.assertEqual(self.target_statuses(), {'C0000001': 'sent', 'C0000002': 'pending', 'C0000003': 'sent'})
+
+        retry_at = ScheduledMessage.objects.get(id=self.broadcast.id).next_attempt_at
+        outcome, _, posted = self.dispatch(now=retry_at + timedelta(seconds=1))
+
+        self.assertEqual(outcome, 'sent')
+        self.assertEqual(posted, ['C0000002'])
+        self.assertEqual(set(self.target_statuses().values()), {'sent'})
+
+    def test_permanent_failure_on_one_target_fails_the_broadcast(self):
+        outcome, error, _ = self.dispatch({'C0000002': slack_error('channel_not_found')})
+
+        self.assertEqual(outcome, 'failed')
+        self.assertEqual(str(error), "Failed for 1 of 3 channels; see the message's targets")
+        self.assertEqual(self.target_statuses(), {'C0000001': 'sent', 'C0000002': 'failed', 'C0000003': 'sent'})
+        target = BroadcastTarget.objects.get(message=self.broadcast, channel='C0000002')
+        self.assertIn('channel_not_found', target.last_error)
+
+    @override_settings(SCHEDULER_MAX_ATTEMPTS=1)
+    def test_running_out_of_attempts_fails_the_pending_targets(self):
+        outcome, _, _ = self.dispatch({'C0000002': slack_error('internal_error')})
+
+        self.assertEqual(outcome, 'failed')
+        self.assertEqual(self.target_statuses(), {'C0000001': 'sent', 'C0000002': 'failed', 'C0000003': 'sent'})
+        self.assertIn('internal_error', BroadcastTarget.objects.get(message=self.broadcast, channel='C0000002').last_error)
+
+    @override_settings(SCHEDULER_BROADCAST_CHUNK_SIZE=2)
+    def test_large_fan_out_is_sent_in_chunks(self):
+        BroadcastTarget.objects.bulk_create([
+            BroadcastTarget(message=self.broadcast, channel=channel) for channel in ('C0000004', 'C0000005')
+        ])
+        send_all = Dispatcher._send_all
+        chunks = []
+
+        def record_chunk(dispatcher, tokens, messages, concurrent):
+            chunks.append(len(messages))
+            return send_all(dispatcher, tokens, messages, concurrent)
+
+        with mock.patch.object(Dispatcher, '_send_all', autospec=True, side_effect=record_chunk):
+            outcome, _, posted = self.dispatch()
+
+        self.assertEqual(outcome, 'sent')
+        self.assertEqual(chunks, [2, 2, 1])
+        self.assertEqual(len(posted), 5)
+
+    def test_reconciliation_marks_the_targets_found_and_resends_the_rest(self):
+        claimed_at = timezone.now() - timedelta(hours=1)
+        ScheduledMessage.objects.filter(id=self.broadcast.id).update(
+            status='sending', claimed_by='gone:1:abcdef12', claimed_at=claimed_at
+        )
+        posted = {
+            'ts': '1700000000.000100',
+            'metadata': {
+                'event_type': services.METADATA_EVENT_TYPE,
+                'event_payload': {'idempotency_key': str(self.broadcast.idempotency_key)},
+            },
+        }
+        client = mock.Mock(token='xoxb-test')
+        client.conversations_history.side_effect = lambda channel, **kwargs: {
+            'messages': [posted] if channel == 'C0000001' else []
+        }
+
+        with mock.patch('scheduler.reconciliation.get_slack_client', return_value=client), \
+                mock.patch('scheduler.reconciliation.get_bot_tokens', side_effect=lambda ids: {team_id: 'xoxb-test' for team_id in ids}):
+            stats = reconciliation.reconcile_stale_sends()
+
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(self.target_statuses(), {'C0000001': 'sent', 'C0000002': 'pending', 'C0000003': 'pending'})
+        self.assertEqual(ScheduledMessage.objects.get(id=self.broadcast.id).status, 'pending')
+
+
+class BotTokenCacheTests(SchedulerTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeServer()
+        self.version = self.cache_version()
+        for name, value in [('_bot_tokens', TTLCache(16, 60)), ('_cache_version', self.version)]:
+            patcher = mock.patch.object(installation_store, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cache_version(self):
+        """
+        A CacheVersion on the shared fake Redis, as another process would hold
+        """
+        with mock.patch('redis.Redis.from_url', return_value=fakeredis.FakeRedis(server=self.redis)):
+            return CacheVersion('redis://fake')
+
+    def install(self, team_id='T0000001', enterprise_id='', token='xoxb-team', **fields):
+        return SlackInstallation.objects.create(team_id=team_id, enterprise_id=enterprise_id, bot_token=token, **fields)
+
+    def test_org_install_answers_for_its_enterprise(self):
+        self.install(team_id='', enterprise_id='E0000001', token='xoxb-org', is_enterprise_install=True)
+        self.install(team_id='T0000002', enterprise_id='E0000002', token='xoxb-team')
+
+        with self.assertNumQueries(1):
+            tokens = get_bot_tokens(['E0000001', 'T0000002', 'E0000002'])
+
+        self.assertEqual(tokens, {'E0000001': 'xoxb-org', 'T0000002': 'xoxb-team', 'E0000002': None})
+
+    def test_missing_installation_is_cached_until_the_ttl(self):
+        with self.assertRaises(SlackInstallationNotFound):
+            resolve_bot_token('T0000001')
+        self.install()
+
+        with self.assertNumQueries(0), self.assertRaises(SlackInstallationNotFound):
+            resolve_bot_token('T0000001')
+        later = time.monotonic() + 61
+        with mock.patch('scheduler.installation_store.time.monotonic', return_value=later):
+            token = resolve_bot_token('T0000001')
+
+        self.assertEqual(token, 'xoxb-team')
+
+    def test_installation_change_empties_every_process_cache(self):
+        installation = self.install()
+        self.assertEqual(resolve_bot_token('T0000001'), 'xoxb-team')
+        SlackInstallation.objects.filter(id=installation.id).update(bot_token='xoxb-rotated')
+
+        # Another process saves the rotated token and bumps the shared version
+        with mock.patch.object(installation_store, '_cache_version', self.cache_version()):
+            installation_store.invalidate_bot_token('T0000001')
+        with mock.patch.object(CacheVersion, 'check_interval', 0):
+            token = resolve_bot_token('T0000001')
+
+        self.assertEqual(token, 'xoxb-rotated')
+
+    def test_token_rejected_at_send_time_is_only_forgotten_locally(self):
+        self.install()
+        resolve_bot_token('T0000001')
+        client = mock.Mock(token='xoxb-team')
+        client.chat_postMessage.side_effect = slack_error('token_revoked')
+
+        with self.assertRaises(SlackApiError):
+            services.post_slack_message('Hello', 'C0000001', client=client, team_id='T0000001')
+
+        self.assertIsNone(fakeredis.FakeRedis(server=self.redis).get(CacheVersion.key))
+        with self.assertNumQueries(1):
+            resolve_bot_token('T0000001')
+
+
+@override_settings(
+    SLACK_CHANNEL_RATE_PER_SECOND=1, SLACK_CHANNEL_BURST=1,
+    SLACK_WORKSPACE_RATE_PER_SECOND=100, SLACK_WORKSPACE_BURST=100,
+    SLACK_RATE_LIMIT_MAX_WAIT=10,
+)
+class RateLimiterTests(SchedulerTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        with mock.patch('redis.Redis.from_url', return_value=self.redis):
+            self.limiter = SlackRateLimiter('redis://fake')
+
+    def channel_tokens(self, channel):
+        keys, _ = self.limiter._buckets('chat.postMessage', 'xoxb-test', channel)
+        return float(self.redis.hget(keys[0], 'tokens'))
+
+    def test_wait_over_the_limit_is_refunded_and_raised(self):
+        waits = [self.limiter.reserve('chat.postMessage', 'xoxb-test', 'C0000001') for _ in range(11)]
+        tokens = self.channel_tokens('C0000001')
+
+        with self.assertRaises(SlackRateLimitedError) as raised:
+            self.limiter.reserve('chat.postMessage', 'xoxb-test', 'C0000001')
+
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[-1], 10, delta=0.1)
+        self.assertAlmostEqual(raised.exception.retry_after, 11, delta=0.1)
+        # The refused caller does not push back the callers already queued
+        self.assertAlmostEqual(self.channel_tokens('C0000001'), tokens, delta=0.1)
+
+    def test_retry_after_blocks_the_channel_for_every_worker(self):
+        client = mock.Mock(token='xoxb-test')
+        client.chat_postMessage.side_effect = slack_error('ratelimited', status_code=429, headers={'Retry-After': '30'})
+
+        with mock.patch('scheduler.services.get_rate_limiter', return_value=self.limiter), \
+                self.assertRaises(SlackRateLimitedError):
+            services.post_slack_message('Hello', 'C0000001', client=client)
+
+        client.chat_postMessage.assert_called_once()
+        with self.assertRaises(SlackRateLimitedError) as raised:
+            self.limiter.reserve('chat.postMessage', 'xoxb-test', 'C0000001')
+        self.assertAlmostEqual(raised.exception.retry_after, 30, delta=1)
+        self.assertEqual(self.limiter.reserve('chat.postMessage', 'xoxb-test', 'C0000002'), 0)
+
+
+@override_settings(
+    SLACK_CHANNEL_RATE_PER_SECOND=1, SLACK_WORKSPACE_RATE_PER_SECOND=10,
+    SCHEDULER_PRIORITY_WEIGHTS=[1, 4, 16], SCHEDULER_FAIR_WINDOW=20,
+)
+class FairDispatchTests(SchedulerTestCase):
+    def create_backlog(self, count, **fields):
+        start = timezone.now() - timedelta(hours=1)
+        return [
+            create_message(scheduled_time=start + timedelta(seconds=i), **fields)
+            for i in range(count)
+        ]
+
+    def test_small_workspace_is_claimed_in_the_first_batch(self):
+        self.create_backlog(50, team_id='T0000001')
+        small = create_message(team_id='T0000002')
+
+        batch = next(Dispatcher(batch_size=5, fair=True)._fair_batches(timezone.now()))
+
+        self.assertIn(small.id, [message.id for message in batch])
+        self.assertEqual(ScheduledMessage.objects.get(id=small.id).status, 'sending')
+
+    def test_priority_weights_share_of_the_order(self):
+        low = self.create_backlog(10, channel='C0000001', priority=ScheduledMessage.PRIORITY_LOW)
+        normal = self.create_backlog(10, channel='C0000002', priority=ScheduledMessage.PRIORITY_NORMAL)
+
+        ranked = rank_due_messages(window=20)
+
+        # Weights 1 and 4: the normal channel gets four sends per low one
+        low_ids = {message.id for message in low}
+        self.assertEqual(ranked[:5], [message.id for message in normal[:4]] + [low[0].id])
+        self.assertEqual(sum(message_id in low_ids for message_id in ranked[:10]), 2)
+
+    def test_window_that_cannot_be_claimed_falls_back_to_oldest_first(self):
+        taken = create_message(status='sent')
+        messages = self.create_backlog(3)
+
+        # Another dispatcher claimed the whole ranked window first
+        with mock.patch('scheduler.dispatcher.rank_due_messages', return_value=[taken.id]) as rank:
+            batches = list(Dispatcher(batch_size=5, fair=True)._fair_batches(timezone.now()))
+
+        rank.assert_called_once()
+        self.assertEqual([[message.id for message in batch] for batch in batches], [[message.id for message in messages]])
+
+
+class ChannelDirectoryTests(SchedulerTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        with mock.patch('redis.Redis.from_url', return_value=self.redis):
+            self.directory = ChannelDirectory('redis://fake')
+        self.client = mock.Mock()
+        self.client.conversations_list.side_effect = lambda cursor=None, **kwargs: {
+            None: {'channels': [{'name': 'general', 'id': 'C0000001'}], 'response_metadata': {'next_cursor': 'page2'}},
+            'page2': {'channels': [{'name': 'alerts', 'id': 'C0000002'}], 'response_metadata': {'next_cursor': ''}},
+        }[cursor]
+        for target, value in [('scheduler.channels.get_client', self.client), ('scheduler.channels.get_channel_directory', self.directory)]:
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_name_resolves_to_its_id_walking_only_as_far_as_needed(self):
+        self.assertEqual(resolve_channel('#General'), 'C0000001')
+        self.assertEqual(self.client.conversations_list.call_count, 1)
+
+        # The next miss resumes where the last walk stopped
+        self.assertEqual(resolve_channel('alerts'), 'C0000002')
+        self.assertEqual(self.client.conversations_list.call_args.kwargs['cursor'], 'page2')
+
+    def test_known_names_and_ids_do_not_call_slack(self):
+        resolve_channel('#general')
+        self.client.conversations_list.reset_mock()
+
+        self.assertEqual(resolve_channel('#general'), 'C0000001')
+        self.assertEqual(resolve_channel('C0000009'), 'C0000009')
+
+        self.client.conversations_list.assert_not_called()
+
+    def test_unknown_name_after_a_full_walk_is_rejected_without_calling_slack(self):
+        with self.assertRaises(ChannelNotFound):
+            resolve_channel('#missing')
+        self.client.conversations_list.reset_mock()
+
+        with self.assertRaises(ChannelNotFound):
+            resolve_channel('#also-missing')
+
+        self.client.conversations_list.assert_not_called()
+
+    def test_disabled_directory_keeps_the_name(self):
+        with mock.patch('scheduler.channels.get_channel_directory', return_value=None):
+            self.assertEqual(resolve_channel(' #General '), '#general')
+
+        self.client.conversations_list.assert_not_called()
+
+    def test_failing_slack_keeps_the_name_for_a_cooldown(self):
+        self.client.conversations_list.side_effect = slack_error('internal_error')
+
+        self.assertEqual(resolve_channel('#general'), '#general')
+        self.assertEqual(resolve_channel('#general'), '#general')
+
+        self.client.conversations_list.assert_called_once()
+
+    def test_unreachable_redis_keeps_the_name(self):
+        with mock.patch.object(self.redis, 'hget', side_effect=redis.ConnectionError('refused')):
+            self.assertEqual(resolve_channel('#general'), '#general')
+
+        self.client.conversations_list.assert_not_called()
+
+
+class OAuthStateStoreTests(SchedulerTestCase):
+    def setUp(self):
+        self.store = DjangoOAuthStateStore(expiration_seconds=600)
+
+    def test_state_is_consumed_exactly_once(self):
+        state = self.store.issue()
+
+        self.assertTrue(self.store.consume(state))
+        self.assertFalse(self.store.consume(state))
+        self.assertFalse(self.store.consume(''))
+
+    def test_expired_state_is_refused(self):
+        state = self.store.issue()
+        OAuthState.objects.filter(state=state).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertFalse(self.store.consume(state))
+
+    def test_purge_deletes_expired_states_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            OAuthState.objects.create(state=f'expired-{i}', expires_at=now - timedelta(minutes=i))
+        live = [self.store.issue() for _ in range(2)]
+
+        with CaptureQueriesContext(connection) as queries:
+            deleted = purge_expired_states(batch_size=2, now=now)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(sorted(OAuthState.objects.values_list('state', flat=True)), sorted(live))
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 3)
+
+
+@override_settings(SCHEDULER_IMMEDIATE_SEND_ASYNC=False)
+class MessageSendViewTests(SchedulerTestCase):
+    def send(self, message_id, post=None):
+        post = post or mock.AsyncMock(return_value={'ts': '1'})
+        with mock.patch('scheduler.async_dispatch.post_message_async', post):
+            return self.client.post(reverse('message-send', args=[message_id]))
+
+    def test_message_is_claimed_before_it_is_posted(self):
+        message = create_message()
+        seen = []
+
+        async def post(*args, **kwargs):
+            seen.append(await ScheduledMessage.objects.filter(id=message.id).values_list('status', flat=True).aget())
+            return {'ts': '1'}
+
+        response = self.send(message.id, post=post)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(seen, ['sending'])
+        row = ScheduledMessage.objects.get(id=message.id)
+        self.assertEqual(row.status, 'sent')
+        self.assertIsNone(row.claimed_by)
+
+    def test_second_send_is_a_conflict_not_a_second_post(self):
+        message = create_message()
+        post = mock.AsyncMock(return_value={'ts': '1'})
+
+        first = self.send(message.id, post=post)
+        second = self.send(message.id, post=post)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 409)
+        post.assert_awaited_once()
+        self.assertEqual(post.call_args.args, ('Hello', 'C0000001'))
+        self.assertEqual(post.call_args.kwargs['idempotency_key'], message.idempotency_key)
+
+    def test_failed_post_is_recorded(self):
+        message = create_message()
+
+        response = self.send(message.id, post=mock.AsyncMock(side_effect=slack_error('channel_not_found')))
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(ScheduledMessage.objects.get(id=message.id).status, 'failed')
+
+    def test_invalid_ids_and_bodies_are_refused(self):
+        post = mock.AsyncMock()
+        url = reverse('message-send-message')
+
+        with mock.patch('scheduler.async_dispatch.post_message_async', post):
+            responses = [
+                self.client.post(reverse('message-send', args=[999])),
+                self.client.post(url, {}, format='json'),
+                self.client.post(url, {'id': 'abc'}, format='json'),
+                self.client.post(url, {'id': 999}, format='json'),
+                self.client.post(url, [1], format='json'),
+            ]
+
+        self.assertEqual([response.status_code for response in responses], [404, 400, 404, 404, 400])
+        post.assert_not_called()
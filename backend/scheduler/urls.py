@@ -5,8 +5,15 @@ from . import views
 # Router setup for DRF viewsets
 router = DefaultRouter()
 router.register(r'messages', views.ScheduledMessageViewSet, basename='message')
+router.register(r'recurring-messages', views.RecurringMessageViewSet, basename='recurring-message')
+router.register(r'message-templates', views.MessageTemplateViewSet, basename='message-template')
 
 urlpatterns = [
+    # Immediate sends are async views, ahead of the router's messages/ routes
+    path('messages/<int:pk>/send/', views.MessageSendView.as_view(), name='message-send'),
+    path('messages/send_message/', views.MessageSendView.as_view(), name='message-send-message'),
+    path('messages/send_slack_message/', views.SlackMessageSendView.as_view(), name='message-send-slack-message'),
+    path('send-jobs/<str:job_id>/', views.SendJobView.as_view(), name='send-job'),
     path('', include(router.urls)),
     path('health/', views.health_check, name='health_check'),  # Updated health check endpoint
     path('slack/auth/', views.SlackAuthView.as_view(), name='slack_auth'),
@@ -1,15 +1,36 @@
+from urllib.parse import urlparse
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.shortcuts import redirect
-from django.http import HttpResponse, JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.utils.decorators import method_decorator
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views import View
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.core.validators import URLValidator
+from django.middleware.csrf import get_token
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from .models import ScheduledMessage
-from .serializers import ScheduledMessageSerializer
+from .async_views import AsyncAPIView
+from .message_templates import render_templates
+from .metrics import render_metrics
+from .models import BroadcastTarget, MessageTemplate, RecurringMessage, ScheduledMessage
+from .pagination import BroadcastTargetPagination, ScheduledMessagePagination
+from .parsers import NDJSONParser
+from .serializers import (
+    BroadcastTargetSerializer,
+    MessageTemplateSerializer,
+    RecurringMessageSerializer,
+    ScheduledMessageSerializer,
+)
 from .slack_auth import get_authorize_url, handle_oauth_callback
 
 # Create your views here.
@@ -22,118 +43,390 @@ def health_check(request):
     """
     return Response({"status": "ok", "message": "Service is healthy"}, status=status.HTTP_200_OK)
 
+def metrics(request):
+    """
+    Prometheus scrape endpoint
+    """
+    if not settings.SCHEDULER_METRICS_ENABLED:
+        raise Http404
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
 class ScheduledMessageViewSet(viewsets.ModelViewSet):
     """
     API endpoint for scheduled Slack messages
     """
-    queryset = ScheduledMessage.objects.all().order_by('-scheduled_time')
+    queryset = ScheduledMessage.objects.all().order_by('-scheduled_time', '-id')
     serializer_class = ScheduledMessageSerializer
+    pagination_class = ScheduledMessagePagination
+    
+    # Always loaded: the cursor is built from scheduled_time and id
+    CURSOR_FIELDS = ('id', 'scheduled_time')
     
-    @action(detail=True, methods=['post'])
-    def send(self, request, pk=None):
+    def get_requested_fields(self):
         """
-        Endpoint to send a specific scheduled message immediately
+        Parse ``?fields=id,channel,...`` on reads; None means every field
         """
-        from .services import send_slack_message
-        
-        try:
-            message = self.get_object()
-            success = send_slack_message(message.message, message.channel)
-            
-            if success:
-                # Update the message status
-                message.status = 'sent'
-                message.save()
-                return Response(
-                    {'status': 'Message sent successfully'}, 
-                    status=status.HTTP_200_OK
-                )
-            else:
-                # Update the message status
-                message.status = 'failed'
-                message.save()
-                return Response(
-                    {'error': 'Failed to send message to Slack'}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-        except Exception as e:
-            return Response(
-                {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        if self.action not in ('list', 'retrieve'):
+            return None
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        # ``channels`` is write-only; a broadcast's channels are listed under targets/
+        unknown = set(fields) - (set(ScheduledMessageSerializer.Meta.fields) - {'channels'})
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
     
-    @action(detail=False, methods=['post'])
-    def send_message(self, request):
+    def get_queryset(self):
         """
-        Endpoint to send a scheduled message immediately
+        Apply the list filters and field projection in SQL
+
+        Filters: ``status`` (comma-separated), ``channel``, ``team_id``,
+        ``scheduled_after`` and ``scheduled_before`` (ISO 8601).
         """
-        from .services import send_slack_message
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*set(fields) | set(self.CURSOR_FIELDS))
+        if self.action != 'list':
+            return queryset
         
-        message_id = request.data.get('id')
-        if not message_id:
+        params = self.request.query_params
+        if params.get('status'):
+            statuses = params['status'].split(',')
+            valid = {choice for choice, _ in ScheduledMessage.STATUS_CHOICES}
+            if set(statuses) - valid:
+                raise ValidationError({'status': f"Expected any of: {', '.join(sorted(valid))}"})
+            queryset = queryset.filter(status__in=statuses)
+        if params.get('channel'):
+            queryset = queryset.filter(channel=params['channel'])
+        if params.get('team_id'):
+            queryset = queryset.filter(team_id=params['team_id'])
+        for param, lookup in (('scheduled_after', 'scheduled_time__gte'), ('scheduled_before', 'scheduled_time__lt')):
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: 'Expected an ISO 8601 datetime'})
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Endpoint to schedule many messages in one request
+
+        Accepts a JSON array or an NDJSON stream (Content-Type:
+        application/x-ndjson) of messages. Either every message is created,
+        in one transaction, or none is and the response lists the errors of
+        each invalid item by its position in the payload.
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
             return Response(
-                {'error': 'Message ID is required'}, 
+                {'error': 'Expected a non-empty list of messages'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
-        try:
-            message = ScheduledMessage.objects.get(id=message_id)
-            success = send_slack_message(message.message, message.channel)
-            
-            if success:
-                # Update the message status
-                message.status = 'sent'
-                message.save()
-                return Response(
-                    {'status': 'Message sent successfully'}, 
-                    status=status.HTTP_200_OK
-                )
-            else:
-                # Update the message status
-                message.status = 'failed'
-                message.save()
-                return Response(
-                    {'error': 'Failed to send message to Slack'}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-        except ScheduledMessage.DoesNotExist:
+        if len(items) > settings.SCHEDULER_BULK_MAX_ITEMS:
             return Response(
-                {'error': 'Message not found'}, 
-                status=status.HTTP_404_NOT_FOUND
+                {'error': f"At most {settings.SCHEDULER_BULK_MAX_ITEMS} messages can be scheduled per request"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-    
-    @action(detail=False, methods=['post'])
-    def send_slack_message(self, request):
-        """
-        Endpoint to send a message to Slack immediately
-        """
-        from .services import send_slack_message
         
-        channel = request.data.get('channel')
-        message = request.data.get('message')
-        
-        if not channel or not message:
+        serializer = self.get_serializer(data=items, many=True)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            if isinstance(errors, dict):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
             return Response(
-                {'error': 'Both channel and message are required'}, 
+                {'errors': [{'index': index, 'errors': item_errors} for index, item_errors in enumerate(errors) if item_errors]},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Add # prefix if not already present and not an ID
-        if not channel.startswith(('#', 'C', 'D', 'G', 'U')):
-            channel = f"#{channel}"
+        # ListSerializer.save() would INSERT row by row; build the rows and insert them in chunks
+        broadcast_channels = [data.pop('channels', None) for data in serializer.validated_data]
+        messages = [ScheduledMessage(**data) for data in serializer.validated_data]
+        with transaction.atomic():
+            ScheduledMessage.objects.bulk_create(messages, batch_size=settings.SCHEDULER_BULK_CHUNK_SIZE)
+            BroadcastTarget.objects.bulk_create(
+                [
+                    BroadcastTarget(message=message, channel=channel)
+                    for message, channels in zip(messages, broadcast_channels)
+                    for channel in channels or ()
+                ],
+                batch_size=settings.SCHEDULER_BULK_CHUNK_SIZE
+            )
             
-        success = send_slack_message(message, channel)
+            # bulk_create sends no post_save, so enqueue the timed sends here
+            from .tasks import enqueue_messages_dispatch
+            due = [(message.id, message.scheduled_time, message.priority) for message in messages]
+            transaction.on_commit(lambda: enqueue_messages_dispatch(due))
         
-        if success:
+        return Response(
+            {'created': len(messages), 'ids': [message.id for message in messages]},
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=True, methods=['get'])
+    def targets(self, request, pk=None):
+        """
+        Endpoint listing a broadcast's channels and the delivery status of each
+
+        Paginated like the message list; filter with ``?status=``.
+        """
+        message = self.get_object()
+        queryset = BroadcastTarget.objects.filter(message=message)
+        if request.query_params.get('status'):
+            queryset = queryset.filter(status__in=request.query_params['status'].split(','))
+        paginator = BroadcastTargetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(BroadcastTargetSerializer(page, many=True).data)
+
+
+class RecurringMessageViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint for recurring Slack messages
+
+    Saving a rule rewrites its upcoming occurrences as scheduled messages.
+    """
+    queryset = RecurringMessage.objects.all().order_by('-id')
+    serializer_class = RecurringMessageSerializer
+
+
+class MessageTemplateViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint for message templates
+
+    Edits apply to every pending message using the template, as messages
+    are rendered when they are sent. A template still in use cannot be
+    deleted.
+    """
+    queryset = MessageTemplate.objects.all().order_by('name')
+    serializer_class = MessageTemplateSerializer
+    
+    def destroy(self, request, *args, **kwargs):
+        template = self.get_object()
+        if template.messages.exists():
             return Response(
-                {'status': 'Message sent successfully'}, 
-                status=status.HTTP_200_OK
+                {'error': 'Template is used by scheduled messages'},
+                status=status.HTTP_409_CONFLICT
             )
-        else:
-            return Response(
-                {'error': 'Failed to send message to Slack'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        return super().destroy(request, *args, **kwargs)
+
+
+def get_request_data(request):
+    """
+    Body of a JSON or form-encoded POST as a dict; raises ParseError for anything else
+    """
+    if not isinstance(request.data, dict):
+        raise ParseError('Expected a JSON object')
+    return request.data
+
+
+def is_async_send(request, data):
+    """
+    Whether an immediate send should be queued: ``?async=`` or ``"async"`` in the body, else SCHEDULER_IMMEDIATE_SEND_ASYNC
+    """
+    value = request.query_params.get('async', data.get('async'))
+    if value is None:
+        return settings.SCHEDULER_IMMEDIATE_SEND_ASYNC
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def validate_callback_url(url):
+    """
+    Error message for a callback_url that cannot be used, or None
+
+    Resolves the host (see is_callback_host_allowed), so call it off the event loop.
+    """
+    from .tasks import is_callback_host_allowed
+    
+    try:
+        URLValidator(schemes=['http', 'https'])(url)
+    except DjangoValidationError:
+        return 'callback_url must be an http(s) URL'
+    if not is_callback_host_allowed(urlparse(url).hostname):
+        return 'callback_url host is not allowed'
+    return None
+
+
+def get_slack_session(request):
+    """
+    The worker's shared aiohttp session when served over ASGI
+
+    Under WSGI each async view runs on an event loop of its own, so sends
+    get a session for the request instead (None).
+    """
+    from .async_dispatch import get_shared_session
+    
+    # A DRF Request wraps the server's request
+    request = getattr(request, '_request', request)
+    return get_shared_session() if isinstance(request, ASGIRequest) else None
+
+
+def send_outcome_response(outcome, error):
+    """
+    Response for the recorded outcome of an immediate send
+    """
+    if outcome == 'sent':
+        return Response({'status': 'Message sent successfully'}, status=status.HTTP_200_OK)
+    return Response({'error': str(error) if error else 'Failed to send message to Slack'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def send_broadcast(message):
+    """
+    Send a claimed broadcast to its pending channels now, recording each channel's outcome
+    """
+    from .dispatcher import Dispatcher
+    
+    try:
+        _, outcome, error = Dispatcher(backend='sync').dispatch_batch([message])[0]
+    finally:
+        # Runs in a pool thread, whose connection no request cycle will close
+        close_old_connections()
+    return send_outcome_response(outcome, error)
+
+
+class MessageSendView(AsyncAPIView):
+    """
+    Send a stored scheduled message immediately
+
+    Served at ``messages/<id>/send/`` and at ``messages/send_message/`` with
+    the id in the body. The handler is async (see AsyncAPIView): while
+    Slack answers, the worker serves other requests instead of blocking on
+    the call. In async mode (``?async=true``, or a ``callback_url`` in the
+    body) the send is queued on Celery instead and answered with 202 and a
+    job to poll.
+
+    The message is claimed before it is sent and its outcome recorded
+    under the claim, as the dispatcher does, so it is never posted twice
+    by a send racing a dispatcher; a message that is not pending or is
+    already being sent is answered with 409.
+    """
+    async def post(self, request, pk=None):
+        from .async_dispatch import post_message_async
+        from .dispatcher import Dispatcher
+        from .services import claim_message_now
+        from .tasks import enqueue_immediate_send
+        
+        data = get_request_data(request)
+        if pk is None:
+            pk = data.get('id')
+            if not pk:
+                return Response({'error': 'Message ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        callback_url = data.get('callback_url')
+        if callback_url:
+            error = await sync_to_async(validate_callback_url, thread_sensitive=False)(callback_url)
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            pk = int(pk)
+            if callback_url or is_async_send(request, data):
+                if not await ScheduledMessage.objects.filter(id=pk).aexists():
+                    raise ScheduledMessage.DoesNotExist
+                job_id = await sync_to_async(enqueue_immediate_send, thread_sensitive=False)(pk, callback_url)
+                if job_id is not None:
+                    status_url = request.build_absolute_uri(reverse('send-job', args=[job_id]))
+                    return Response(
+                        {'job_id': job_id, 'message_id': pk, 'status': 'queued', 'status_url': status_url},
+                        status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': status_url}
+                    )
+                # No broker: send within the request instead
+            message = await sync_to_async(claim_message_now)(pk)
+            if message is None:
+                if not await ScheduledMessage.objects.filter(id=pk).aexists():
+                    raise ScheduledMessage.DoesNotExist
+                return Response(
+                    {'error': 'Message is not pending or is already being sent'},
+                    status=status.HTTP_409_CONFLICT
+                )
+        except (ScheduledMessage.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if message.is_broadcast:
+            return await sync_to_async(send_broadcast, thread_sensitive=False)(message)
+        dispatcher = Dispatcher(backend='sync')
+        if message.template_id:
+            _, failures = await sync_to_async(render_templates)([message])
+            if failures:
+                await sync_to_async(dispatcher.record)(failures)
+                return Response({'error': str(failures[0][2])}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            await post_message_async(
+                message.message,
+                message.channel,
+                team_id=message.team_id,
+                idempotency_key=message.idempotency_key,
+                session=get_slack_session(request),
+                blocks=message.blocks
             )
+            result = (message, True, None)
+        except Exception as e:
+            result = (message, False, e)
+        _, outcome, error = (await sync_to_async(dispatcher.record)([result]))[0]
+        return send_outcome_response(outcome, error)
+
+
+class SendJobView(AsyncAPIView):
+    """
+    Status of an immediate send queued in async mode
+
+    Read from the Celery result backend, so polling never touches the
+    database. ``status`` is queued, running, then the send's outcome (sent,
+    failed or deferred, or conflict if the message could not be claimed),
+    or error if the task itself crashed.
+    """
+    async def get(self, request, job_id):
+        from .tasks import get_send_job
+        
+        try:
+            job = await sync_to_async(get_send_job, thread_sensitive=False)(job_id)
+        except Exception as e:
+            return Response({'error': f"Job status unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(job)
+
+
+class SlackMessageSendView(AsyncAPIView):
+    """
+    Send an ad-hoc message to Slack immediately, served at ``messages/send_slack_message/``
+    """
+    async def post(self, request):
+        from .async_dispatch import send_slack_message_async
+        from .channels import ChannelNotFound, resolve_channel
+        from .installation_store import SlackInstallationNotFound
+        
+        data = get_request_data(request)
+        channel = data.get('channel')
+        message = data.get('message')
+        team_id = data.get('team_id')
+        
+        if not channel or not message:
+            return Response({'error': 'Both channel and message are required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            channel = await sync_to_async(resolve_channel)(channel, team_id or '')
+        except (ChannelNotFound, SlackInstallationNotFound) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        success = await send_slack_message_async(
+            message,
+            channel,
+            team_id=team_id,
+            session=get_slack_session(request)
+        )
+        if success:
+            return Response({'status': 'Message sent successfully'}, status=status.HTTP_200_OK)
+        return Response({'error': 'Failed to send message to Slack'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class SlackAuthView(View):
@@ -158,15 +451,14 @@ class SlackAuthUrlView(View):
         """
         client_id = settings.SLACK_CLIENT_ID
         redirect_uri = request.build_absolute_uri('/api/slack/oauth-callback/')
-        scope = 'chat:write,channels:read,groups:read'
+        scope = 'chat:write,channels:read,groups:read,channels:history,groups:history'
         
         auth_url = f"https://slack.com/oauth/v2/authorize?client_id={client_id}&scope={scope}&redirect_uri={redirect_uri}"
         
         return JsonResponse({'url': auth_url})
 
 
-@method_decorator(csrf_exempt, name='dispatch')
-class SlackOAuthCallbackView(View):
+class SlackOAuthCallbackView(APIView):
     """
     View for handling Slack OAuth callback
     """
@@ -199,8 +491,7 @@ class SlackAuthErrorView(View):
         return HttpResponse("<h1>Slack Authentication Failed</h1><p>There was an error authenticating with Slack. Please try again.</p>")
 
 
-@method_decorator(csrf_exempt, name='dispatch')
-class SlackTestMessageView(View):
+class SlackTestMessageView(APIView):
     """
     View for testing Slack message sending
     """
@@ -217,6 +508,7 @@ class SlackTestMessageView(View):
             <p>Make sure your bot is invited to the channel before sending a message.</p>
             <p><strong>Slack Bot Token:</strong> {token_status}</p>
             <form method="post" action="">
+                <input type="hidden" name="csrfmiddlewaretoken" value="{get_token(request)}">
                 <div style="margin-bottom: 15px;">
                     <label for="channel">Channel:</label>
                     <input type="text" id="channel" name="channel" value="general" required style="margin-left: 10px;">
@@ -238,23 +530,21 @@ class SlackTestMessageView(View):
         """
         Send a test message to Slack
         """
-        from slack_sdk import WebClient
         from slack_sdk.errors import SlackApiError
+        from .channels import ChannelNotFound, resolve_channel
+        from .services import get_slack_client
         
-        channel = request.POST.get('channel', 'general')
-        # Add # prefix if not already present and not an ID
-        if not channel.startswith(('#', 'C', 'D', 'G', 'U')):
-            channel = f"#{channel}"
-            
-        message = request.POST.get('message', 'Hello from Slack Scheduler!')
+        channel = request.data.get('channel', 'general')
+        message = request.data.get('message', 'Hello from Slack Scheduler!')
         
         # Try to get detailed error information
         try:
-            client = WebClient(token=settings.SLACK_BOT_TOKEN)
+            channel = resolve_channel(channel)
+            client = get_slack_client()
             client.chat_postMessage(channel=channel, text=message)
             success = True
             error_detail = None
-        except SlackApiError as e:
+        except (SlackApiError, ChannelNotFound) as e:
             success = False
             error_detail = str(e)
         except Exception as e:
@@ -2,6 +2,7 @@
 """
 Scheduler runner script for processing scheduled messages.
 This script runs as a separate process and periodically checks for scheduled messages that are due to be sent.
+With event-driven dispatch enabled it acts as a low-frequency sweeper behind the timed Celery send tasks.
 """
 import os
 import time
@@ -28,10 +29,20 @@ def main():
     django.setup()
     
     # Import Django models after setting up the environment
-    from scheduler.models import ScheduledMessage
-    from scheduler.services import send_slack_message
+    from scheduler.dispatcher import Dispatcher
+    from scheduler.metrics import start_metrics_server
+    from scheduler.recurrence import materialize_recurring_messages
+    from scheduler.tasks import enqueue_upcoming_messages
+    from django.conf import settings
     from django.utils import timezone
     
+    # Batch size, backend and concurrency come from the SCHEDULER_* settings
+    dispatcher = Dispatcher()
+    
+    # Expose dispatcher metrics on SCHEDULER_METRICS_PORT, if set
+    if start_metrics_server():
+        logger.info(f"Serving metrics on port {settings.SCHEDULER_METRICS_PORT}")
+    
     # Wait for the web server to start up
     logger.info("Waiting 60 seconds for web server to start...")
     time.sleep(60)
@@ -41,44 +52,32 @@ def main():
         current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         logger.info(f"Running scheduled tasks at {current_time}")
         
+        try:
+            # Write upcoming occurrences of recurring messages before dispatching
+            materialize_recurring_messages()
+        except Exception as e:
+            logger.error(f"Error materializing recurring messages: {e}")
+        
         try:
             # Process scheduled messages directly without using the management command
             now = timezone.now()
             logger.info(f"Checking for messages due before {now}")
-            
-            # Get all pending messages that are due
-            due_messages = ScheduledMessage.objects.filter(
-                status='pending',
-                scheduled_time__lte=now
-            )
-            
-            logger.info(f"Found {due_messages.count()} messages to process")
-            
-            for message in due_messages:
-                logger.info(f"Processing message {message.id} to channel {message.channel}")
-                
-                try:
-                    success = send_slack_message(message.message, message.channel)
-                    
-                    if success:
-                        message.status = 'sent'
-                        message.save()
-                        logger.info(f"Successfully sent message {message.id}")
-                    else:
-                        message.status = 'failed'
-                        message.save()
-                        logger.error(f"Failed to send message {message.id}")
-                except Exception as e:
-                    message.status = 'failed'
-                    message.save()
-                    logger.error(f"Error processing message {message.id}: {str(e)}")
+            dispatcher.run(now=now)
             
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
         
-        # Wait for the next minute
-        logger.info("Waiting 60 seconds for next run...")
-        time.sleep(60)
+        try:
+            # Hand messages coming due soon to the timed send tasks
+            enqueued = enqueue_upcoming_messages()
+            if enqueued:
+                logger.info(f"Enqueued {enqueued} upcoming messages for timed dispatch")
+        except Exception as e:
+            logger.error(f"Error enqueuing upcoming messages: {e}")
+        
+        # Wait for the next sweep; timed send tasks handle messages in between
+        logger.info(f"Waiting {settings.SCHEDULER_SWEEP_INTERVAL} seconds for next run...")
+        time.sleep(settings.SCHEDULER_SWEEP_INTERVAL)
 
 if __name__ == "__main__":
     main()
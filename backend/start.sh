@@ -31,12 +31,24 @@ if [ "$TABLE_EXISTS" -eq 0 ]; then
     python manage.py migrate scheduler
 fi
 
+# Multiprocess metrics files from a previous run must not be aggregated into this one
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Start Django server
 echo "Starting Django server..."
-python manage.py runserver 0.0.0.0:$PORT
+if [ "$WEB_SERVER" = "uvicorn" ]; then
+    # ASGI: the immediate-send endpoints await Slack without holding a worker
+    python -m uvicorn core.asgi:application --host 0.0.0.0 --port $PORT --lifespan off
+else
+    python manage.py runserver 0.0.0.0:$PORT
+fi
 
 # Note: Celery worker and beat processes are started separately by Railway
 # based on the Procfile configuration:
 # worker: celery -A core worker --loglevel=info
+# immediate: celery -A core worker -Q immediate --loglevel=info
 # beat: celery -A core beat --loglevel=info
 # scheduler: python scheduler_runner.py
\ No newline at end of file
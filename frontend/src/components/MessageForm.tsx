@@ -16,6 +16,7 @@ const MessageForm: React.FC<MessageFormProps> = ({
   const [message, setMessage] = useState<string>('');
   const [channel, setChannel] = useState<string>('');
   const [scheduledTime, setScheduledTime] = useState<string>('');
+  const [priority, setPriority] = useState<number>(1);
   const [loading, setLoading] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
 
@@ -23,6 +24,7 @@ const MessageForm: React.FC<MessageFormProps> = ({
     if (initialMessage) {
       setMessage(initialMessage.message);
       setChannel(initialMessage.channel);
+      setPriority(initialMessage.priority ?? 1);
       // Format the date-time for the input
       if (initialMessage.scheduled_time) {
         const date = new Date(initialMessage.scheduled_time);
@@ -37,10 +39,14 @@ const MessageForm: React.FC<MessageFormProps> = ({
     setError(null);
 
     try {
+      // Several comma-separated channels schedule one broadcast to all of them
+      const channels = channel.split(',').map((name) => name.trim()).filter(Boolean);
       const messageData: ScheduledMessage = {
         message,
-        channel,
+        channel: channels.length === 1 ? channels[0] : '',
+        ...(channels.length > 1 && { channels }),
         scheduled_time: new Date(scheduledTime).toISOString(),
+        priority,
       };
 
       if (isEditing && initialMessage?.id) {
@@ -80,9 +86,9 @@ const MessageForm: React.FC<MessageFormProps> = ({
             id="channel"
             value={channel}
             onChange={(e) => setChannel(e.target.value)}
-            required
+            required={!initialMessage?.is_broadcast}
             className="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm"
-            placeholder="#general"
+            placeholder={initialMessage?.is_broadcast ? 'Leave blank to keep the broadcast channels' : '#general, or #general, #random to broadcast'}
           />
         </div>
 
@@ -115,6 +121,22 @@ const MessageForm: React.FC<MessageFormProps> = ({
           />
         </div>
 
+        <div>
+          <label htmlFor="priority" className="block text-sm font-medium text-gray-700">
+            Priority
+          </label>
+          <select
+            id="priority"
+            value={priority}
+            onChange={(e) => setPriority(Number(e.target.value))}
+            className="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-indigo-500 focus:ring-indigo-500 sm:text-sm"
+          >
+            <option value={2}>High</option>
+            <option value={1}>Normal</option>
+            <option value={0}>Low (bulk)</option>
+          </select>
+        </div>
+
         <div className="flex justify-end space-x-3">
           <button
             type="button"
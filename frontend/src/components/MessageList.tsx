@@ -4,16 +4,21 @@ import { format } from 'date-fns';
 import { ScheduledMessage } from '../types';
 import { messageService } from '../services/api';
 
+// Only the columns the table shows are fetched
+const LIST_FIELDS = ['id', 'channel', 'is_broadcast', 'message', 'scheduled_time', 'status'];
+
 const MessageList: React.FC = () => {
   const [messages, setMessages] = useState<ScheduledMessage[]>([]);
+  const [nextPage, setNextPage] = useState<string | null>(null);
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
 
   const fetchMessages = async () => {
     try {
       setLoading(true);
-      const data = await messageService.getMessages();
-      setMessages(data);
+      const page = await messageService.getMessages(null, LIST_FIELDS);
+      setMessages(page.results);
+      setNextPage(page.next);
       setError(null);
     } catch (err) {
       console.error('Error fetching messages:', err);
@@ -23,6 +28,17 @@ const MessageList: React.FC = () => {
     }
   };
 
+  const fetchMoreMessages = async () => {
+    try {
+      const page = await messageService.getMessages(nextPage);
+      setMessages((current) => [...current, ...page.results]);
+      setNextPage(page.next);
+    } catch (err) {
+      console.error('Error fetching messages:', err);
+      setError('Failed to load messages. Please try again.');
+    }
+  };
+
   useEffect(() => {
     fetchMessages();
   }, []);
@@ -57,6 +73,8 @@ const MessageList: React.FC = () => {
         return 'bg-green-100 text-green-800';
       case 'failed':
         return 'bg-red-100 text-red-800';
+      case 'sending':
+        return 'bg-blue-100 text-blue-800';
       default:
         return 'bg-yellow-100 text-yellow-800';
     }
@@ -131,7 +149,7 @@ const MessageList: React.FC = () => {
             {messages.map((msg) => (
               <tr key={msg.id}>
                 <td className="px-6 py-4 whitespace-nowrap text-sm font-medium text-gray-900">
-                  {msg.channel}
+                  {msg.is_broadcast ? 'Broadcast' : msg.channel}
                 </td>
                 <td className="px-6 py-4 text-sm text-gray-500">
                   {msg.message.length > 50 ? `${msg.message.substring(0, 50)}...` : msg.message}
@@ -175,6 +193,17 @@ const MessageList: React.FC = () => {
           </tbody>
         </table>
       </div>
+
+      {nextPage && (
+        <div className="text-center mt-4">
+          <button
+            onClick={fetchMoreMessages}
+            className="text-sm text-indigo-600 hover:text-indigo-900"
+          >
+            Load More
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { ScheduledMessage } from '../types';
+import { Page, ScheduledMessage } from '../types';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
@@ -18,8 +18,11 @@ const api = axios.create({
 // CORS headers must only be set by the server, not the client
 
 export const messageService = {
-  getMessages: async (): Promise<ScheduledMessage[]> => {
-    const response = await api.get('/messages/');
+  // Pass the previous page's `next` URL to fetch the following page
+  getMessages: async (next?: string | null, fields?: string[]): Promise<Page<ScheduledMessage>> => {
+    const response = next
+      ? await api.get(next)
+      : await api.get('/messages/', { params: fields ? { fields: fields.join(',') } : {} });
     return response.data;
   },
   
@@ -3,13 +3,31 @@
 export interface ScheduledMessage {
   id?: number;
   message: string;
+  // A template id, with the values of its {{ variables }}, instead of message
+  template?: number | null;
+  variables?: Record<string, string>;
   channel: string;
+  channels?: string[];
+  is_broadcast?: boolean;
+  team_id?: string;
   scheduled_time: string;
+  // 0 low (bulk campaigns), 1 normal, 2 high (urgent)
+  priority?: number;
   status?: string;
+  attempts?: number;
+  next_attempt_at?: string | null;
+  last_error?: string;
+  idempotency_key?: string;
   created_at?: string;
   updated_at?: string;
 }
 
+export interface Page<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
+
 export interface ApiResponse<T> {
   data: T;
   status: number;